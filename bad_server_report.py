@@ -1,9 +0,0 @@
-# Manual mangadex report tool
-
-import requests
-
-https://uploads.mangadex.org/at-home/server/7f4f1092-52e5-44db-a897-3459abaad354
-
-requests.post(
-    "url",
-)
\ No newline at end of file
@@ -0,0 +1,194 @@
+# End-to-end benchmark. Starts the fake Mangadex of fake_mangadex.py in its own process (so it doesn't compete with
+# Caravel for the GIL), points Caravel at it, and runs the real batch pipeline on every series of the fake library:
+# series and feed lookups, MD@Home pages, covers, conversion and the push to Calibre, with stand-ins for kcc-c2e and
+# calibredb. It reports pages per second, page latency, requests per endpoint and rate limit violations, and can
+# compare against a previous report to catch throughput regressions.
+# Usage: "python benchmark.py [--series 4 --pages 30 --slow-nodes 1 ...] [--parallel 4] [--json report.json] [--baseline old.json]"
+# Everything is written to a temporary working directory, nothing touches the real cache, journal or library.
+
+import argparse
+import contextlib
+import json
+import os
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from caravel import settings
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# * Stand-ins for the real tools. KCC names its output after the input, then the profile makes it a .kepub.epub
+KCC_STUB = '''import os, sys, zipfile
+source = sys.argv[-1]
+output = (source[:-4] if source.endswith(".cbz") else source) + ".kepub.epub"
+with zipfile.ZipFile(output, "w") as epub:
+    epub.writestr("mimetype", "application/epub+zip")
+print("Benchmark kcc-c2e:", source)
+'''
+CALIBREDB_STUB = '''import os, sys
+books = [arg for arg in sys.argv[1:] if arg.endswith(".epub")]
+counter = os.path.join(os.path.dirname(os.path.abspath(__file__)), "calibre_ids")
+first = int(open(counter).read()) if os.path.exists(counter) else 1
+open(counter, "w").write(str(first + len(books)))
+print("Added book ids: " + ", ".join(str(first + index) for index in range(len(books))))
+'''
+
+
+def write_stub(folder: str, name: str, source: str) -> str:
+    """Writes a stand-in tool as a Python script with a launcher that can be run directly. Returns its path."""
+    script = os.path.join(folder, name + "_stub.py")
+    with open(script, "w", encoding="utf-8") as file:
+        file.write(source)
+    if os.name == "nt":
+        launcher = os.path.join(folder, name + ".cmd")
+        with open(launcher, "w", encoding="utf-8") as file:
+            file.write(f'@"{sys.executable}" "{script}" %*\n')
+    else:
+        launcher = os.path.join(folder, name)
+        with open(launcher, "w", encoding="utf-8") as file:
+            file.write(f'#!/bin/sh\nexec "{sys.executable}" "{script}" "$@"\n')
+        os.chmod(launcher, os.stat(launcher).st_mode | stat.S_IEXEC)
+    return launcher
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(round(fraction * (len(values) - 1))), len(values) - 1)]
+
+
+def start_fake(config: dict, folder: str) -> tuple:
+    """Starts fake_mangadex.py in another process. Returns (process, URLs of its servers)."""
+    config_path = os.path.join(folder, "fake_config.json")
+    with open(config_path, "w", encoding="utf-8") as file:
+        json.dump(config, file)
+    process = subprocess.Popen([sys.executable, os.path.join(HERE, "fake_mangadex.py"), config_path], stdout=subprocess.PIPE, text=True)
+    urls = json.loads(process.stdout.readline())
+    return process, urls
+
+
+def run_benchmark(config: dict, converter: str = None, preprocess: bool = False, verbose: bool = False, parallel: int = 1) -> dict:
+    """Runs the whole pipeline against a fresh fake Mangadex.
+
+    Args:
+        config (dict): Configuration of the fake, see fake_mangadex.DEFAULT_CONFIG. Missing keys use the defaults.
+        converter (str, optional): 'kcc' or 'native'. Defaults to the converter setting.
+        preprocess (bool, optional): Turn on preprocess_pages. Defaults to False.
+        verbose (bool, optional): Show what the pipeline prints. Defaults to False.
+        parallel (int, optional): How many series run at the same time. Defaults to 1.
+
+    Returns:
+        dict: The report: {"config", "duration", "pages" (written to disk), "pages_per_second", "megabytes", "page_latency":
+        {"p50", "p99"} (seconds per page request, measured by the nodes), "requests": {endpoint: count}, "rate_limit_violations", "injected_429",
+        "node_errors", "reports", "jobs", "failed_jobs", "parallel"}
+    """
+    with tempfile.TemporaryDirectory(prefix="caravel-benchmark-") as folder:
+        process, urls = start_fake(config, folder)
+        try:
+            # * Before importing anything from Caravel, every module reads its settings once when imported
+            settings.working_dir = folder
+            settings.api_url, settings.uploads_url, settings.report_url = urls["api"], urls["uploads"], urls["report"]
+            settings.kcc_path = write_stub(folder, "kcc-c2e", KCC_STUB)
+            settings.calibre_path = write_stub(folder, "calibredb", CALIBREDB_STUB)
+            settings.use_calibre, settings.calibre_library = True, ''
+            settings.offline = False
+            settings.preprocess_pages = preprocess
+            if converter is not None:
+                settings.converter = converter
+
+            from caravel import batch
+            from caravel.preprocess import get_pool
+            jobs = [{"mdid": mdid, "volumes": "all", "profile": settings.ereader_profile,
+                     "preferred_groups": settings.preferred_groups, "excluded_groups": settings.excluded_groups} for mdid in urls["series"]]
+            if preprocess:
+                get_pool() # * Before any thread starts, see preprocess.get_pool()
+            output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(open(os.devnull, "w"))
+            with output:
+                time_start = time.perf_counter()
+                try:
+                    summary = batch.run_jobs(jobs, settings.converter, parallel)
+                    duration = time.perf_counter() - time_start
+                    pages = sum(row["downloaded"] for row in batch.get_journal().status())
+                finally:
+                    batch.shutdown()
+            with urllib.request.urlopen(urls["api"] + "/__stats") as response:
+                stats = json.load(response)
+        finally:
+            process.terminate()
+            process.wait()
+
+    nodes = stats["nodes"]
+    requests = {}
+    for server in ("api", "uploads", "nodes", "report"):
+        for endpoint, count in stats[server]["requests"].items():
+            requests[endpoint] = requests.get(endpoint, 0) + count
+    return {
+        "config": config,
+        "duration": round(duration, 3),
+        "pages": pages,
+        "pages_per_second": round(pages / duration, 2) if duration > 0 else 0.0,
+        "megabytes": round(nodes["bytes"] / 1024 / 1024, 2),
+        "page_latency": {"p50": round(percentile(nodes["page_latencies"], 0.5), 4), "p99": round(percentile(nodes["page_latencies"], 0.99), 4)},
+        "requests": requests,
+        "rate_limit_violations": stats["api"]["rate_limited"],
+        "injected_429": stats["api"]["injected_429"],
+        "node_errors": sum(count for status, count in nodes["statuses"].items() if status.startswith("5")),
+        "reports": stats["report"]["reports"],
+        "jobs": summary["jobs"],
+        "failed_jobs": summary["failed"],
+        "parallel": parallel
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['pages']} pages ({report['megabytes']} MB) in {report['duration']} s: {report['pages_per_second']} pages/s")
+    print(f"Page latency: p50 {report['page_latency']['p50'] * 1000:.0f} ms, p99 {report['page_latency']['p99'] * 1000:.0f} ms")
+    print(f"Rate limit violations: {report['rate_limit_violations']}, injected 429s: {report['injected_429']}, node errors: {report['node_errors']}")
+    print(f"Jobs: {report['jobs']}, failed: {report['failed_jobs']}, MD@Home reports: {report['reports']}")
+    print("Requests:")
+    for endpoint, count in sorted(report["requests"].items()):
+        print(f"  {endpoint}: {count}")
+
+
+def main(argv: list = None) -> int:
+    from fake_mangadex import DEFAULT_CONFIG
+    parser = argparse.ArgumentParser(description="Benchmark the whole pipeline against a local fake Mangadex.")
+    for key, default in DEFAULT_CONFIG.items():
+        if isinstance(default, list):
+            continue
+        parser.add_argument("--" + key.replace("_", "-"), type=type(default), default=default)
+    parser.add_argument("--converter", choices=["kcc", "native"], help="Defaults to the converter setting")
+    parser.add_argument("--preprocess", action="store_true", help="Turn on preprocess_pages")
+    parser.add_argument("--parallel", type=int, default=1, help="How many series run at the same time. Default: 1")
+    parser.add_argument("--verbose", action="store_true", help="Show what the pipeline prints")
+    parser.add_argument("--json", help="Write the report to this file")
+    parser.add_argument("--baseline", help="Report of a previous run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="How much slower than the baseline is still fine. Default: 0.1 (10%%)")
+    args = parser.parse_args(argv)
+    config = {key: getattr(args, key) for key in DEFAULT_CONFIG if not isinstance(DEFAULT_CONFIG[key], list)}
+
+    report = run_benchmark(config, args.converter, args.preprocess, args.verbose, args.parallel)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+    failed = report["rate_limit_violations"] > 0 or report["failed_jobs"] > 0
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+        floor = baseline["pages_per_second"] * (1 - args.tolerance)
+        print(f"Baseline: {baseline['pages_per_second']} pages/s, this run: {report['pages_per_second']} pages/s")
+        if report["pages_per_second"] < floor:
+            print(f"Regression: slower than {floor:.2f} pages/s")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
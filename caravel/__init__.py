@@ -0,0 +1,18 @@
+# Caravel: downloads manga from Mangadex, converts the volumes to EPUB and adds them to Calibre.
+# The public API (see api.py) is loaded on first use, so importing the package, or running "caravel --help", doesn't
+# pull in requests, aiohttp or Pillow. Usage: "from caravel import search, resolve_feed, run, Pipeline".
+
+__version__ = "0.1.0"
+
+__all__ = ["search", "resolve_feed", "download_volumes", "convert", "push", "run", "Pipeline", "run_all", "shutdown"]
+
+
+def __getattr__(name: str):
+    if name in __all__:
+        from . import api
+        return getattr(api, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> list:
+    return sorted(list(globals()) + __all__)
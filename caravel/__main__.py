@@ -0,0 +1,7 @@
+# "python -m caravel", same as the caravel command.
+
+import sys
+
+from .cli import main
+
+sys.exit(main())
@@ -0,0 +1,239 @@
+# Public API. The steps of a run as plain functions, to use Caravel from another program (ie a scheduler) instead of
+# the command line: search, resolve the chapter feed of a series, download volumes, convert them, push them, or all of
+# it at once with run(). Nothing here prompts. Everything goes through the same HTTP client, rate limiter, API cache
+# and journal as the command line, so steps that were already done are skipped. Call shutdown() once done.
+# To run several series at the same time (ie a sync of the whole library), make a Pipeline per series and start them,
+# or give them to run_all(). They share the HTTP client, the rate limiter, the caches, the download engine and the
+# conversion workers, and get pages and conversions in proportion to their weight (see fair_queue.py).
+# Import from the package: "from caravel import resolve_feed, run, Pipeline".
+
+import concurrent.futures
+import threading
+import time
+
+from . import pipeline
+from .func import chapter_request_and_files, mangadex_titles_request, parse_volume_ranges, series_request
+from .journal import get_journal
+from .preprocess import get_pool
+from .push_to_calibre import push_books
+from .settings import converter as default_converter, ereader_profile, excluded_groups, parallel_series, preferred_groups, preprocess_pages
+
+
+def search(title: str) -> list:
+    """Searches Mangadex for a title.
+
+    Returns:
+        list: One dict per result: {"mdid", "title", "authors": list of names, "main_cover_filename", "url"}
+    """
+    results = mangadex_titles_request(title) # ! API request
+    return [{"mdid": mdid, "title": found, "authors": authors, "main_cover_filename": cover, "url": url} for mdid, found, authors, cover, url in
+            zip(results["ids_results"], results["titles_results"], results["contributor_names"], results["main_cover_filename"], results["mangadex_links"])]
+
+
+def resolve_feed(mdid: str, preferred: list = preferred_groups, excluded: list = excluded_groups) -> dict:
+    """Looks up a series and sorts its chapters into volumes, one upload per chapter (see func.select_uploads()).
+
+    Args:
+        mdid (str): Mangadex ID of the series.
+        preferred (list, optional): Scanlation groups to prefer. Defaults to the preferred_groups setting.
+        excluded (list, optional): Scanlation groups to skip. Defaults to the excluded_groups setting.
+
+    Returns:
+        dict: {"info": see func.series_request(), "pseudo_file_structure": dict, "volumes": volumes Mangadex has, in
+        order}. This is the "feed" the other functions take.
+    """
+    info = series_request(mdid) # ! API request
+    pseudo_file_structure = chapter_request_and_files(mdid, info["clean_title"], preferred, excluded)["pseudo_file_structure"] # ! API request
+    return {"info": info, "pseudo_file_structure": pseudo_file_structure, "volumes": pipeline.pick_volumes(pseudo_file_structure, info["clean_title"])[0]}
+
+
+def _volumes(feed: dict, volumes) -> list:
+    # * "all", "1-5,7" or a list of volume numbers, volumes Mangadex doesn't have are left out
+    if isinstance(volumes, str) and volumes.strip().lower() != "all":
+        volumes = parse_volume_ranges(volumes)
+    return pipeline.pick_volumes(feed["pseudo_file_structure"], feed["info"]["clean_title"], "all" if isinstance(volumes, str) else volumes)[0]
+
+
+def _series(feed: dict, volumes: list, profile: str) -> dict:
+    series = pipeline.series_context(feed["info"], feed["pseudo_file_structure"], volumes, profile)
+    get_journal().add_series(series, [pipeline.volume_key(volume) for volume in volumes])
+    return series
+
+
+def download_volumes(feed: dict, volumes="all", profile: str = ereader_profile) -> dict:
+    """Downloads the pages of volumes (and their covers), without converting them.
+
+    Args:
+        feed (dict): See resolve_feed().
+        volumes (optional): "all", a selection like "1-5,7", or a list of volume numbers. Defaults to "all".
+        profile (str, optional): KCC profile of the device. Defaults to the ereader_profile setting.
+
+    Returns:
+        dict: {volume: list of failed page results, empty if every page is on disk}
+    """
+    from .page_downloader import download_pages # * Not at the top, importing aiohttp would slow down every import of the API
+
+    volumes = _volumes(feed, volumes)
+    series = _series(feed, volumes, profile)
+    failed = {}
+    for volume in volumes:
+        page_results = download_pages(pipeline.prepare_volume(series, volume))
+        pipeline.record_pages(series, volume, page_results)
+        failed[pipeline.volume_key(volume)] = [result for result in page_results if not result["success"]]
+    return failed
+
+
+def convert(feed: dict, volume, converter: str = default_converter, profile: str = ereader_profile) -> dict:
+    """Converts a downloaded volume to EPUB, unless it already was.
+
+    Returns:
+        dict: {"success": bool, "full_path": path of the EPUB, "error": str}, see kcc_conversion.img_dir_to_epub().
+    """
+    series = _series(feed, [volume], profile)
+    result = pipeline.convert_volume(series, volume, converter).result()
+    if result["success"]:
+        get_journal().set_volume_state(series["mdid"], pipeline.volume_key(volume), "converted", result["full_path"])
+    return result
+
+
+def push(feed: dict, volumes, profile: str = ereader_profile) -> dict:
+    """Adds converted volumes to Calibre with their metadata and cover, with one calibredb call.
+
+    Returns:
+        dict: {volume: {"success": bool, "book id": int or None, "error": str}}, see push_to_calibre.push_books().
+    """
+    volumes = _volumes(feed, volumes)
+    series = _series(feed, volumes, profile)
+    results = {}
+    for volume, result in zip(volumes, push_books([pipeline.calibre_book(series, volume) for volume in volumes])):
+        if result["success"]:
+            get_journal().set_volume_state(series["mdid"], pipeline.volume_key(volume), "pushed", book_id=result["book id"])
+        results[pipeline.volume_key(volume)] = result
+    return results
+
+
+def run(mdid: str, volumes="all", profile: str = ereader_profile, converter: str = default_converter,
+        preferred: list = preferred_groups, excluded: list = excluded_groups, weight: float = 1.0) -> dict:
+    """Downloads, converts and pushes volumes of a series, with the stages overlapping (see pipeline.py). What
+    "caravel batch" does for each job. weight only matters when other series run at the same time, see Pipeline.
+
+    Returns:
+        dict: See pipeline.run_pipeline().
+    """
+    feed = resolve_feed(mdid, preferred, excluded)
+    return pipeline.run_series(feed["info"], feed["pseudo_file_structure"], _volumes(feed, volumes), profile, converter, weight)
+
+
+class Pipeline:
+    """One series to download, convert and push, that can run at the same time as others. Nothing is shared between
+    instances but what every run shares anyway (HTTP client, rate limiter, caches, download engine, conversion workers,
+    journal), so any number of them can run in one process. Two pipelines of the same series run one after the other.
+
+    Usage:
+        pipelines = [Pipeline(mdid) for mdid in library]
+        for series in pipelines:
+            series.start()
+        results = [series.result() for series in pipelines]
+
+    Attributes:
+        feed (dict): See resolve_feed(), once resolved.
+        results (dict): See pipeline.run_pipeline(), once done.
+        error (Exception): What stopped the run, None if it finished.
+        duration (float): Seconds the run took, once done.
+    """
+
+    def __init__(self, mdid: str, volumes="all", profile: str = ereader_profile, converter: str = default_converter,
+                 preferred: list = preferred_groups, excluded: list = excluded_groups, weight: float = 1.0):
+        """
+        Args:
+            mdid (str): Mangadex ID of the series.
+            volumes (optional): "all", a selection like "1-5,7", or a list of volume numbers. Defaults to "all".
+            profile (str, optional): KCC profile of the device. Defaults to the ereader_profile setting.
+            converter (str, optional): 'kcc' or 'native'. Defaults to the converter setting.
+            preferred (list, optional): Scanlation groups to prefer. Defaults to the preferred_groups setting.
+            excluded (list, optional): Scanlation groups to skip. Defaults to the excluded_groups setting.
+            weight (float, optional): Share of the downloads and conversions against the other series running at the
+            same time: a series with weight 2 gets twice as many pages as a series with weight 1. Defaults to 1.0.
+        """
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        self.mdid = mdid
+        self.volumes = volumes
+        self.profile = profile
+        self.converter = converter
+        self.preferred = preferred
+        self.excluded = excluded
+        self.weight = weight
+        self.feed = None
+        self.results = None
+        self.error = None
+        self.duration = None
+        self.thread = None
+        self.finished = threading.Event()
+
+    def run(self) -> dict:
+        """Runs the series in the calling thread. Returns the results, see pipeline.run_pipeline(), and raises what
+        stopped the run."""
+        time_start = time.perf_counter()
+        try:
+            self.feed = resolve_feed(self.mdid, self.preferred, self.excluded)
+            self.results = pipeline.run_series(self.feed["info"], self.feed["pseudo_file_structure"], _volumes(self.feed, self.volumes),
+                                               self.profile, self.converter, self.weight)
+            return self.results
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            self.duration = time.perf_counter() - time_start
+            self.finished.set()
+
+    def start(self) -> "Pipeline":
+        """Runs the series in a thread of its own. Returns the pipeline, see result()."""
+        if self.thread is not None:
+            raise RuntimeError("Pipeline of " + self.mdid + " was already started")
+        if preprocess_pages:
+            get_pool() # * Before the thread starts, see preprocess.get_pool()
+        self.thread = threading.Thread(target=self._run_quietly, name="pipeline-" + self.mdid[:8], daemon=True)
+        self.thread.start()
+        return self
+
+    def _run_quietly(self) -> None:
+        try:
+            self.run()
+        except Exception:
+            pass # * Kept in self.error, result() raises it
+
+    def done(self) -> bool:
+        return self.finished.is_set()
+
+    def result(self, timeout: float = None) -> dict:
+        """Waits for a started pipeline and returns its results, or raises what stopped it. Raises TimeoutError if it
+        isn't done after timeout seconds."""
+        if not self.finished.wait(timeout):
+            raise TimeoutError("Pipeline of " + self.mdid + " is still running")
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+
+def run_all(pipelines: list, parallel: int = parallel_series) -> list:
+    """Runs pipelines, parallel of them at the same time, starting them in order. A pipeline that fails doesn't stop
+    the others, check its error attribute.
+
+    Args:
+        pipelines (list): Pipeline objects that weren't started.
+        parallel (int, optional): How many run at the same time. Defaults to the parallel_series setting.
+
+    Returns:
+        list: The pipelines, in the same order, all done.
+    """
+    if preprocess_pages:
+        get_pool() # * Before the threads start, see preprocess.get_pool()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(parallel, 1), thread_name_prefix="pipeline") as executor:
+        list(executor.map(lambda series: series._run_quietly(), pipelines))
+    return pipelines
+
+
+def shutdown() -> None:
+    """Stops the download engine and the worker pools, sends the remaining MD@Home reports and writes the metrics."""
+    pipeline.shutdown()
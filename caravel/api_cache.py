@@ -0,0 +1,166 @@
+# Persistent cache for Mangadex API responses. Responses are stored gzipped under the working directory, keyed by
+# endpoint and parameters, and expire after a time that depends on the kind of endpoint (a search goes stale quickly,
+# an author's name doesn't). The cache is size bounded and drops the least recently used responses first.
+# In offline mode, anything in the cache is served whatever its age and nothing is requested from the network.
+
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .settings import api_cache_max_size, api_cache_ttl, offline, use_api_cache, working_dir
+
+
+class CacheMiss(Exception):
+    """Raised in offline mode when a request is not in the cache."""
+
+
+class ApiCache:
+    """The cache itself. Every entry is one "<key>.json.gz" file in the cache folder. Files are touched when they are
+    read, so their modification time doubles as the "last used" time for eviction.
+    """
+
+    def __init__(self, folder: str, max_size: int = api_cache_max_size, ttl: dict = api_cache_ttl, offline: bool = offline):
+        self.folder = folder
+        self.max_size = max_size
+        self.ttl = ttl
+        self.offline = offline
+        self.index = None # * key -> [size, last used], loaded on first use so startup doesn't scan the folder
+        self.size = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def endpoint_class(url: str) -> str:
+        """Sorts an API URL into the classes used for TTLs: "search", "feed", "author", "cover", "at-home" or "other"."""
+        path = urlsplit(url).path.rstrip("/")
+        if path == "/manga":
+            return "search"
+        if path.startswith("/manga/") and path.endswith("/feed"):
+            return "feed"
+        if path.startswith("/author"):
+            return "author"
+        if path.startswith("/cover"):
+            return "cover"
+        if path.startswith("/at-home/server"):
+            return "at-home"
+        return "other"
+
+    @staticmethod
+    def key(url: str, params=None) -> str:
+        """Builds the cache key of a request from its URL and its parameters, in a stable order."""
+        if isinstance(params, dict):
+            params = sorted((str(name), value if isinstance(value, list) else [value]) for name, value in params.items())
+        raw = json.dumps([url, params], sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key[:2], key + ".json.gz")
+
+    def _load_index(self) -> None:
+        self.index = {}
+        self.size = 0
+        if not os.path.isdir(self.folder):
+            return
+        for root, _, files in os.walk(self.folder):
+            for name in files:
+                if name.endswith(".json.gz"):
+                    stat = os.stat(os.path.join(root, name))
+                    self.index[name[:-8]] = [stat.st_size, stat.st_mtime]
+                    self.size += stat.st_size
+
+    def load(self, url: str, params=None):
+        """Returns the cached JSON of a request, or None if it isn't cached or has expired.
+
+        Args:
+            url (str): Full URL of the request.
+            params (optional): Parameters of the request, as passed to http_client.get().
+
+        Returns:
+            The decoded JSON, or None.
+        """
+        key = self.key(url, params)
+        path = self._path(key)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None # * Not cached, or a broken file that will be overwritten on the next store
+        ttl = self.ttl.get(self.endpoint_class(url), self.ttl.get("other", 0))
+        if not self.offline and time.time() - entry["stored"] > ttl:
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self.lock:
+            if self.index is not None and key in self.index:
+                self.index[key][1] = now
+        return entry["data"]
+
+    def store(self, url: str, params, data) -> None:
+        """Saves the JSON of a request, then evicts the least recently used entries if the cache is too big.
+
+        Args:
+            url (str): Full URL of the request.
+            params: Parameters of the request, as passed to http_client.get().
+            data: The decoded JSON to cache.
+        """
+        key = self.key(url, params)
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + f".{threading.get_ident()}.tmp"
+        with gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump({"url": url, "stored": time.time(), "data": data}, f, separators=(",", ":"))
+        os.replace(temp_path, path) # * Atomic, a reader never sees half a file
+        size = os.path.getsize(path)
+        evicted = []
+        with self.lock:
+            if self.index is None:
+                self._load_index()
+            else:
+                self.size += size - self.index.get(key, [0])[0]
+                self.index[key] = [size, time.time()]
+            if self.size > self.max_size:
+                for old_key in sorted(self.index, key=lambda k: self.index[k][1]):
+                    if self.size <= self.max_size * 0.9: # * Free a bit more than needed so we don't evict on every store
+                        break
+                    if old_key == key:
+                        continue
+                    self.size -= self.index.pop(old_key)[0]
+                    evicted.append(old_key)
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                pass
+
+    def clear(self) -> None:
+        """Removes every cached response."""
+        with self.lock:
+            if self.index is None:
+                self._load_index()
+            keys = list(self.index)
+            self.index = {}
+            self.size = 0
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+
+# * Same as misc_utils.working_path(), which can't be imported here since misc_utils uses http_client
+_cache = ApiCache(os.path.join(working_dir or os.getcwd(), "cache", "api")) if use_api_cache else None
+
+
+def get_cache() -> ApiCache:
+    """Returns the shared cache, or None if caching is disabled in the settings."""
+    return _cache
+
+
+def is_offline() -> bool:
+    return _cache is not None and _cache.offline
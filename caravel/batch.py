@@ -0,0 +1,237 @@
+# Headless batch mode. Runs a list of series from a job file without asking anything, for unattended (ie nightly)
+# runs. Every job goes through the same HTTP client, rate limiter, API cache and download engine, and the series
+# metadata and chapter feeds of the next jobs are fetched while the current one downloads. With parallel_series (or
+# "--parallel") above 1, that many jobs run at the same time and share the downloads and conversions fairly.
+# Usage: "caravel batch jobs.jsonl" (or jobs.toml). Everything the pipeline prints goes to stderr, stdout only gets
+# the summary of the run as JSON, see run_jobs(). With "--progress json", stdout gets the progress events (see
+# events.py) as JSON lines instead, and the summary as the last line.
+#
+# A JSON lines job file has one job per line, blank lines and lines starting with # are skipped:
+#   {"mdid": "a1c7c817-4e59-43b7-9365-09675a149a6f", "volumes": "1-5,7", "profile": "KoL"}
+# A TOML job file has one [[job]] table per job, with the same keys:
+#   [[job]]
+#   mdid = "a1c7c817-4e59-43b7-9365-09675a149a6f"
+#   volumes = "all"
+# "volumes" is a selection like in the interactive script ("1-5,7"), a list of numbers, or "all" (the default).
+# "profile" is the KCC profile of the device, the ereader_profile setting if missing. "preferred_groups" and
+# "excluded_groups" (lists of scanlation group names or IDs) replace the settings of the same name for that job.
+# "weight" is the share of the downloads and conversions the job gets when jobs run at the same time, 1 if missing
+# (a job with weight 2 gets twice as many pages as a job with weight 1).
+
+import argparse
+import concurrent.futures
+import contextlib
+import json
+import os
+import sys
+import time
+
+from . import events
+
+try:
+    import tomllib
+except ImportError: # * Python 3.10, only JSON lines job files then
+    tomllib = None
+
+from .func import chapter_request_and_files, parse_volume_ranges, series_request
+from .journal import get_journal
+from .kcc_conversion import PROFILE_RESOLUTIONS
+from .pipeline import pick_volumes, run_series, shutdown, volume_key
+from .preprocess import get_pool
+from .settings import (converter, ereader_profile, excluded_groups, feed_workers, parallel_series, preferred_groups, preprocess_pages,
+                       progress)
+
+
+def load_jobs(path: str) -> list:
+    """Reads a job file, see the top of this file for the format.
+
+    Args:
+        path (str): A .toml file, anything else is read as JSON lines.
+
+    Returns:
+        list: One dict per job: {"mdid": str, "volumes": "all" or list of volume numbers, "profile": str,
+        "preferred_groups": list, "excluded_groups": list, "weight": float}. Raises
+        ValueError for a job that can't be run, with its line (or position in the TOML file).
+    """
+    if path.endswith(".toml"):
+        if tomllib is None:
+            raise ValueError(f"{path}: TOML job files need Python 3.11, use JSON lines")
+        with open(path, "rb") as file:
+            entries = [(f"job {index+1}", job) for index, job in enumerate(tomllib.load(file).get("job", []))]
+    else:
+        entries = []
+        with open(path, encoding="utf-8") as file:
+            for number, line in enumerate(file, 1):
+                if line.strip() == "" or line.lstrip().startswith("#"):
+                    continue
+                try:
+                    entries.append((f"line {number}", json.loads(line)))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"{path}, line {number}: {e}")
+
+    jobs = []
+    for where, entry in entries:
+        if not isinstance(entry, dict) or not isinstance(entry.get("mdid"), str):
+            raise ValueError(f"{path}, {where}: a job needs a Mangadex ID in \"mdid\"")
+        volumes = entry.get("volumes", "all")
+        try:
+            if isinstance(volumes, list):
+                volumes = [int(volume) for volume in volumes]
+            elif str(volumes).strip().lower() != "all":
+                volumes = parse_volume_ranges(str(volumes))
+            else:
+                volumes = "all"
+        except ValueError:
+            raise ValueError(f"{path}, {where}: can't read the volumes {volumes!r}")
+        profile = entry.get("profile", ereader_profile)
+        if profile not in PROFILE_RESOLUTIONS:
+            raise ValueError(f"{path}, {where}: unknown profile {profile!r}")
+        groups = {key: entry.get(key, default) for key, default in (("preferred_groups", preferred_groups), ("excluded_groups", excluded_groups))}
+        if not all(isinstance(value, list) for value in groups.values()):
+            raise ValueError(f"{path}, {where}: preferred_groups and excluded_groups must be lists")
+        weight = entry.get("weight", 1)
+        if isinstance(weight, bool) or not isinstance(weight, (int, float)) or weight <= 0:
+            raise ValueError(f"{path}, {where}: weight must be a positive number")
+        jobs.append(dict({"mdid": entry["mdid"], "volumes": volumes, "profile": profile, "weight": float(weight)}, **groups))
+    return jobs
+
+
+def resolve_job(job: dict) -> dict:
+    """Looks up the series of a job and its chapters, and picks the volumes to run. Only makes API requests, so
+    several jobs can be resolved at the same time.
+
+    Returns:
+        dict: {"info": see func.series_request(), "pseudo_file_structure": dict, "volumes": list of volumes to run,
+        "missing": list of selected volumes Mangadex doesn't have}
+    """
+    info = series_request(job["mdid"]) # ! API request
+    pseudo_file_structure = chapter_request_and_files(job["mdid"], info["clean_title"], job["preferred_groups"], job["excluded_groups"])["pseudo_file_structure"] # ! API request
+    volumes, missing = pick_volumes(pseudo_file_structure, info["clean_title"], job["volumes"])
+    return {"info": info, "pseudo_file_structure": pseudo_file_structure, "volumes": volumes, "missing": missing}
+
+
+def job_summary(job: dict, resolved: dict, pipeline_results: dict, duration: float) -> dict:
+    """Turns what the pipeline returned for a job into its entry of the summary, see run_jobs()."""
+    journal = get_journal()
+    volumes = {}
+    for volume in resolved["missing"]:
+        volumes[volume_key(volume)] = {"state": None, "failed_pages": 0, "book_id": None, "error": "NOT_ON_MANGADEX"}
+    for volume, result in pipeline_results.items():
+        convert, push = result["convert"] or {}, result["push"] or {}
+        error = push.get("error") or convert.get("error") or ''
+        if result["download"]:
+            error = "PAGES_MISSING"
+        volumes[volume] = {
+            "state": journal.volume_state(job["mdid"], volume),
+            "failed_pages": len(result["download"]),
+            "book_id": push.get("book id"),
+            "error": error
+        }
+    error = ''
+    if len(pipeline_results) == 0:
+        error = "NO_VOLUMES"
+    elif resolved["missing"]:
+        error = "VOLUMES_MISSING"
+    elif not all((result["push"] or {}).get("success", False) for result in pipeline_results.values()):
+        error = "VOLUMES_FAILED"
+    return {
+        "mdid": job["mdid"],
+        "title": resolved["info"]["series_title"],
+        "profile": job["profile"],
+        "success": error == '',
+        "error": error,
+        "duration": round(duration, 2),
+        "volumes": volumes
+    }
+
+
+def run_job(job: dict, resolving: concurrent.futures.Future, converter: str = converter) -> dict:
+    """Runs one job once its series is resolved. Never raises, a job that fails gets an entry with its error.
+
+    Args:
+        job (dict): See load_jobs().
+        resolving (concurrent.futures.Future): Future of resolve_job() for this job.
+        converter (str, optional): See pipeline.convert_volume(). Defaults to the converter setting.
+
+    Returns:
+        dict: Entry of the job in the summary, see run_jobs().
+    """
+    job_start = time.perf_counter()
+    try:
+        resolved = resolving.result()
+        pipeline_results = run_series(resolved["info"], resolved["pseudo_file_structure"], resolved["volumes"], job["profile"], converter,
+                                      job.get("weight", 1.0))
+        return job_summary(job, resolved, pipeline_results, time.perf_counter() - job_start)
+    except Exception as e:
+        # * One broken series doesn't stop the others
+        events.message(f"Job {job['mdid']} failed: {e}", "error")
+        return {"mdid": job["mdid"], "title": None, "profile": job["profile"], "success": False,
+                "error": "CATASTROPHIC_ERROR: " + str(e), "duration": round(time.perf_counter() - job_start, 2), "volumes": {}}
+
+
+def run_jobs(jobs: list, converter: str = converter, parallel: int = parallel_series) -> dict:
+    """Runs jobs, parallel of them at the same time. The series and chapter requests of every job are started right
+    away (feed_workers at a time) so that a job never waits on its metadata once the previous one is done downloading.
+
+    Args:
+        jobs (list): See load_jobs().
+        converter (str, optional): See pipeline.convert_volume(). Defaults to the converter setting.
+        parallel (int, optional): How many jobs run at the same time. Jobs still start in order. Defaults to the
+        parallel_series setting.
+
+    Returns:
+        dict: {"success": bool, "jobs": number of jobs, "failed": number of failed jobs, "duration": seconds,
+        "results": one dict per job, in the order of the jobs: {"mdid", "title", "profile", "success", "error",
+        "duration", "volumes": {volume: {"state": journal state, "failed_pages": int, "book_id": Calibre id or None,
+        "error": str}}}}
+    """
+    time_start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(feed_workers, 1), thread_name_prefix="batch-resolve") as resolver, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=max(parallel, 1), thread_name_prefix="batch-job") as runner:
+        resolving = [resolver.submit(resolve_job, job) for job in jobs]
+        results = list(runner.map(lambda job, future: run_job(job, future, converter), jobs, resolving))
+    failed = sum(1 for result in results if not result["success"])
+    return {
+        "success": failed == 0,
+        "jobs": len(results),
+        "failed": failed,
+        "duration": round(time.perf_counter() - time_start, 2),
+        "results": results
+    }
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="caravel batch", description="Download, convert and push a list of series without any prompt.")
+    parser.add_argument("job_file", help="JSON lines or .toml file with one job per series")
+    parser.add_argument("--summary", help="Also write the JSON summary to this file")
+    parser.add_argument("--converter", choices=["kcc", "native"], default=converter, help="Defaults to the converter setting")
+    parser.add_argument("--progress", choices=sorted(events.RENDERERS), default=progress, help="Defaults to the progress setting")
+    parser.add_argument("--parallel", type=int, default=parallel_series, help="How many series run at the same time. Defaults to the parallel_series setting")
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_jobs(args.job_file)
+    except (OSError, ValueError) as e: # * tomllib.TOMLDecodeError is a ValueError
+        print(e, file=sys.stderr)
+        return 2
+    if preprocess_pages:
+        get_pool() # * Before the resolve threads start, see preprocess.get_pool()
+    # * JSON events go to the real stdout, the bar and the messages follow the redirection below
+    events.set_mode(args.progress, sys.stdout if args.progress == "json" else None)
+    # * Keep stdout for the summary, so it can be piped as is
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            summary = run_jobs(jobs, args.converter, args.parallel)
+        finally:
+            shutdown()
+    if args.summary:
+        temp_path = args.summary + ".part"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+        os.replace(temp_path, args.summary)
+    print(json.dumps(summary))
+    return 0 if summary["success"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
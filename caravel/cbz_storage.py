@@ -0,0 +1,241 @@
+# Page storage in CBZ archives. Instead of one file per page, pages are appended to a stored (uncompressed) ZIP as
+# they arrive, one archive per chapter or per volume depending on the page_storage setting. Images are already
+# compressed, so storing them costs nothing, and a volume becomes a single file that KCC reads directly.
+# The central directory is only written when the archive is closed. An archive left open by a crash is recovered
+# on the next run by walking its local headers, dropping whatever was half written.
+
+import hashlib
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+
+from .misc_utils import image_extension
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_OF_CENTRAL_DIRECTORY = struct.Struct("<IHHHHIIH")
+LOCAL_SIGNATURE = 0x04034b50
+CENTRAL_SIGNATURE = 0x02014b50
+END_SIGNATURE = 0x06054b50
+UTF8_FLAG = 0x800
+ZIP32_LIMIT = 0xFFFFFFFF # * Past this (or 65535 entries) the archive would need ZIP64, which we don't write
+
+
+def _dos_time(timestamp: float) -> tuple:
+    t = time.localtime(timestamp)
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def natural_key(name: str) -> list:
+    # * "1/00000.jpg" < "1.5/00000.jpg" < "10/00000.jpg", like the chapters of the pseudo file structure
+    return [float(part) if index % 2 else part for index, part in enumerate(re.split(r"(\d+(?:\.\d+)?)", name))]
+
+
+class CbzArchive:
+    """A stored ZIP archive open for appending. Safe to use from several threads.
+
+    Entries are written in the order they arrive, the central directory lists them in natural name order. Adding a
+    name that is already in the archive, or the same name with another extension (ie a page that came back as PNG
+    instead of JPEG), replaces it (the old bytes stay in the file but are no longer listed).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {} # * name -> (offset of the local header, crc32, size)
+        self.file = open(path, "r+b" if os.path.exists(path) else "w+b")
+        self.end = self._recover()
+        self.time, self.date = _dos_time(time.time())
+
+    def _recover(self) -> int:
+        """Reads the local headers already in the file and cuts it after the last complete entry."""
+        file_size = os.fstat(self.file.fileno()).st_size
+        offset = 0
+        while offset + LOCAL_HEADER.size <= file_size:
+            self.file.seek(offset)
+            header = LOCAL_HEADER.unpack(self.file.read(LOCAL_HEADER.size))
+            if header[0] != LOCAL_SIGNATURE:
+                break # * Central directory of a closed archive, or garbage from a crash
+            crc, size, name_length, extra_length = header[6], header[7], header[9], header[10]
+            data_offset = offset + LOCAL_HEADER.size + name_length + extra_length
+            if data_offset + size > file_size:
+                break # * Half written
+            name = self.file.read(name_length).decode("utf-8")
+            self._list(name, (offset, crc, size))
+            offset = data_offset + size
+        self.file.truncate(offset)
+        return offset
+
+    def _list(self, name: str, entry: tuple) -> None:
+        stem = os.path.splitext(name)[0]
+        for replaced in [listed for listed in self.entries if listed != name and os.path.splitext(listed)[0] == stem]:
+            del self.entries[replaced]
+        self.entries[name] = entry
+
+    def add(self, name: str, data, crc: int = None) -> None:
+        """Appends one entry.
+
+        Args:
+            name (str): Name in the archive, ie "00000.jpg" or "12/00000.jpg".
+            data: Bytes-like content of the entry.
+            crc (int, optional): CRC32 of data, if already known (ie when copying from another archive).
+        """
+        if crc is None:
+            crc = zlib.crc32(data)
+        encoded_name = name.encode("utf-8")
+        header = LOCAL_HEADER.pack(LOCAL_SIGNATURE, 20, UTF8_FLAG, 0, self.time, self.date, crc, len(data), len(data), len(encoded_name), 0)
+        with self.lock:
+            if self.end + len(header) + len(encoded_name) + len(data) > ZIP32_LIMIT:
+                raise OSError(f"{self.path} would be larger than 4 GB, use page_storage = 'chapter' for this series")
+            self.file.seek(self.end)
+            self.file.write(header)
+            self.file.write(encoded_name)
+            self.file.write(data)
+            self._list(name, (self.end, crc, len(data)))
+            self.end += len(header) + len(encoded_name) + len(data)
+
+    def read(self, name: str) -> tuple:
+        """Returns (data, crc32) of an entry."""
+        with self.lock:
+            offset, crc, size = self.entries[name]
+            self.file.seek(offset)
+            header = LOCAL_HEADER.unpack(self.file.read(LOCAL_HEADER.size))
+            self.file.seek(offset + LOCAL_HEADER.size + header[9] + header[10])
+            return self.file.read(size), crc
+
+    def sync(self) -> None:
+        """Makes sure every entry added so far is on disk, so it survives a crash before close() (see _recover())."""
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def names(self) -> list:
+        with self.lock:
+            return sorted(self.entries, key=natural_key)
+
+    def close(self) -> None:
+        """Writes the central directory and closes the file. The archive can be opened again to add more pages."""
+        with self.lock:
+            if self.file.closed:
+                return
+            if len(self.entries) > 0xFFFF:
+                raise OSError(f"{self.path} has more than 65535 pages, use page_storage = 'chapter' for this series")
+            self.file.seek(self.end)
+            directory_size = 0
+            for name in sorted(self.entries, key=natural_key):
+                offset, crc, size = self.entries[name]
+                encoded_name = name.encode("utf-8")
+                self.file.write(CENTRAL_HEADER.pack(CENTRAL_SIGNATURE, 20, 20, UTF8_FLAG, 0, self.time, self.date, crc, size, size,
+                                                    len(encoded_name), 0, 0, 0, 0, 0, offset))
+                self.file.write(encoded_name)
+                directory_size += CENTRAL_HEADER.size + len(encoded_name)
+            self.file.write(END_OF_CENTRAL_DIRECTORY.pack(END_SIGNATURE, 0, 0, len(self.entries), len(self.entries), directory_size, self.end, 0))
+            self.file.truncate()
+            self.file.close()
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def open_archive(path: str) -> CbzArchive:
+    """Returns the open archive at path, opening (or creating) it if needed. Every caller shares the same object."""
+    with _archives_lock:
+        if path not in _archives:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _archives[path] = CbzArchive(path)
+        return _archives[path]
+
+
+def _open_in(folder: str) -> list:
+    # * Caller holds _archives_lock
+    return [path for path in _archives if folder is None or os.path.commonpath([folder, path]) == os.path.normpath(folder)]
+
+
+def sync_archives(folder: str = None) -> None:
+    """Writes the entries of the open archives inside a folder, the archive at that path, or every open archive to
+    disk, without closing them. Call it before pages are marked as downloaded in the journal."""
+    with _archives_lock:
+        archives = [_archives[path] for path in _open_in(folder)]
+    for archive in archives:
+        archive.sync()
+
+
+def close_archives(folder: str = None) -> None:
+    """Closes the open archives inside a folder (and its subfolders), the archive at that path, or every open archive.
+    Nothing may still be adding pages to them."""
+    with _archives_lock:
+        archives = [_archives.pop(path) for path in _open_in(folder)]
+    for archive in archives:
+        archive.close()
+
+
+def write_page(archive_path: str, name: str, data, content_type: str = None) -> dict:
+    """Same as misc_utils.write_page(), but appends the page to an archive. name is the entry name without extension.
+
+    Returns:
+        dict: {"path": archive path joined with the entry name, "bytes": size, "sha256": hash of the content}
+    """
+    entry = name + image_extension(data, content_type)
+    open_archive(archive_path).add(entry, data)
+    return {"path": os.path.join(archive_path, entry), "bytes": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def merge_archives(archive_paths: list, output_path: str, prefixes: list) -> str:
+    """Copies the entries of several archives into one, ie the chapters of a volume into the volume. The data is
+    copied as is, nothing is decompressed or hashed again.
+
+    Args:
+        archive_paths (list): Archives to merge, in order. They must be closed (see close_archives()).
+        output_path (str): The merged archive. Replaced if it exists.
+        prefixes (list): Folder to put the entries of each archive in, ie the chapter names.
+
+    Returns:
+        str: output_path
+    """
+    temp_path = output_path + ".part"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    merged = CbzArchive(temp_path)
+    for archive_path, prefix in zip(archive_paths, prefixes):
+        if not os.path.exists(archive_path):
+            continue
+        archive = CbzArchive(archive_path)
+        for name in archive.names():
+            data, crc = archive.read(name)
+            merged.add(prefix + "/" + name, data, crc)
+        archive.close()
+    merged.close()
+    os.replace(temp_path, output_path)
+    return output_path
+
+
+def remove_folders(archive_path: str, folders: list) -> None:
+    """Rewrites an archive without the entries inside some of its folders, ie the chapters of a volume archive that
+    were uploaded again. The rest is copied as is. Nothing may still be adding pages to it.
+
+    Args:
+        archive_path (str): The archive. Nothing happens if it doesn't exist.
+        folders (list): Folder names inside the archive, ie ["12", "12.5"].
+    """
+    close_archives(archive_path)
+    if not os.path.exists(archive_path):
+        return
+    prefixes = tuple(folder + "/" for folder in folders)
+    temp_path = archive_path + ".part"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    archive = CbzArchive(archive_path)
+    kept = CbzArchive(temp_path)
+    for name in archive.names():
+        if not name.startswith(prefixes):
+            data, crc = archive.read(name)
+            kept.add(name, data, crc)
+    archive.close()
+    kept.close()
+    os.replace(temp_path, archive_path)
@@ -0,0 +1,33 @@
+# The "caravel" command. Only argparse is imported here, the module of the command is imported once it is known, so
+# "caravel --help" and commands that have nothing to do start fast.
+# Usage: "caravel [get|batch|watch|status] [arguments of the command]", "caravel <command> --help" for those arguments.
+
+import argparse
+import importlib
+import sys
+
+from . import __version__
+
+# * Command: (module, description)
+COMMANDS = {
+    "get": ("retriever", "Search a title and pick the series and volumes interactively (default)"),
+    "batch": ("batch", "Run a list of series and volumes without prompts"),
+    "watch": ("watch", "Sync the follow list, downloading new chapters as they come out"),
+    "status": ("journal", "Show what the journal knows about the series and volumes")
+}
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="caravel", description="Download manga from Mangadex, convert it to EPUB and add it to Calibre.",
+                                     epilog="Commands:\n" + "\n".join(f"  {name:8}{description}" for name, (_, description) in COMMANDS.items()),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--version", action="version", version="%(prog)s " + __version__)
+    parser.add_argument("command", nargs="?", default="get", choices=COMMANDS, metavar="command", help="One of: " + ", ".join(COMMANDS) + ". Default: get")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help="Arguments of the command")
+    args = parser.parse_args(sys.argv[1:] if argv is None else argv)
+    module = importlib.import_module("." + COMMANDS[args.command][0], __package__)
+    return module.main(args.args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,185 @@
+# Cover download for the selected volumes. Every cover of the series is listed (all pages, not only the first 100),
+# the full resolution original of each selected volume is downloaded once into a cache, and the Calibre thumbnail and
+# the EPUB cover are made from it locally. Volumes whose cover didn't change since last time are skipped.
+
+import concurrent.futures
+import hashlib
+import json
+import os
+import threading
+
+from . import events
+from . import http_client
+from .func import baseUrl, main_cover_filename
+from .kcc_conversion import PROFILE_RESOLUTIONS
+from .misc_utils import working_path
+from .settings import cover_workers, ereader_profile, uploads_url
+
+COVER_PAGE_SIZE = 100 # * Highest limit the cover endpoint accepts
+THUMBNAIL_WIDTH = 512 # * Same size as the ".512.jpg" thumbnails Mangadex serves
+
+_manifest_lock = threading.Lock()
+
+
+def cover_list(mdid: str) -> list:
+    """Lists every cover of a series, requesting the pages after the first one at the same time.
+
+    Args:
+        mdid (str): Mangadex ID of the manga.
+
+    Returns:
+        list: Cover objects from the API, ordered by volume.
+    """
+    def cover_page(offset):
+        # ! API Request is being made here, this is a marker
+        return http_client.get_json(
+            f"{baseUrl}/cover",
+            params={"manga[]": [mdid], "limit": COVER_PAGE_SIZE, "offset": offset, "order[volume]": "asc"}
+        )
+
+    first_page = cover_page(0)
+    covers = first_page.get('data', [])
+    offsets = range(COVER_PAGE_SIZE, first_page.get('total', 0), COVER_PAGE_SIZE)
+    if len(offsets) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=cover_workers) as executor:
+            for page in executor.map(cover_page, offsets):
+                covers.extend(page.get('data', []))
+    return covers
+
+
+def cache_folder(mdid: str) -> str:
+    """Folder where the originals, the EPUB covers and the manifest of a series are kept."""
+    return working_path("cache", "covers", mdid)
+
+
+def _load_manifest(mdid: str) -> dict:
+    try:
+        with open(os.path.join(cache_folder(mdid), "manifest.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {"originals": {}, "volumes": {}}
+
+
+def _save_manifest(mdid: str, manifest: dict) -> None:
+    path = os.path.join(cache_folder(mdid), "manifest.json")
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def fetch_original(mdid: str, cover_filename: str, manifest: dict) -> dict:
+    """Downloads the full resolution original of a cover into the cache, unless it's already there.
+
+    Args:
+        mdid (str): Mangadex ID of the manga.
+        cover_filename (str): File name of the cover, as given by the API.
+        manifest (dict): Manifest of the series, updated with the hash of the original.
+
+    Returns:
+        dict: {"path": path of the original, "sha256": hash of its content}
+    """
+    path = os.path.join(cache_folder(mdid), cover_filename)
+    with _manifest_lock:
+        known_hash = manifest["originals"].get(cover_filename)
+    if known_hash is not None and os.path.exists(path):
+        return {"path": path, "sha256": known_hash}
+
+    # ! Request is being made here, uploads.mangadex.org is not rate limited
+    cover_file_request = http_client.get(f"{uploads_url}/covers/{mdid}/{cover_filename}")
+    cover_file_request.raise_for_status()
+    content = cover_file_request.content
+    with open(path + ".part", 'wb') as f:
+        f.write(content)
+    os.replace(path + ".part", path)
+    sha256 = hashlib.sha256(content).hexdigest()
+    with _manifest_lock:
+        manifest["originals"][cover_filename] = sha256
+    return {"path": path, "sha256": sha256}
+
+
+def derive_covers(original_path: str, thumbnail_path: str, epub_cover_path: str, profile: str = ereader_profile) -> None:
+    """Makes the Calibre thumbnail and the EPUB cover out of a full resolution original.
+
+    Args:
+        original_path (str): The original cover.
+        thumbnail_path (str): Where to save the thumbnail (512 pixels wide, like the Mangadex thumbnails).
+        epub_cover_path (str): Where to save the EPUB cover (fit to the screen of the profile, greyscale if the screen is).
+        profile (str, optional): KCC profile of the device. Defaults to the ereader_profile setting.
+    """
+    from PIL import Image # * Only when a cover changed, a run with every cover up to date never loads Pillow
+
+    with Image.open(original_path) as original:
+        original = original.convert("RGB")
+        thumbnail = original.copy()
+        thumbnail.thumbnail((THUMBNAIL_WIDTH, THUMBNAIL_WIDTH * 4), Image.LANCZOS)
+        thumbnail.save(thumbnail_path, "JPEG", quality=90)
+
+        width, height, greyscale = PROFILE_RESOLUTIONS.get(profile, (original.width, original.height, False))
+        epub_cover = original.copy()
+        epub_cover.thumbnail((width, height), Image.LANCZOS)
+        if greyscale:
+            epub_cover = epub_cover.convert("L")
+        epub_cover.save(epub_cover_path, "JPEG", quality=90)
+
+
+def download_covers(mdid: str, series_folder: str, volumes_to_download: list, default_cover_filename: str = None, profile: str = ereader_profile) -> dict:
+    """Gets the covers of the selected volumes. Downloads happen at the same time, and a volume is skipped if the cover
+    it was made from last time is still the one Mangadex has.
+
+    Args:
+        mdid (str): Mangadex ID of the manga.
+        series_folder (str): Folder of the series, where the "<volume>.jpg" thumbnails go (used by Calibre).
+        volumes_to_download (list): Volumes to get covers for.
+        default_cover_filename (str, optional): File name of the main cover of the series, used for volumes without
+            their own cover. Comes with the search results ("main_cover_filename"), looked up if not given.
+        profile (str, optional): KCC profile the EPUB covers are made for. Defaults to the ereader_profile setting.
+
+    Returns:
+        dict: One entry per volume: {"success": bool, "thumbnail": path, "epub_cover": path, "skipped": bool, "error": str}
+    """
+    os.makedirs(cache_folder(mdid), exist_ok=True)
+    manifest = _load_manifest(mdid)
+    covers_by_volume = {}
+    for cover in cover_list(mdid):
+        covers_by_volume.setdefault(str(cover['attributes']['volume']), cover['attributes']['fileName'])
+
+    def get_cover(volume):
+        volume_name = str(volume).zfill(4)
+        thumbnail_path = os.path.join(series_folder, volume_name + ".jpg")
+        cover_filename = covers_by_volume.get(str(volume), default_cover_filename)
+        if cover_filename is None:
+            return {"success": False, "thumbnail": "", "epub_cover": "", "skipped": False, "error": "NO_COVER"}
+        epub_cover_path = os.path.join(cache_folder(mdid), os.path.splitext(cover_filename)[0] + "." + profile + ".jpg")
+
+        with _manifest_lock:
+            previous = manifest["volumes"].get(volume_name)
+        original = fetch_original(mdid, cover_filename, manifest)
+        if previous == {"fileName": cover_filename, "sha256": original["sha256"], "profile": profile} and os.path.exists(thumbnail_path) and os.path.exists(epub_cover_path):
+            return {"success": True, "thumbnail": thumbnail_path, "epub_cover": epub_cover_path, "skipped": True, "error": ""}
+
+        derive_covers(original["path"], thumbnail_path, epub_cover_path, profile)
+        with _manifest_lock:
+            manifest["volumes"][volume_name] = {"fileName": cover_filename, "sha256": original["sha256"], "profile": profile}
+        return {"success": True, "thumbnail": thumbnail_path, "epub_cover": epub_cover_path, "skipped": False, "error": ""}
+
+    if any(str(volume) not in covers_by_volume for volume in volumes_to_download) and default_cover_filename is None:
+        default_cover_filename = main_cover_filename(mdid)
+
+    results = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=cover_workers) as executor:
+        futures = {volume: executor.submit(get_cover, volume) for volume in volumes_to_download}
+        for volume, future in futures.items():
+            try:
+                results[volume] = future.result()
+            except Exception as e:
+                results[volume] = {"success": False, "thumbnail": "", "epub_cover": "", "skipped": False, "error": "COVER_FAILED: " + str(e)}
+            result = results[volume]
+            if not result["success"]:
+                events.message(f"Could not get the cover for volume {volume}: {result['error']}", "warning")
+            elif result["skipped"]:
+                events.message(f"Cover for volume {volume} already exists, skipping")
+            else:
+                events.message(f"Downloaded cover for volume {volume}")
+    _save_manifest(mdid, manifest)
+    events.message("Cover download completed")
+    return results
@@ -0,0 +1,304 @@
+# Native EPUB builder. When the pages of a volume are already the right size for the device (ie prepared by
+# preprocess.py), running kcc-c2e only repackages them. This writes the fixed layout EPUB directly instead: images are
+# copied into the book as they are, without being decoded or encoded again, with one XHTML page per image, a table of
+# contents with a marker for every chapter, and the volume cover. Works from a volume folder or a volume CBZ.
+# Volumes whose pages still need resizing or splitting are left to KCC, see can_build().
+
+import os
+import re
+import shutil
+import time
+import uuid
+import zipfile
+from html import escape
+
+from . import events
+from .cbz_storage import natural_key
+from .kcc_conversion import PROFILE_RESOLUTIONS
+from .misc_utils import IMAGE_EXTENSIONS
+from .settings import ereader_profile
+
+MEDIA_TYPES = {".jpg": "image/jpeg", ".png": "image/png", ".gif": "image/gif", ".webp": "image/webp"}
+
+
+def list_pages(volume_path: str, chapters: list) -> list:
+    """Lists the pages of a volume in reading order, from "<volume>.cbz" if it exists or from the volume folder.
+
+    Args:
+        volume_path (str): Path of the volume folder, without ".cbz".
+        chapters (list): Chapter names in reading order, ie the keys of the volume in the pseudo file structure.
+
+    Returns:
+        list: [(chapter, name in the source, extension)]
+    """
+    pages = []
+    if os.path.isfile(volume_path + ".cbz"):
+        with zipfile.ZipFile(volume_path + ".cbz") as archive:
+            names = archive.namelist()
+        by_chapter = {}
+        for name in names:
+            chapter, _, page = name.rpartition("/")
+            by_chapter.setdefault(chapter, []).append(name)
+        for chapter in chapters:
+            for name in sorted(by_chapter.get(chapter, []), key=natural_key):
+                pages.append((chapter, name, os.path.splitext(name)[1].lower()))
+        return pages
+    for chapter in chapters:
+        chapter_path = os.path.join(volume_path, chapter)
+        if not os.path.isdir(chapter_path):
+            continue
+        for name in sorted(os.listdir(chapter_path), key=natural_key):
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                pages.append((chapter, os.path.join(chapter, name), os.path.splitext(name)[1].lower()))
+    return pages
+
+
+class _Source:
+    # * Opens the pages of a volume the same way whether they are in a folder or in a CBZ
+    def __init__(self, volume_path: str):
+        self.volume_path = volume_path
+        self.archive = zipfile.ZipFile(volume_path + ".cbz") if os.path.isfile(volume_path + ".cbz") else None
+
+    def open(self, name: str):
+        if self.archive is not None:
+            return self.archive.open(name)
+        return open(os.path.join(self.volume_path, name), "rb")
+
+    def size(self, name: str) -> tuple:
+        from PIL import Image # * Only loaded once a volume is built
+
+        with self.open(name) as f, Image.open(f) as image: # * Only the header is read
+            return image.size
+
+    def close(self) -> None:
+        if self.archive is not None:
+            self.archive.close()
+
+
+def can_build(volume_path: str, chapters: list, profile: str = ereader_profile) -> bool:
+    """Whether every page of a volume is ready for the device: not a spread and not bigger than the screen. Pages
+    smaller than the screen are fine, the reader centers them.
+
+    Args:
+        volume_path (str): Path of the volume folder, without ".cbz".
+        chapters (list): Chapter names in reading order.
+        profile (str, optional): KCC profile of the device. Defaults to the ereader_profile setting.
+
+    Returns:
+        bool: False if KCC should convert this volume.
+    """
+    if profile not in PROFILE_RESOLUTIONS:
+        return False
+    screen_width, screen_height, _ = PROFILE_RESOLUTIONS[profile]
+    source = _Source(volume_path)
+    try:
+        for _, name, extension in list_pages(volume_path, chapters):
+            if extension not in MEDIA_TYPES:
+                return False
+            width, height = source.size(name)
+            if width > height or width > screen_width or height > screen_height:
+                return False
+        return True
+    except OSError:
+        return False
+    finally:
+        source.close()
+
+
+def _page_xhtml(title: str, image: str, width: int, height: int) -> str:
+    return f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head><title>{escape(title)}</title><meta name="viewport" content="width={width}, height={height}"/>
+<style>html, body {{ margin: 0; padding: 0; }} img {{ position: absolute; top: 0; left: 0; width: {width}px; height: {height}px; }}</style></head>
+<body><img src="{image}" alt=""/></body>
+</html>
+"""
+
+
+def build_epub(volume_path: str, output_path: str, title: str, chapters: list, authors: list = None, series: str = None,
+               volume_number=None, cover_path: str = None, right_to_left: bool = True) -> dict:
+    """Writes a fixed layout EPUB out of the pages of a volume.
+
+    Args:
+        volume_path (str): Path of the volume folder, without ".cbz". Pages are read from "<volume_path>.cbz" if it exists.
+        output_path (str): Where to write the EPUB. Written next to it first, then renamed.
+        title (str): Title of the book.
+        chapters (list): Chapter names in reading order, each gets a table of contents entry.
+        authors (list, optional): Author names. Defaults to None.
+        series (str, optional): Series name, for the Calibre series metadata. Defaults to None.
+        volume_number (optional): Position in the series. Defaults to None.
+        cover_path (str, optional): Image to use as cover, ie the "epub_cover" from covers.download_covers(). Defaults to None.
+        right_to_left (bool, optional): Page progression of manga. Defaults to True.
+
+    Returns:
+        dict: Same as kcc_conversion.img_dir_to_epub(): {"success": bool, "full_path": str, "error": str, "output": str}
+        List of errors:
+        - VOLUME_FOLDER_IS_EMPTY: No pages were found for the volume
+        - NATIVE_BUILD_FAILED: Something went wrong while writing the book, see "output"
+    """
+    pages = list_pages(volume_path, chapters)
+    if len(pages) == 0:
+        return {"success": False, "full_path": volume_path, "error": "VOLUME_FOLDER_IS_EMPTY", "output": ""}
+
+    book_id = "urn:uuid:" + str(uuid.uuid4())
+    temp_path = output_path + ".part"
+    manifest = []
+    spine = []
+    toc = [] # * (title, page file) of the first page of every chapter
+    source = _Source(volume_path)
+    try:
+        with zipfile.ZipFile(temp_path, "w") as epub:
+            # * The mimetype must be the first file, uncompressed
+            epub.writestr(zipfile.ZipInfo("mimetype"), "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+            epub.writestr("META-INF/container.xml", """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>
+</container>
+""", compress_type=zipfile.ZIP_DEFLATED)
+
+            if cover_path is not None and os.path.isfile(cover_path):
+                from PIL import Image
+                extension = os.path.splitext(cover_path)[1].lower()
+                with Image.open(cover_path) as image:
+                    width, height = image.size
+                with open(cover_path, "rb") as src, epub.open("OEBPS/Images/cover" + extension, "w") as dst:
+                    shutil.copyfileobj(src, dst)
+                manifest.append(f'<item id="cover-image" href="Images/cover{extension}" media-type="{MEDIA_TYPES.get(extension, "image/jpeg")}" properties="cover-image"/>')
+                epub.writestr("OEBPS/Text/cover.xhtml", _page_xhtml(title, "../Images/cover" + extension, width, height), compress_type=zipfile.ZIP_DEFLATED)
+                manifest.append('<item id="cover" href="Text/cover.xhtml" media-type="application/xhtml+xml"/>')
+                spine.append('<itemref idref="cover"/>')
+
+            previous_chapter = None
+            for index, (chapter, name, extension) in enumerate(pages):
+                image_name = f"Images/{index:05d}{extension}"
+                page_name = f"Text/{index:05d}.xhtml"
+                width, height = source.size(name)
+                # * Stored as is, no point compressing JPEG/PNG again
+                with source.open(name) as src, epub.open(zipfile.ZipInfo("OEBPS/" + image_name), "w") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+                epub.writestr("OEBPS/" + page_name, _page_xhtml(title, "../" + image_name, width, height), compress_type=zipfile.ZIP_DEFLATED)
+                manifest.append(f'<item id="img{index:05d}" href="{image_name}" media-type="{MEDIA_TYPES[extension]}"/>')
+                manifest.append(f'<item id="page{index:05d}" href="{page_name}" media-type="application/xhtml+xml"/>')
+                spine.append(f'<itemref idref="page{index:05d}"/>')
+                if chapter != previous_chapter:
+                    toc.append(("Chapter " + chapter, page_name))
+                    previous_chapter = chapter
+
+            nav_points = "\n".join(f'<navPoint id="nav{i}" playOrder="{i + 1}"><navLabel><text>{escape(label)}</text></navLabel><content src="{href}"/></navPoint>'
+                                   for i, (label, href) in enumerate(toc))
+            epub.writestr("OEBPS/toc.ncx", f"""<?xml version="1.0" encoding="UTF-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+<head><meta name="dtb:uid" content="{book_id}"/></head>
+<docTitle><text>{escape(title)}</text></docTitle>
+<navMap>
+{nav_points}
+</navMap>
+</ncx>
+""", compress_type=zipfile.ZIP_DEFLATED)
+            nav_items = "\n".join(f'<li><a href="{href}">{escape(label)}</a></li>' for label, href in toc)
+            epub.writestr("OEBPS/nav.xhtml", f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+<head><title>{escape(title)}</title></head>
+<body><nav epub:type="toc" id="toc"><ol>
+{nav_items}
+</ol></nav></body>
+</html>
+""", compress_type=zipfile.ZIP_DEFLATED)
+            manifest.append('<item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>')
+            manifest.append('<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>')
+
+            creators = "\n".join(f"<dc:creator>{escape(author)}</dc:creator>" for author in (authors or []))
+            series_meta = ""
+            if series:
+                series_meta = f'<meta name="calibre:series" content="{escape(series)}"/>'
+                if volume_number is not None:
+                    series_meta += f'\n<meta name="calibre:series_index" content="{escape(str(volume_number))}"/>'
+            epub.writestr("OEBPS/content.opf", f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="BookId" prefix="rendition: http://www.idpf.org/vocab/rendition/#">
+<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+<dc:identifier id="BookId">{book_id}</dc:identifier>
+<dc:title>{escape(title)}</dc:title>
+<dc:language>en</dc:language>
+{creators}
+<meta property="dcterms:modified">{time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}</meta>
+<meta property="rendition:layout">pre-paginated</meta>
+<meta property="rendition:spread">none</meta>
+{'<meta name="cover" content="cover-image"/>' if spine[0] == '<itemref idref="cover"/>' else ''}
+<meta name="book-type" content="comic"/>
+{series_meta}
+</metadata>
+<manifest>
+{chr(10).join(manifest)}
+</manifest>
+<spine toc="ncx" page-progression-direction="{'rtl' if right_to_left else 'ltr'}">
+{chr(10).join(spine)}
+</spine>
+</package>
+""", compress_type=zipfile.ZIP_DEFLATED)
+        os.replace(temp_path, output_path)
+    except Exception as e:
+        events.message("Error: could not build " + output_path + ": " + str(e), "error")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return {"success": False, "full_path": volume_path, "error": "NATIVE_BUILD_FAILED", "output": str(e)}
+    finally:
+        source.close()
+    return {"success": True, "full_path": output_path, "error": "", "output": f"{len(pages)} pages, {len(toc)} chapters"}
+
+
+def stamp_metadata(epub_path: str, title: str, authors: list = None, series: str = None, volume_number=None, cover_path: str = None) -> None:
+    """Writes the title, authors, series and cover into an existing EPUB (ie one made by KCC), so Calibre picks them
+    up when the book is added and nothing has to be set book by book afterwards. The book is rewritten next to
+    itself, then renamed.
+
+    Args:
+        epub_path (str): The EPUB to update.
+        title (str): Title of the book.
+        authors (list, optional): Author names. Defaults to None.
+        series (str, optional): Series name. Defaults to None.
+        volume_number (optional): Position in the series. Defaults to None.
+        cover_path (str, optional): Image to use as cover. Defaults to None, which keeps the cover of the book.
+    """
+    with zipfile.ZipFile(epub_path) as epub:
+        container = epub.read("META-INF/container.xml").decode("utf-8")
+        opf_name = re.search(r'full-path="([^"]+)"', container).group(1)
+        opf = epub.read(opf_name).decode("utf-8")
+
+        # * Drop what we are about to set, then add ours at the end of the metadata
+        opf = re.sub(r"<dc:title[^>]*>.*?</dc:title>\s*", "", opf, flags=re.S)
+        opf = re.sub(r"<dc:creator[^>]*>.*?</dc:creator>\s*", "", opf, flags=re.S)
+        opf = re.sub(r'<meta name="calibre:series(_index)?"[^>]*/>\s*', "", opf)
+        metadata = f"<dc:title>{escape(title)}</dc:title>\n" + "".join(f"<dc:creator>{escape(author)}</dc:creator>\n" for author in (authors or []))
+        if series:
+            metadata += f'<meta name="calibre:series" content="{escape(series)}"/>\n'
+            if volume_number is not None:
+                metadata += f'<meta name="calibre:series_index" content="{escape(str(volume_number))}"/>\n'
+
+        cover_name = None
+        if cover_path is not None and os.path.isfile(cover_path):
+            extension = os.path.splitext(cover_path)[1].lower()
+            cover_href = "caravel-cover" + extension
+            cover_name = (os.path.dirname(opf_name) + "/" if os.path.dirname(opf_name) else "") + cover_href
+            opf = re.sub(r'<meta name="cover"[^>]*/>\s*', "", opf)
+            opf = re.sub(r'\s*properties="([^"]*)\bcover-image\b([^"]*)"',
+                         lambda m: f' properties="{" ".join((m.group(1) + m.group(2)).split())}"' if (m.group(1) + m.group(2)).strip() else "", opf)
+            opf = re.sub(r'<item id="caravel-cover"[^>]*/>\s*', "", opf)
+            opf = opf.replace("</manifest>", f'<item id="caravel-cover" href="{cover_href}" media-type="{MEDIA_TYPES.get(extension, "image/jpeg")}" properties="cover-image"/>\n</manifest>', 1)
+            metadata += '<meta name="cover" content="caravel-cover"/>\n'
+        opf = re.sub(r"(</(?:opf:)?metadata>)", metadata.replace("\\", "\\\\") + r"\1", opf, count=1)
+
+        temp_path = epub_path + ".part"
+        with zipfile.ZipFile(temp_path, "w") as output:
+            for item in epub.infolist():
+                if item.filename == cover_name:
+                    continue
+                if item.filename == opf_name:
+                    output.writestr(item, opf.encode("utf-8"), compress_type=zipfile.ZIP_DEFLATED)
+                    continue
+                with epub.open(item) as src, output.open(item, "w") as dst:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+            if cover_name is not None:
+                output.write(cover_path, cover_name, compress_type=zipfile.ZIP_STORED)
+    os.replace(temp_path, epub_path)
@@ -0,0 +1,315 @@
+# Progress events. The pipeline publishes what happens (a volume is prepared, a page is done, a volume is converted or
+# pushed, a message) on a bus instead of printing it, and the renderer subscribed to the bus decides what to show:
+# - 'bar': a progress bar with the ETA of the whole run, redrawn at most every progress_interval seconds (every
+#   PLAIN_INTERVAL seconds on a new line when the output is not a terminal, ie a log file), with the messages above it
+# - 'json': one JSON object per line for job runners, page events are folded into "progress" events
+# - 'quiet': only warnings and errors
+#
+# Every event is a dict {"event": kind, "time": unix time, ...}. Kinds and what they carry:
+#   series_started     mdid, title, volumes (how many)
+#   volume_started     mdid, volume, position, pages (to download)
+#   page_done          mdid, volume, success
+#   volume_downloaded  mdid, volume, failed_pages
+#   volume_converted   mdid, volume, success, error
+#   volume_pushed      mdid, volume, success, book_id, error
+#   series_finished    mdid, duration
+#   message            text, level ("info", "warning" or "error")
+#   progress           (json only) done, failed, total, volumes, volumes_started, pages_per_second, eta (seconds or None)
+
+import json
+import sys
+import threading
+import time
+
+from .settings import progress, progress_interval
+
+PLAIN_INTERVAL = 30 # * Seconds between progress lines when the output is not a terminal
+LEVELS = ("info", "warning", "error")
+
+
+class Progress:
+    """Page counts of the series being run and the ETA of all their volumes. Volumes that aren't prepared yet are
+    counted with the average size of the ones that are, MD@Home links are only resolved a few volumes ahead. Series
+    running at the same time (see parallel_series) are counted together, the counts start over when a series starts
+    while none is running.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.series = {} # * mdid -> {"title", "volumes", "volumes_started", "total"}
+        self.running = set()
+        self.done = 0
+        self.failed = 0
+        self.first_page = None
+
+    @property
+    def volumes(self) -> int:
+        return sum(series["volumes"] for series in self.series.values())
+
+    @property
+    def volumes_started(self) -> int:
+        return sum(series["volumes_started"] for series in self.series.values())
+
+    @property
+    def total(self) -> int:
+        return sum(series["total"] for series in self.series.values())
+
+    def update(self, event: dict) -> None:
+        kind = event["event"]
+        if kind == "series_started":
+            if not self.running:
+                self.reset()
+            self.running.add(event["mdid"])
+            self.series[event["mdid"]] = {"title": event["title"], "volumes": event["volumes"], "volumes_started": 0, "total": 0}
+        elif kind == "series_finished":
+            self.running.discard(event["mdid"])
+        elif kind == "volume_started":
+            series = self.series.setdefault(event["mdid"], {"title": None, "volumes": 0, "volumes_started": 0, "total": 0})
+            series["volumes_started"] += 1
+            series["total"] += event["pages"]
+        elif kind == "page_done":
+            if self.first_page is None:
+                self.first_page = time.monotonic()
+            self.done += 1
+            if not event["success"]:
+                self.failed += 1
+
+    def title(self, mdid: str) -> str:
+        """Returns the title of a series that was started, None if unknown."""
+        return self.series.get(mdid, {}).get("title")
+
+    def estimated_total(self) -> float:
+        return sum(series["total"] + series["total"] / series["volumes_started"] * max(series["volumes"] - series["volumes_started"], 0)
+                   for series in self.series.values() if series["volumes_started"] > 0)
+
+    def rate(self) -> float:
+        if self.first_page is None or self.done < 2:
+            return 0.0
+        return self.done / max(time.monotonic() - self.first_page, 0.001)
+
+    def eta(self) -> float:
+        """Seconds left for every volume of the series being run, None until it can be estimated."""
+        rate = self.rate()
+        return None if rate == 0 else max(self.estimated_total() - self.done, 0) / rate
+
+    def as_dict(self) -> dict:
+        eta = self.eta()
+        return {"done": self.done, "failed": self.failed, "total": self.total, "volumes": self.volumes, "volumes_started": self.volumes_started,
+                "pages_per_second": round(self.rate(), 2), "eta": round(eta, 1) if eta is not None else None}
+
+
+def _duration(seconds: float) -> str:
+    if seconds is None:
+        return "--:--"
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
+
+
+def describe(event: dict) -> str:
+    """Returns the line of text for an event, or None for events that are only progress."""
+    kind = event["event"]
+    if kind == "message":
+        return event["text"]
+    if kind == "series_started":
+        return f"\n===== {event['title']} ({event['mdid']}): {event['volumes']} volume(s) ====="
+    if kind == "volume_started":
+        return f"Volume {event['volume']} ({event['position']}): {event['pages']} page(s) to download"
+    if kind == "volume_downloaded":
+        return f"Finished downloading Volume {event['volume']}" + (f" with {event['failed_pages']} failed pages" if event["failed_pages"] else "")
+    if kind == "volume_converted":
+        return f"Conversion of Volume {event['volume']} was " + ("successful!" if event["success"] else "unsuccessful... " + event["error"])
+    if kind == "volume_pushed":
+        if not event["success"]:
+            return f"Volume {event['volume']} was not pushed to Calibre: {event['error']}"
+        return f"Volume {event['volume']} pushed to Calibre" + (f" (book {event['book_id']})" if event["book_id"] is not None else "")
+    if kind == "series_finished":
+        return f"Time for all volumes: {round(event['duration'], 2)} seconds"
+    return None
+
+
+class _Renderer:
+    """Base of the renderers: a lock around the output, and the output stream. No stream means whatever sys.stdout is
+    when something is written, so contextlib.redirect_stdout() still works."""
+
+    def __init__(self, stream=None):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def output(self):
+        return self.stream or sys.stdout
+
+    def __call__(self, event: dict) -> None:
+        raise NotImplementedError
+
+
+class ProgressBar(_Renderer):
+    """Shows every event as text, and page events as a single progress bar that is redrawn at most every interval."""
+
+    def __init__(self, stream=None, interval: float = progress_interval, length: int = 30):
+        super().__init__(stream)
+        self.interval = interval
+        self.length = length
+        self.progress = Progress()
+        self.drawn = False # * Whether the bar is the last thing on the terminal
+        self.last_draw = 0.0
+
+    def _tty(self) -> bool:
+        try:
+            return self.output().isatty()
+        except (AttributeError, ValueError):
+            return False
+
+    def line(self) -> str:
+        progress = self.progress
+        total = max(progress.estimated_total(), progress.done, 1)
+        filled = int(self.length * progress.done // total)
+        failed = f", {progress.failed} failed" if progress.failed else ""
+        return (f"Progress: |{'█' * filled}{'-' * (self.length - filled)}| {100 * progress.done / total:5.1f}% "
+                f"{progress.done}/{progress.total} pages{failed}, volume {progress.volumes_started}/{progress.volumes}, "
+                f"{progress.rate():.1f} pages/s, ETA {_duration(progress.eta())}")
+
+    def _draw(self, tty: bool) -> None:
+        stream = self.output()
+        stream.write(("\r" + self.line() + "\033[K") if tty else self.line() + "\n")
+        stream.flush()
+        self.drawn = tty
+        self.last_draw = time.monotonic()
+
+    def __call__(self, event: dict) -> None:
+        with self.lock:
+            several = len(self.progress.running) > 1 # * Before a series_finished event takes one away
+            self.progress.update(event)
+            tty = self._tty()
+            text = describe(event)
+            if text is None:
+                if time.monotonic() - self.last_draw >= (self.interval if tty else PLAIN_INTERVAL):
+                    self._draw(tty)
+                return
+            if several and self.progress.title(event.get("mdid")) and event["event"] != "series_started":
+                text = f"[{self.progress.title(event['mdid'])}] " + text.lstrip("\n") # * Several series share the output
+            stream = self.output()
+            if self.drawn:
+                stream.write("\r\033[K") # * The text goes where the bar was, the bar is drawn again below it
+            stream.write(text + "\n")
+            self.drawn = False
+            if tty and event["event"] in ("volume_started", "volume_downloaded"):
+                self._draw(tty)
+            stream.flush()
+
+
+class JsonLines(_Renderer):
+    """Writes every event as one JSON object per line. Page events are folded into a "progress" event, written at most
+    every interval seconds and whenever a volume is done downloading."""
+
+    def __init__(self, stream=None, interval: float = progress_interval):
+        super().__init__(stream)
+        self.interval = max(interval, 1.0) # * A job runner doesn't need a terminal's refresh rate
+        self.progress = Progress()
+        self.last_progress = 0.0
+
+    def _write(self, event: dict) -> None:
+        stream = self.output()
+        stream.write(json.dumps(event, default=str) + "\n")
+        stream.flush()
+
+    def __call__(self, event: dict) -> None:
+        with self.lock:
+            self.progress.update(event)
+            if event["event"] != "page_done":
+                self._write(event)
+            if event["event"] == "volume_downloaded" or (event["event"] == "page_done" and time.monotonic() - self.last_progress >= self.interval):
+                self._write(dict({"event": "progress", "time": event["time"]}, **self.progress.as_dict()))
+                self.last_progress = time.monotonic()
+
+
+class Quiet(_Renderer):
+    """Only shows warning and error messages."""
+
+    def __call__(self, event: dict) -> None:
+        if event["event"] == "message" and event["level"] != "info":
+            with self.lock:
+                stream = self.output()
+                stream.write(event["text"] + "\n")
+                stream.flush()
+
+
+RENDERERS = {"bar": ProgressBar, "json": JsonLines, "quiet": Quiet}
+
+
+class EventBus:
+    """Calls every subscribed handler with each published event, in the thread that publishes it. Handlers must be
+    quick (the download engine publishes page events), and one that raises is ignored."""
+
+    def __init__(self):
+        self.handlers = []
+        self.lock = threading.Lock()
+
+    def subscribe(self, handler) -> None:
+        with self.lock:
+            self.handlers = self.handlers + [handler]
+
+    def unsubscribe(self, handler) -> None:
+        with self.lock:
+            self.handlers = [existing for existing in self.handlers if existing is not handler]
+
+    def publish(self, kind: str, **data) -> None:
+        event = dict({"event": kind, "time": round(time.time(), 3)}, **data)
+        for handler in self.handlers: # * Replaced, never changed in place, so no lock needed here
+            try:
+                handler(event)
+            except Exception:
+                pass # * Showing progress is never worth failing a download
+
+
+_bus = None
+_renderer = None
+_mode = progress
+_lock = threading.Lock()
+
+
+def get_bus() -> EventBus:
+    """Returns the shared bus, with the renderer of the progress setting subscribed on first use."""
+    global _bus, _renderer
+    with _lock:
+        if _bus is None:
+            _bus = EventBus()
+            _renderer = RENDERERS.get(_mode, ProgressBar)()
+            _bus.subscribe(_renderer)
+        return _bus
+
+
+def set_mode(mode: str, stream=None) -> None:
+    """Replaces the renderer of the shared bus.
+
+    Args:
+        mode (str): 'bar', 'json' or 'quiet', see the top of this file.
+        stream (optional): Where to write. Defaults to sys.stdout at the time of writing.
+    """
+    global _mode, _renderer
+    if mode not in RENDERERS:
+        raise ValueError(f"Unknown progress mode {mode!r}, use one of {', '.join(RENDERERS)}")
+    bus = get_bus()
+    with _lock:
+        bus.unsubscribe(_renderer)
+        _mode = mode
+        _renderer = RENDERERS[mode](stream)
+        bus.subscribe(_renderer)
+
+
+def is_verbose() -> bool:
+    """Whether modules that print on their own (ie kcc_conversion.img_dir_to_epub() and its verbose argument) should
+    print. Only with the bar, anything else would end up in the middle of the JSON lines."""
+    return _mode == "bar"
+
+
+def publish(kind: str, **data) -> None:
+    """Publishes an event on the shared bus, see the top of this file for the kinds."""
+    get_bus().publish(kind, **data)
+
+
+def message(text: str, level: str = "info") -> None:
+    """Publishes a line of text. Use instead of print() for anything shown during a run."""
+    get_bus().publish("message", text=text, level=level if level in LEVELS else "info")
@@ -0,0 +1,63 @@
+# Weighted fair queue. Several series share the download engine and the conversion workers, and a plain priority
+# queue would serve whichever series queued first (or queued the most) until it is done: a 300 volume series would
+# hold up every series behind it. Here each series (a "flow") gets its own queue, and the next item always comes from
+# the flow that got the least service for its weight (stride scheduling): with weights 2 and 1, the first series gets
+# two pages for every page of the second, whatever either of them queued. Within a flow, items still come out lowest
+# priority first, then in the order they were put, so the earliest volume of a series still finishes first.
+# Not thread safe, the download engine only uses it from its event loop and ConversionScheduler holds a lock.
+
+import heapq
+import itertools
+
+
+class FairQueue:
+    """Queue of items split by flow, see the top of this file.
+
+    A flow that had nothing queued doesn't get to make up for lost time when it comes back: it starts level with the
+    flows that were busy, so a series that idled while resolving MD@Home links can't then take every connection.
+    """
+
+    def __init__(self):
+        self.flows = {} # * flow -> {"items": heap of (priority, order, item), "pass": service received / weight, "weight"}
+        self.active = [] # * Flows with items, in the order they got some
+        self.counter = itertools.count() # * Tie breaker so items of the same priority keep their order
+        self.now = 0.0 # * Pass of the last flow served
+        self.size = 0
+
+    def __len__(self) -> int:
+        return self.size
+
+    def put(self, item, flow=None, weight: float = 1.0, priority: int = 0) -> None:
+        """Queues an item.
+
+        Args:
+            item: Anything, it is given back as is by get().
+            flow (optional): Who the item is for (ie the Mangadex ID of a series). Defaults to None, one flow for
+            everything else.
+            weight (float, optional): Share of the flow, relative to the others. The last weight given is kept.
+            Defaults to 1.0.
+            priority (int, optional): Lower numbers come out first within the flow. Defaults to 0.
+        """
+        if weight <= 0:
+            raise ValueError("weight must be positive")
+        state = self.flows.setdefault(flow, {"items": [], "pass": self.now, "weight": weight})
+        state["weight"] = weight
+        if not state["items"]:
+            state["pass"] = max(state["pass"], self.now)
+            self.active.append(flow)
+        heapq.heappush(state["items"], (priority, next(self.counter), item))
+        self.size += 1
+
+    def get(self):
+        """Removes and returns the next item. Raises IndexError when the queue is empty."""
+        if not self.active:
+            raise IndexError("get from an empty FairQueue")
+        flow = min(self.active, key=lambda name: self.flows[name]["pass"]) # * First one wins a tie, the earliest to come
+        state = self.flows[flow]
+        _, _, item = heapq.heappop(state["items"])
+        self.now = state["pass"]
+        state["pass"] += 1 / state["weight"]
+        if not state["items"]:
+            self.active.remove(flow) # * Its pass is kept, a flow that comes right back doesn't jump the line
+        self.size -= 1
+        return item
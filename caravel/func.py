@@ -0,0 +1,635 @@
+# This script will handle most complex functions of the main script
+
+import concurrent.futures
+import time
+from pprint import pprint
+import os
+
+from . import http_client
+from .misc_utils import working_path
+from .settings import api_url, excluded_groups, feed_workers, preferred_groups
+
+baseUrl = api_url
+
+def relationships_of_type(item: dict, rel_type: str) -> list:
+    """Returns the relationships of an API object (manga, chapter, cover...) that have the given type, in order.
+    Never rely on the position of a relationship, Mangadex doesn't guarantee any order.
+
+    Args:
+        item (dict): An object from a "data" list of the API.
+        rel_type (str): Relationship type, ie "author", "artist", "cover_art", "scanlation_group".
+
+    Returns:
+        list: The matching relationships. They have "attributes" if they were expanded with includes[].
+    """
+    return [relationship for relationship in item.get("relationships", []) if relationship.get("type") == rel_type]
+
+
+def contributor_request(contributor_ids: list) -> dict:
+    """Takes a list of staff IDs and returns a list of their names in the same order. All the IDs are looked up in a
+    single batched request.
+
+    Args:
+        contributor_ids (list): list of mangadex staff IDs
+
+    Returns:
+        dict: results of the request,
+        {
+            "names": list of names,
+            "duration": time taken to execute the request
+        }
+    """
+    name_list = []
+    t1 = time.perf_counter()
+    try:
+        if len(contributor_ids) > 0:
+            # ! API Request is being made here, this is a marker
+            contributor_request = http_client.get_json(
+                            f"{baseUrl}/author",
+                            params={"ids[]": list(contributor_ids), "limit": 100}
+                            )
+            names_by_id = {author['id']: author['attributes']['name'] for author in contributor_request['data']}
+            for author_id in contributor_ids:
+                name = names_by_id.get(author_id)
+                name_list.append(name) if name is not None and name not in name_list else None # * Avoid duplication
+        t2 = time.perf_counter()
+        duration = round(t2 - t1, 2) # Useful later for understanding a rate limiting issue
+        # ? Checking time should be done whenever an API request is inside a fast loop
+    except:
+        # * Likely that authors don't exist or we are rate limited, just skip
+        name_list = [""]
+        duration = 0
+    return {
+        "names": name_list,
+        "duration": duration
+    }
+
+
+def mangadex_titles_request(title_lookup: str) -> dict:
+    """This function will execute the API request for the titles endpoint. It
+    will return the response it gets from the API, or any errors received.
+
+    Args:
+        title_lookup (str): The title to lookup.
+
+    Returns:
+        dict: A dictionary similar to the JSON but in a format that is easier for
+        us to use. The API response is cached for a certain amount of time, see api_cache.py.
+    """
+    # ! API Request is being made here, this is a marker
+    title_request = http_client.get_json(
+        f"{baseUrl}/manga",
+        params={"title": title_lookup, "includes[]": ["author", "artist", "cover_art"]}
+    ) # * Cached for a few minutes, going "back" to the search doesn't request it again
+    # includes[] makes the API send the names of the authors and the cover file name with each result, so picking a
+    # series doesn't need any other request
+    # The title lookup is used for the following in the main script:
+    # - Get a list of strings of the titles
+    # - Get a list of strings of the IDs
+    # - Get a list of anilist links
+    # - Get a description for the chosen title (NOT USED?)
+    # - Get the year of the chosen title (NOT USED?)
+    # - Get the real title of the series (including illegal characters)
+    # - Get the author and artist of the series
+
+    title_results = []
+    ids_results = []
+    anilist_links = []
+    real_titles = []
+    contributors = [] # * Special format, list of lists. [[author, artist], [author, artist]]. If author and artist are the same, only one is listed.
+    contributor_names = [] # * Same format as contributors, but names instead of IDs
+    cover_ids = []
+    cover_filenames = []
+    mangadex_links = []
+    # Loop through the results and append them to the lists as needed:
+    for result in title_request["data"]:
+        try: # Sometimes the titles are too well classified lmao
+            tit = title_results.append(result["attributes"]["title"]["en"])
+        except:
+            tit = title_results.append(result["attributes"]["title"]["ja-ro"])
+        ids_results.append(result["id"])
+        real_titles.append(tit)
+        cover_art = relationships_of_type(result, "cover_art")
+        cover_ids.append(cover_art[0]["id"] if len(cover_art) > 0 else None)
+        cover_filenames.append(cover_art[0].get("attributes", {}).get("fileName") if len(cover_art) > 0 else None)
+        mangadex_links.append("https://mangadex.org/title/" + result["id"])
+
+        try: # Not every title has an anilist link, might break when it's not there.
+            anilist_links.append("https://anilist.co/manga/" + result["attributes"]["links"]["al"])
+        except:
+            anilist_links.append("N/A")
+
+        # Get the contributors, authors first then artists
+        authors_list = []
+        names_list = []
+        for relationship in relationships_of_type(result, "author") + relationships_of_type(result, "artist"):
+            if relationship["id"] not in authors_list:
+                authors_list.append(relationship["id"])
+                name = relationship.get("attributes", {}).get("name")
+                names_list.append(name) if name is not None and name not in names_list else None
+        contributors.append(authors_list)
+        contributor_names.append(names_list)
+
+    return {
+        "titles_results": title_results,
+        "ids_results": ids_results,
+        "mangadex_links": mangadex_links,
+        "anilist_links": anilist_links,
+        "description": "",  # * Not used yet
+        "year": "",         # * Not used yet
+        "real_titles": real_titles,
+        "contributors": contributors,
+        "contributor_names": contributor_names,
+        "main_cover_id": cover_ids,
+        "main_cover_filename": cover_filenames,
+        "result_number": len(title_results),
+        "results": title_request # * For debugging
+    }
+
+
+def safe_title(title: str) -> str:
+    """Removes the characters that can't be in a folder name from a title."""
+    for character in ':/\\*?"<>|':
+        title = title.replace(character, "")
+    return title
+
+
+def series_request(mdid: str) -> dict:
+    """Looks up a series by its Mangadex ID, with everything the pipeline needs to know about it, in a single request.
+    Used when there is no title search to pick the series from (ie batch.py).
+
+    Args:
+        mdid (str): Mangadex ID of the manga to lookup.
+
+    Returns:
+        dict: {"mdid": str, "series_title": real title, "clean_title": title for folders (see safe_title()),
+        "authors": list of author and artist names, "main_cover_filename": str or None}
+    """
+    # ! API Request is being made here, this is a marker
+    manga = http_client.get_json(f"{baseUrl}/manga/{mdid}", params={"includes[]": ["author", "artist", "cover_art"]})['data']
+    titles = manga["attributes"]["title"]
+    title = titles.get("en") or titles.get("ja-ro") or next(iter(titles.values()), mdid) # * Same order as the title search
+    authors = []
+    for relationship in relationships_of_type(manga, "author") + relationships_of_type(manga, "artist"):
+        name = relationship.get("attributes", {}).get("name")
+        authors.append(name) if name is not None and name not in authors else None
+    cover_art = relationships_of_type(manga, "cover_art")
+    return {
+        "mdid": mdid,
+        "series_title": title,
+        "clean_title": safe_title(title),
+        "authors": authors,
+        "main_cover_filename": cover_art[0].get("attributes", {}).get("fileName") if len(cover_art) > 0 else None
+    }
+
+
+FEED_PAGE_SIZE = 500 # * Highest limit the feed endpoint accepts
+
+
+def _slim_chapter(chapter: dict) -> dict:
+    """Keeps only the parts of a chapter from the feed that we use, so a long feed doesn't sit in memory as raw JSON.
+
+    Args:
+        chapter (dict): One entry of the "data" list of a feed response.
+
+    Returns:
+        dict: The same chapter with only the fields we need, in the same format.
+    """
+    attributes = chapter["attributes"]
+    relationships = []
+    for relationship in chapter.get("relationships", []):
+        slim = {"id": relationship["id"], "type": relationship["type"]}
+        if relationship["type"] == "scanlation_group" and "attributes" in relationship:
+            slim["attributes"] = {"name": relationship["attributes"].get("name")}
+        relationships.append(slim)
+    return {
+        "id": chapter["id"],
+        "type": chapter.get("type", "chapter"),
+        "attributes": {key: attributes.get(key) for key in ("volume", "chapter", "title", "pages", "externalUrl", "translatedLanguage", "updatedAt")},
+        "relationships": relationships
+    }
+
+
+def chapter_feed_page(mdid: str, offset: int, updated_since: str = None) -> dict:
+    """Requests one page of the feed of a series and slims it down right away.
+
+    Args:
+        mdid (str): Mangadex ID of the manga to lookup.
+        offset (int): Offset of the first chapter of the page.
+        updated_since (str, optional): Only chapters created or updated since then, ie "2024-01-31T12:00:00" (UTC).
+            These requests skip the API cache, they are how we find out the cached feed is out of date. Defaults to
+            None (every chapter).
+
+    Returns:
+        dict: The JSON response, with slimmed chapters in "data".
+    """
+    params = {"translatedLanguage[]": "en", "order[chapter]": "asc", "limit": FEED_PAGE_SIZE, "offset": offset,
+              "includes[]": ["scanlation_group"]} # * Group names come with the chapters, see select_uploads()
+    # ! API Request is being made here, this is a marker
+    if updated_since is not None:
+        params["updatedAtSince"] = updated_since # * A new chapter's updatedAt is when it was created, so they show up too
+        page = http_client.get(f"{baseUrl}/manga/{mdid}/feed", params=params).json()
+    else:
+        page = http_client.get_json(f"{baseUrl}/manga/{mdid}/feed", params=params)
+    if page.get("result") == "ok":
+        page["data"] = [_slim_chapter(chapter) for chapter in page["data"]]
+    return page
+
+
+def chapter_request(mdid: str, updated_since: str = None) -> dict:
+    """
+    Execute a mangadex API request for all the chapters in a series. The first page tells us how many chapters there
+    are, the other pages are then requested at the same time (the rate limiter keeps us in check) and put back in order.
+    Returns the JSON response from the API request, with every page merged in "data".
+
+    Args:
+        mdid (str): Mangadex ID of the manga to lookup.
+        updated_since (str, optional): Only the chapters created or updated since then, see chapter_feed_page().
+
+    Returns:
+        dict: The JSON response from the API request. If the first page failed, the error response as is.
+    """
+    first_page = chapter_feed_page(mdid, 0, updated_since)
+    if first_page.get("result") != "ok":
+        return first_page
+    total = first_page["total"]
+    data = first_page["data"]
+    offsets = range(FEED_PAGE_SIZE, total, FEED_PAGE_SIZE)
+    if len(offsets) > 0:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=feed_workers) as executor:
+            # * map() gives the pages back in order, whatever order they finish in
+            for page in executor.map(lambda offset: chapter_feed_page(mdid, offset, updated_since), offsets):
+                if page.get("result") != "ok":
+                    # ! A missing page means missing chapters, better to fail loudly than to build half a series
+                    raise RuntimeError(f"Feed page failed for {mdid}: {page.get('errors')}")
+                data.extend(page["data"])
+    return {
+        "result": "ok",
+        "response": "collection",
+        "data": data,
+        "limit": len(data),
+        "offset": 0,
+        "total": total
+    }
+
+def _upload_groups(chapter: dict) -> tuple:
+    # * IDs and lowercase names of the groups of an upload, an upload without a group counts as its own "group"
+    groups = relationships_of_type(chapter, "scanlation_group")
+    ids = tuple(sorted(group["id"] for group in groups)) or ("no group",)
+    names = {(group.get("attributes") or {}).get("name", "").lower() for group in groups} - {""}
+    return ids, {group_id.lower() for group_id in ids} | names
+
+
+def chapter_name(chapter: dict) -> str:
+    """Returns the folder name of a chapter in the pseudo file structure: its number, or "extra-<chapter ID>" for a
+    chapter without one (oneshots, extras), so two of them never end up in the same folder."""
+    number = chapter["attributes"]["chapter"]
+    return number if number is not None else "extra-" + chapter["id"]
+
+
+def select_uploads(chapter_request_json: dict, preferred: list = preferred_groups, excluded: list = excluded_groups,
+                   current: dict = None, coverage: dict = None) -> dict:
+    """Keeps a single upload of each chapter number, so a chapter uploaded by several scanlation groups is only
+    downloaded once. Uploads of excluded groups and external chapters (hosted on another site) are dropped, then for
+    each chapter number the best upload wins, compared on, in order:
+    - its group's place in the preferred list
+    - whether it has a volume number (otherwise it's stranded and never downloaded)
+    - how many chapters of the series its group uploaded, so most chapters come from the same group
+    - its page count
+    - its chapter ID, so the choice never depends on the order of the feed
+    Chapters without a number (oneshots, extras) can't be told apart, so each of them is kept, see chapter_name().
+
+    Args:
+        chapter_request_json (dict): The JSON response of chapter_request(), needs includes[]=scanlation_group for
+            group names (group IDs always work).
+        preferred (list, optional): Group names or IDs, best first. Defaults to the preferred_groups setting.
+        excluded (list, optional): Group names or IDs. Defaults to the excluded_groups setting.
+        current (dict, optional): {chapter name (see chapter_name()): chapter ID} already chosen before, ie the chapters
+            of the pseudo file structure of the previous sync of watch.py. A new upload of one of these chapters only
+            replaces it if its group is preferred. Defaults to None.
+        coverage (dict, optional): "coverage" of a previous result for the whole feed, when chapter_request_json only
+            has the chapters that changed since (ie an incremental sync of watch.py), so groups are compared on the
+            whole series and not only on what changed. Defaults to None.
+
+    Returns:
+        dict: The same response, with only the selected uploads in "data" (in feed order), how many uploads were
+        dropped in "duplicates", and the chapters each group uploaded in "coverage" ({comma separated group IDs:
+        list of chapter names}, can be saved as JSON).
+    """
+    preferred = [group.lower() for group in preferred]
+    excluded = {group.lower() for group in excluded}
+    uploads = []
+    for chapter in chapter_request_json["data"]:
+        ids, keys = _upload_groups(chapter)
+        if chapter["attributes"]["externalUrl"] is None and not keys & excluded:
+            uploads.append((chapter, ids, keys))
+
+    coverage = {group: set(numbers) for group, numbers in (coverage or {}).items()}
+    for chapter, ids, _ in uploads:
+        coverage.setdefault(",".join(ids), set()).add(chapter_name(chapter))
+
+    def score(upload):
+        chapter, ids, keys = upload
+        rank = min([preferred.index(key) for key in keys if key in preferred], default=len(preferred))
+        return (-rank, chapter["attributes"]["volume"] is not None, len(coverage[",".join(ids)]), chapter["attributes"].get("pages") or 0, chapter["id"])
+
+    best = {}
+    for upload in uploads:
+        number = chapter_name(upload[0]) # * A chapter without a number is never the same chapter as another one
+        if number not in best or score(upload) > score(best[number]):
+            best[number] = upload
+    if current:
+        for number, (chapter, ids, keys) in list(best.items()):
+            if number in current and chapter["id"] != current[number] and not keys & set(preferred):
+                del best[number] # * Another group's upload of a chapter we already have
+    kept = {upload[0]["id"] for upload in best.values()}
+    data = [chapter for chapter in chapter_request_json["data"] if chapter["id"] in kept]
+    return dict(chapter_request_json, data=data, duplicates=len(chapter_request_json["data"]) - len(data),
+                coverage={group: list(numbers) for group, numbers in coverage.items()})
+
+
+def extract_chapter_info(chapter_request_json: dict) -> tuple:
+    """
+    Extract chapter IDs and volume numbers from the API response.
+    Returns a tuple containing the chapter ID list and volume list.
+
+    Args:
+        chapter_request_json (dict): The JSON response from the chapter request.
+
+    Returns:
+        tuple: A tuple containing the chapter ID list and volume list.
+    """
+    chapter_id_list = []
+    volume_list = []
+    for chapter in chapter_request_json["data"]:
+        if chapter["attributes"]["externalUrl"] is None:
+            chapter_id_list.append(chapter["id"])
+            volume_list.append(chapter["attributes"]["volume"])
+    return chapter_id_list, volume_list
+
+def build_pseudo_file_structure(chapter_request_json: dict, series_title: str, chapter_id_list: list, pseudo_file_structure: dict = None) -> dict:
+    """
+    Build the pseudo file structure dictionary based on the chapter request JSON.
+    Returns the pseudo file structure dictionary.
+
+    Args:
+        chapter_request_json (dict): The JSON response from the chapter request.
+        series_title (str): The title of the series.
+        chapter_id_list (list): The list of chapter IDs.
+        pseudo_file_structure (dict, optional): An existing structure to add the chapters to, ie only the chapters
+            updated since the last sync (see watch.py). A chapter already in it (or another upload of the same chapter
+            number) is moved to where the response puts it.
+            Series without volumes are not split in groups of ten then, their new chapters stay stranded.
+
+    Returns:
+        dict: The pseudo file structure dictionary.
+    """
+    incremental = pseudo_file_structure is not None
+    if not incremental:
+        pseudo_file_structure = {series_title: {'stranded': {}}}
+    else:
+        # * Drop where these chapters were, and any other upload of the same chapter numbers (see select_uploads())
+        updated_ids = set(chapter_id_list)
+        updated_numbers = {chapter_name(chapter) for chapter in chapter_request_json["data"]
+                           if chapter["id"] in updated_ids and chapter["attributes"]["externalUrl"] is None}
+        for volume in pseudo_file_structure[series_title].values():
+            for chapter_num in [chapter_num for chapter_num, chapter_id in volume.items() if chapter_id in updated_ids or chapter_num in updated_numbers]:
+                del volume[chapter_num]
+    for chapter in chapter_request_json["data"]:
+        if chapter["attributes"]["externalUrl"] is None:
+            chapter_num = chapter_name(chapter)
+            volume_num = chapter["attributes"]["volume"]
+            volume_str = str(volume_num).zfill(4) if volume_num is not None else "stranded"
+
+            if volume_str == "stranded":
+                pseudo_file_structure[series_title]['stranded'][chapter_num] = chapter["id"]
+            else:
+                if volume_str not in pseudo_file_structure[series_title]:
+                    pseudo_file_structure[series_title][volume_str] = {}
+                pseudo_file_structure[series_title][volume_str][chapter_num] = chapter["id"]
+    if incremental:
+        for volume_str in [volume_str for volume_str, volume in pseudo_file_structure[series_title].items() if not volume and volume_str != 'stranded']:
+            del pseudo_file_structure[series_title][volume_str] # * Every chapter moved to another volume
+        return pseudo_file_structure
+
+    if len(pseudo_file_structure[series_title]['stranded']) == len(chapter_id_list):
+        pseudo_file_structure = {series_title: {'stranded': {}}}
+        for i in range(0, len(chapter_id_list), 10):
+            volume_str = str(i // 10).zfill(4)
+            pseudo_file_structure[series_title][volume_str] = {}
+            for j in range(i, i+10):
+                try:
+                    pseudo_file_structure[series_title][volume_str][chapter_id_list[j]] = chapter_id_list[j]
+                except:
+                    pseudo_file_structure[series_title]['stranded'][chapter_id_list[j]] = chapter_id_list[j]
+
+    return pseudo_file_structure
+
+def chapter_request_and_files(mdid: str, series_title: str, preferred: list = preferred_groups, excluded: list = excluded_groups) -> dict:
+    """
+    Execute a mangadex API request for all the chapters in a series.
+    Returns a dictionary with the results and other information. Only one upload of each chapter is kept, see
+    select_uploads().
+
+    Args:
+        mdid (str): Mangadex ID of the manga to lookup.
+        series_title (str): The title of the series.
+        preferred (list, optional): Scanlation groups to prefer. Defaults to the preferred_groups setting.
+        excluded (list, optional): Scanlation groups to skip. Defaults to the excluded_groups setting.
+
+    Returns:
+        dict: A dictionary with the following keys:
+            - "chapter_id_list": A list of chapter IDs.
+            - "volumes": A list of volume numbers.
+            - "chapter_number": The total number of chapters.
+            - "pseudo_file_structure": A nested dictionary representing the file structure.
+            - "duplicates": How many uploads were dropped.
+            - "results": The JSON response from the API request, without the dropped uploads.
+    """
+    chapter_request_json = chapter_request(mdid)
+    if chapter_request_json.get("result") == "ok":
+        chapter_request_json = select_uploads(chapter_request_json, preferred, excluded)
+    chapter_id_list, volume_list = extract_chapter_info(chapter_request_json)
+    pseudo_file_structure = build_pseudo_file_structure(chapter_request_json, series_title, chapter_id_list)
+
+    return {
+        "chapter_id_list": chapter_id_list,
+        "volumes": volume_list,
+        "chapter_number": len(chapter_id_list),
+        "pseudo_file_structure": pseudo_file_structure,
+        "duplicates": chapter_request_json.get("duplicates", 0),
+        "results": chapter_request_json
+    }
+
+def chapter_request_and_files_temp(mdid: str, series_title: str) -> dict:
+    """Execute a mangadex API request for all the chapters in a
+    series. Returns a dictionary with the results and other information.
+
+    Args:
+        mdid (str): Mangadex ID of the manga to lookup.
+        series_title (str): The title of the series.
+
+    Returns:
+        dict: See "return" for the format.
+    """
+    # ! API Request is being made here, this is a marker
+    chapter_request_json = chapter_request(mdid) # * Every page of the feed, not only the first 500 chapters
+    # TODO Handle error responses
+
+    chapter_id_list = []
+    volume_list = []
+    # * If we want any other stat, we can add a list that is filled gradually here too
+
+    for chapter in chapter_request_json["data"]:
+        # ? This should exclude "official publisher" chapters
+        if chapter["attributes"]["externalUrl"] == None:
+            chapter_id_list.append(chapter["id"])
+            volume_list.append(chapter["attributes"]["volume"])
+
+# ==============================================================================
+
+    # Build the pseudo file structure right away
+    pseudo_file_structure = {series_title: {
+        'stranded': {},
+    }}
+
+    for chapter in chapter_request_json["data"]:
+        if chapter["attributes"]["externalUrl"] == None:
+            chapter_num = chapter["attributes"]["chapter"] # * Will return None if empty, no point try-excepting
+            volume_num = chapter["attributes"]["volume"]
+            volume_str = str(volume_num).zfill(4) if volume_num is not None else "stranded"
+
+            # If it's stranded, add it to the stranded list. Else, add to its volume dict:
+            if volume_str == "stranded":
+                pseudo_file_structure[series_title]['stranded'][chapter_num] = chapter["id"]
+            else:
+                if volume_str not in pseudo_file_structure[series_title]: # Can't create a new dict with an assignment to it
+                    pseudo_file_structure[series_title][volume_str] = {}
+                pseudo_file_structure[series_title][volume_str][chapter_num] = chapter["id"]
+    # By the end of this loop, the pseudo file structure should be complete
+
+    # Check if everything ended up in stranded. If so, use chapter ranges instead:
+    if len(pseudo_file_structure[series_title]['stranded']) == len(chapter_id_list):
+        # Default to chapter ranges of 10, may be changed in settings later.
+        # * The setting is not implemented yet
+        # If there's not enoug chapters to fill the last range, put in stranded. Can apply to the first volume:
+        pseudo_file_structure = {series_title: {
+            'stranded': {},
+        }}
+        for i in range(0, len(chapter_id_list), 10):
+            volume_str = str(i // 10).zfill(4)
+            pseudo_file_structure[series_title][volume_str] = {}
+            for j in range(i, i+10):
+                try:
+                    pseudo_file_structure[series_title][volume_str][chapter_id_list[j]] = chapter_id_list[j]
+                except:
+                    pseudo_file_structure[series_title]['stranded'][chapter_id_list[j]] = chapter_id_list[j]
+        # * The above is completely untested. It's just a concept for now.
+    # Rebuild the volume list
+    volume_list = list(pseudo_file_structure[series_title].keys())
+
+# ==============================================================================
+
+    #pprint(pseudo_file_structure)
+
+    return {
+        "chapter_id_list": chapter_id_list,
+        "volumes": volume_list,
+        "chapter_number": len(chapter_id_list),
+        "pseudo_file_structure": pseudo_file_structure,
+        "results": chapter_request_json
+    }
+
+
+def build_folders(pseudo_file_structure: dict, volumes_to_download: list) -> None:
+    """Builds the folders of the selected volumes from a pseudo file structure. Chapter folders are made by the
+    pipeline, only for chapters that still have pages to download.
+
+    Args:
+        pseudo_file_structure (dict): A pseudo file structure built by a previous function.
+        volumes_to_download (list): Volumes selected by the user.
+    """
+    # First, build the root folder named after the series in the current directory:
+    root_folder = working_path("books", list(pseudo_file_structure.keys())[0])
+    os.makedirs(root_folder, exist_ok=True)
+    # Now, create a folder for each selected volume:
+    for volume in volumes_to_download:
+        os.makedirs(os.path.join(root_folder, str(volume).zfill(4)), exist_ok=True)
+
+
+
+def parse_volume_ranges(volume_ranges: str) -> list:
+    """Reads a volume selection like "1-5,7,9" into a list of volumes, in the order given.
+
+    Args:
+        volume_ranges (str): Volume numbers separated by commas, ranges are inclusive ("1-5" is 1 to 5).
+
+    Returns:
+        list: Volume numbers as ints. Raises ValueError if a part isn't a number or a range.
+    """
+    volumes = []
+    for part in volume_ranges.split(","):
+        if "-" in part:
+            # It's a range, so add all the volumes in the range:
+            first, last = part.split("-")
+            volumes.extend(range(int(first), int(last)+1))
+        elif part.strip() != "":
+            # It's a single volume, so add it to the list:
+            volumes.append(int(part))
+    return volumes
+
+
+def select_volumes_to_download(pseudo_file_structure: dict) -> dict:
+    """Takes a pseudo file structure and displays its content and asks
+    the user which volumes within it to download.
+
+    Args:
+        pseudo_file_structure (dict): a pseudo file structure built by a previous function
+
+    Returns:
+        dict: See returned structure for more information.
+    """
+    # List all volumes available, and how many chapters are in each:
+    print("Available volumes:")
+    i = 0
+    for volume in pseudo_file_structure[list(pseudo_file_structure.keys())[0]]:
+        print(f"{i}: \t {volume} ({len(pseudo_file_structure[list(pseudo_file_structure.keys())[0]][volume])} chapters)")
+        i += 1
+    # Ask the user which volumes to download:
+    user_input = input("Enter the numbers of the volumes you want to download, separated by commas, or a range ('1-5'): ")
+    # Parse the user input and build a list of volumes to download, which are inherently their IDs:
+    volumes_to_download = parse_volume_ranges(user_input) # ! This has no error handling!
+    return {
+        "volumes_to_download": volumes_to_download
+    }
+
+
+def main_cover_filename(mdid: str) -> str:
+    """Looks up the file name of the main cover of a series, using includes[] so it's a single request.
+
+    Args:
+        mdid (str): Mangadex ID of the manga to lookup.
+
+    Returns:
+        str: File name of the cover, or None if the series has no cover.
+    """
+    # ! API Request is being made here, this is a marker
+    manga_request = http_client.get_json(f"{baseUrl}/manga/{mdid}", params={"includes[]": ["cover_art"]})
+    cover_art = relationships_of_type(manga_request['data'], "cover_art")
+    return cover_art[0].get("attributes", {}).get("fileName") if len(cover_art) > 0 else None
+
+
+def at_home_server(chapter_id: str, fresh: bool = False) -> dict:
+    """Asks MD@Home which node to download a chapter from.
+
+    Args:
+        chapter_id (str): Mangadex ID of the chapter.
+        fresh (bool, optional): Skip the API cache and ask for a new node, ie when the one we had is too slow. The
+            new node replaces the cached one, so the next prepare or retry of the chapter doesn't get the old node
+            back. Defaults to False.
+
+    Returns:
+        dict: The JSON response: {"baseUrl": node URL, "chapter": {"hash": ..., "data": [...], "dataSaver": [...]}}
+    """
+    # ! API Request is being made here, rate limiting and retries on 429 are handled by http_client
+    return http_client.get_json(f"{baseUrl}/at-home/server/{chapter_id}", fresh=fresh)
@@ -0,0 +1,167 @@
+# Shared HTTP client. Every request to Mangadex or to a MD@Home node should go through here instead of calling
+# requests directly, so that connections are kept alive and reused between calls.
+# requests itself is only imported once the first session is made, runs served from the API cache never pay for it.
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from . import api_cache
+from . import events
+from . import metrics
+from . import rate_limiter
+from .settings import (api_pool_size, api_url, connect_timeout, image_pool_size, max_pooled_hosts, max_rate_limit_retries,
+                      read_timeout, uploads_url)
+
+if TYPE_CHECKING:
+    import requests # * Only for the annotations, see the top of this file
+
+API_HOSTS = (urlsplit(api_url).netloc, urlsplit(uploads_url).netloc)
+DEFAULT_TIMEOUT = (connect_timeout, read_timeout)
+USER_AGENT = "Caravel (https://github.com/FAChenier/Caravel)"
+
+_sessions = OrderedDict() # * host -> requests.Session, most recently used last
+_lock = threading.Lock()
+
+
+def _host_key(url: str) -> str:
+    """Returns the "scheme://host:port" part of a URL, which is what we pool connections on.
+
+    Args:
+        url (str): Any full URL.
+
+    Returns:
+        str: The origin of the URL.
+    """
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _new_session(host: str) -> requests.Session:
+    """Builds a session with a connection pool sized for the kind of host it talks to.
+
+    Args:
+        host (str): Origin of the host, as returned by _host_key().
+
+    Returns:
+        requests.Session: A session with a single adapter mounted for this host.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    pool_size = api_pool_size if urlsplit(host).netloc in API_HOSTS else image_pool_size
+    session = requests.Session()
+    session.headers["User-Agent"] = USER_AGENT
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount(host, adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """Returns the pooled session for the host of a URL, creating it if needed. Hosts that haven't been used recently
+    are closed once there are more than max_pooled_hosts of them (MD@Home hands out new hosts all the time).
+
+    Args:
+        url (str): Any URL on the host we want to talk to.
+
+    Returns:
+        requests.Session: The session to use for that host.
+    """
+    host = _host_key(url)
+    evicted = []
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _new_session(host)
+            _sessions[host] = session
+        _sessions.move_to_end(host)
+        while len(_sessions) > max(max_pooled_hosts, 1):
+            evicted.append(_sessions.popitem(last=False)[1])
+    for old_session in evicted: # * Closed outside the lock, closing sockets can take a moment
+        old_session.close()
+    return session
+
+
+def request(method: str, url: str, **kwargs) -> requests.Response:
+    """Makes a request through the pooled session of the host. Same arguments as requests.request(), but a default
+    timeout is always applied and the request waits for the rate limiter. A 429 is retried after the delay the server
+    asks for, up to max_rate_limit_retries times, after which the 429 response is returned as is. The time to the
+    response and its size (unless streamed, the caller counts those) go to the run metrics, see metrics.py.
+
+    Args:
+        method (str): HTTP method, ie "GET".
+        url (str): Full URL to request.
+
+    Returns:
+        requests.Response: The response.
+    """
+    if api_cache.is_offline():
+        raise api_cache.CacheMiss(f"Offline mode, not requesting {url}")
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    session = get_session(url)
+    attempt = 0
+    while True:
+        rate_limiter.acquire(url)
+        time_start = time.perf_counter()
+        response = session.request(method, url, **kwargs)
+        metrics.observe("caravel_request_seconds", time.perf_counter() - time_start, endpoint=metrics.endpoint(url))
+        if not kwargs.get("stream"):
+            metrics.inc("caravel_downloaded_bytes_total", len(response.content), host=urlsplit(url).netloc)
+        rate_limiter.update(url, response.status_code, response.headers)
+        if response.status_code == 429:
+            metrics.inc("caravel_rate_limited_total", endpoint=metrics.endpoint(url))
+        if response.status_code != 429 or attempt >= max_rate_limit_retries:
+            return response
+        attempt += 1
+        metrics.inc("caravel_retries_total", reason="rate_limit")
+        events.message(f"Rate limit exceeded on {rate_limiter.endpoint_class(url)}, retrying ({attempt}/{max_rate_limit_retries})", "warning")
+        response.close()
+
+
+def get(url: str, params=None, **kwargs) -> requests.Response:
+    """Shortcut for request("GET", ...). Use this instead of requests.get()."""
+    return request("GET", url, params=params, **kwargs)
+
+
+def post(url: str, data=None, json=None, **kwargs) -> requests.Response:
+    """Shortcut for request("POST", ...). Use this instead of requests.post()."""
+    return request("POST", url, data=data, json=json, **kwargs)
+
+
+def get_json(url: str, params=None, fresh: bool = False, **kwargs):
+    """GETs a Mangadex API endpoint and returns the decoded JSON, going through the on-disk API cache first. Only
+    successful responses are cached. In offline mode, raises api_cache.CacheMiss if the response isn't cached.
+
+    Args:
+        url (str): Full URL to request.
+        params (optional): Parameters of the request.
+        fresh (bool, optional): Don't use the cached response, but replace it with the new one, so later calls don't
+            get the old one back. Defaults to False.
+
+    Returns:
+        The decoded JSON of the response.
+    """
+    cache = api_cache.get_cache()
+    if cache is not None and not fresh:
+        data = cache.load(url, params)
+        metrics.inc("caravel_api_cache_total", result="miss" if data is None else "hit")
+        if data is not None:
+            return data
+    response = get(url, params, **kwargs)
+    data = response.json()
+    if cache is not None and response.status_code == 200 and not (isinstance(data, dict) and data.get("result") == "error"):
+        cache.store(url, params, data)
+    return data
+
+
+def close_all() -> None:
+    """Closes every pooled session. Safe to call more than once."""
+    with _lock:
+        sessions = list(_sessions.values())
+        _sessions.clear()
+    for session in sessions:
+        session.close()
@@ -0,0 +1,311 @@
+# Job journal. A SQLite database in the working directory that remembers, for every series, volume, chapter and page,
+# how far it got: pages are pending or downloaded (with their size and hash), volumes are pending, downloaded,
+# converted or pushed. A restart asks the journal what is left instead of looking at the files, and pages are only
+# marked downloaded once they were written atomically, so a page in the journal is a complete page.
+# It also holds the follow list of watch.py, with the last feed sync of each followed series.
+# To see what is left: "caravel status" for every series, "caravel status <mangadex id>" for one.
+
+import argparse
+import json
+import sqlite3
+import sys
+import threading
+import time
+
+from .misc_utils import working_path
+
+VOLUME_STATES = ("pending", "downloaded", "converted", "pushed") # * In order, a volume only moves forward
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    mdid TEXT PRIMARY KEY,
+    title TEXT,
+    workdir TEXT,
+    updated REAL
+);
+CREATE TABLE IF NOT EXISTS volumes (
+    mdid TEXT,
+    volume TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    path TEXT,
+    updated REAL,
+    book_id INTEGER,
+    outdated INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (mdid, volume)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS chapters (
+    mdid TEXT,
+    volume TEXT,
+    chapter TEXT,
+    chapter_id TEXT,
+    pages INTEGER,
+    PRIMARY KEY (mdid, volume, chapter)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS pages (
+    mdid TEXT,
+    volume TEXT,
+    chapter TEXT,
+    page TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    file TEXT,
+    bytes INTEGER,
+    sha256 TEXT,
+    PRIMARY KEY (mdid, volume, chapter, page)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS follows (
+    mdid TEXT PRIMARY KEY,
+    title TEXT,
+    profile TEXT,
+    volumes TEXT,
+    cursor TEXT,
+    full_sync REAL,
+    structure TEXT,
+    seen TEXT,
+    coverage TEXT
+);
+"""
+
+# * Columns added since the first journals, added to older databases when they are opened
+ADDED_COLUMNS = {
+    "volumes": [("book_id", "INTEGER"), ("outdated", "INTEGER NOT NULL DEFAULT 0")],
+    "follows": [("coverage", "TEXT")],
+}
+
+
+class Journal:
+    """The journal database. Safe to use from several threads, every call is its own transaction."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL") # * Readers (ie the status command) don't block a running download
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {row[1] for row in self.db.execute(f"PRAGMA table_info({table})")}
+            for column, definition in columns:
+                if column not in existing:
+                    self.db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+    def add_series(self, series: dict, volumes: list) -> None:
+        """Records a series and the chapters of the selected volumes. Volumes and chapters already in the journal keep
+        their state.
+
+        Args:
+            series (dict): See pipeline.run_pipeline().
+            volumes (list): Names of the selected volumes, ie "0001".
+        """
+        structure = series['pseudo_file_structure'][series['clean_title']]
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO series VALUES (?, ?, ?, ?) ON CONFLICT(mdid) DO UPDATE SET title=excluded.title, workdir=excluded.workdir, updated=excluded.updated",
+                            (series['mdid'], series['series_title'], series['workdir'], now))
+            self.db.executemany("INSERT OR IGNORE INTO volumes (mdid, volume, state, updated) VALUES (?, ?, 'pending', ?)",
+                                [(series['mdid'], volume, now) for volume in volumes])
+            self.db.executemany("INSERT OR IGNORE INTO chapters (mdid, volume, chapter, chapter_id) VALUES (?, ?, ?, ?)",
+                                [(series['mdid'], volume, chapter, chapter_id) for volume in volumes for chapter, chapter_id in structure.get(volume, {}).items()])
+
+    def volume_chapters(self, mdid: str, volume: str) -> dict:
+        """Returns what is known of the chapters of a volume, in one query.
+
+        Returns:
+            dict: {chapter: {"pages": page count or None if never asked to MD@Home, "done": {downloaded page names}}}
+        """
+        with self.lock:
+            chapters = {chapter: {"pages": pages, "done": set()} for chapter, pages in
+                        self.db.execute("SELECT chapter, pages FROM chapters WHERE mdid=? AND volume=?", (mdid, volume))}
+            for chapter, page in self.db.execute("SELECT chapter, page FROM pages WHERE mdid=? AND volume=? AND state='downloaded'", (mdid, volume)):
+                chapters.setdefault(chapter, {"pages": None, "done": set()})["done"].add(page)
+        return chapters
+
+    def set_chapter_pages(self, mdid: str, volume: str, chapter: str, chapter_id: str, page_count: int) -> None:
+        """Records how many pages a chapter has. If it changed (the chapter was uploaded again), its pages start over."""
+        with self.lock, self.db:
+            row = self.db.execute("SELECT pages FROM chapters WHERE mdid=? AND volume=? AND chapter=?", (mdid, volume, chapter)).fetchone()
+            if row is not None and row[0] is not None and row[0] != page_count:
+                self.db.execute("DELETE FROM pages WHERE mdid=? AND volume=? AND chapter=?", (mdid, volume, chapter))
+            self.db.execute("INSERT INTO chapters VALUES (?, ?, ?, ?, ?) ON CONFLICT(mdid, volume, chapter) DO UPDATE SET chapter_id=excluded.chapter_id, pages=excluded.pages",
+                            (mdid, volume, chapter, chapter_id, page_count))
+            self.db.executemany("INSERT OR IGNORE INTO pages (mdid, volume, chapter, page) VALUES (?, ?, ?, ?)",
+                                [(mdid, volume, chapter, str(im).zfill(5)) for im in range(page_count)])
+
+    def record_pages(self, mdid: str, page_results: list) -> None:
+        """Marks the pages that were written successfully as downloaded.
+
+        Args:
+            mdid (str): Mangadex ID of the series.
+            page_results (list): Results from page_downloader, the jobs must have "volume", "chapter" and "page".
+        """
+        rows = [(result["path"].replace("\\", "/").rsplit("/", 1)[-1], result["bytes"], result.get("sha256"),
+                 mdid, result["job"]["volume"], result["job"]["chapter"], result["job"]["page"])
+                for result in page_results if result["success"]]
+        with self.lock, self.db:
+            self.db.executemany("UPDATE pages SET state='downloaded', file=?, bytes=?, sha256=? WHERE mdid=? AND volume=? AND chapter=? AND page=?", rows)
+
+    def volume_state(self, mdid: str, volume: str) -> str:
+        with self.lock:
+            row = self.db.execute("SELECT state FROM volumes WHERE mdid=? AND volume=?", (mdid, volume)).fetchone()
+        return row[0] if row is not None else "pending"
+
+    def volume_path(self, mdid: str, volume: str) -> str:
+        """Returns the path of the converted book of a volume, or None."""
+        with self.lock:
+            row = self.db.execute("SELECT path FROM volumes WHERE mdid=? AND volume=?", (mdid, volume)).fetchone()
+        return row[0] if row is not None else None
+
+    def volume_book(self, mdid: str, volume: str) -> dict:
+        """Returns what Calibre has of a volume.
+
+        Returns:
+            dict: {"book_id": Calibre ID of the book it was pushed as, or None if unknown, "outdated": whether the
+            volume was reopened after it was pushed (see reopen_volume()), so its book must be replaced}
+        """
+        with self.lock:
+            row = self.db.execute("SELECT book_id, outdated FROM volumes WHERE mdid=? AND volume=?", (mdid, volume)).fetchone()
+        return {"book_id": row[0], "outdated": bool(row[1])} if row is not None else {"book_id": None, "outdated": False}
+
+    def set_volume_state(self, mdid: str, volume: str, state: str, path: str = None, book_id: int = None) -> None:
+        """Moves a volume to a state, ie "converted" with the path of the book, or "pushed" with the Calibre ID of the
+        book. A volume never moves backwards."""
+        with self.lock, self.db:
+            row = self.db.execute("SELECT state FROM volumes WHERE mdid=? AND volume=?", (mdid, volume)).fetchone()
+            if row is not None and VOLUME_STATES.index(row[0]) > VOLUME_STATES.index(state):
+                return
+            self.db.execute("INSERT INTO volumes (mdid, volume, state, path, updated, book_id) VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(mdid, volume) DO UPDATE SET "
+                            "state=excluded.state, path=coalesce(excluded.path, volumes.path), updated=excluded.updated, "
+                            "book_id=coalesce(excluded.book_id, volumes.book_id), outdated=volumes.outdated AND excluded.state!='pushed'",
+                            (mdid, volume, state, path, time.time(), book_id))
+
+    def reset_volume(self, mdid: str, volume: str) -> None:
+        """Forgets everything about a volume, so it is downloaded, converted and pushed again on the next run."""
+        with self.lock, self.db:
+            for table in ("volumes", "chapters", "pages"):
+                self.db.execute(f"DELETE FROM {table} WHERE mdid=? AND volume=?", (mdid, volume))
+
+    def reopen_volume(self, mdid: str, volume: str, chapters: list = ()) -> None:
+        """Moves a volume back to pending because its chapters changed on Mangadex, so it is converted and pushed again.
+        The listed chapters are forgotten and downloaded again, the other pages are kept. If it was pushed, the book in
+        Calibre is marked outdated, see volume_book()."""
+        with self.lock, self.db:
+            self.db.execute("UPDATE volumes SET state='pending', outdated=(outdated OR state='pushed'), updated=? WHERE mdid=? AND volume=?",
+                            (time.time(), mdid, volume))
+            for chapter in chapters:
+                for table in ("chapters", "pages"):
+                    self.db.execute(f"DELETE FROM {table} WHERE mdid=? AND volume=? AND chapter=?", (mdid, volume, chapter))
+
+    def follow(self, mdid: str, title: str, profile: str, volumes) -> None:
+        """Adds a series to the follow list, or changes its profile and volumes. Its last sync is kept.
+
+        Args:
+            mdid (str): Mangadex ID of the series.
+            title (str): Real title of the series.
+            profile (str): KCC profile its volumes are made for.
+            volumes: "all" or a list of volume numbers to keep up to date.
+        """
+        with self.lock, self.db:
+            self.db.execute("INSERT INTO follows (mdid, title, profile, volumes) VALUES (?, ?, ?, ?) ON CONFLICT(mdid) DO UPDATE SET title=excluded.title, profile=excluded.profile, volumes=excluded.volumes",
+                            (mdid, title, profile, json.dumps(volumes)))
+
+    def unfollow(self, mdid: str) -> bool:
+        """Removes a series from the follow list. Returns whether it was followed."""
+        with self.lock, self.db:
+            return self.db.execute("DELETE FROM follows WHERE mdid=?", (mdid,)).rowcount > 0
+
+    def followed(self) -> list:
+        """Returns the follow list.
+
+        Returns:
+            list: One dict per series: {"mdid", "title", "profile", "volumes", "cursor": updatedAt of the newest chapter
+            seen or None, "full_sync": time of the last full feed sync or None, "structure": pseudo file structure or
+            None, "seen": {chapter id: updatedAt}, "coverage": chapter numbers of each group, see func.select_uploads(),
+            or None}
+        """
+        with self.lock:
+            rows = self.db.execute("SELECT mdid, title, profile, volumes, cursor, full_sync, structure, seen, coverage FROM follows ORDER BY title").fetchall()
+        return [{"mdid": mdid, "title": title, "profile": profile, "volumes": json.loads(volumes), "cursor": cursor, "full_sync": full_sync,
+                 "structure": json.loads(structure) if structure else None, "seen": json.loads(seen) if seen else {},
+                 "coverage": json.loads(coverage) if coverage else None}
+                for mdid, title, profile, volumes, cursor, full_sync, structure, seen, coverage in rows]
+
+    def save_sync(self, mdid: str, cursor: str, full_sync: float, structure: dict, seen: dict, coverage: dict = None) -> None:
+        """Records the result of a feed sync of a followed series, see followed()."""
+        with self.lock, self.db:
+            self.db.execute("UPDATE follows SET cursor=?, full_sync=?, structure=?, seen=?, coverage=? WHERE mdid=?",
+                            (cursor, full_sync, json.dumps(structure), json.dumps(seen), json.dumps(coverage) if coverage is not None else None, mdid))
+
+    def status(self, mdid: str = None) -> list:
+        """Summarizes what is left, per volume.
+
+        Args:
+            mdid (str, optional): Only this series. Defaults to every series.
+
+        Returns:
+            list: One dict per volume: {"mdid", "title", "volume", "state", "chapters", "unknown_chapters" (never asked to
+            MD@Home, page count unknown), "pages", "downloaded"}
+        """
+        query = """
+            SELECT v.mdid, s.title, v.volume, v.state,
+                (SELECT count(*) FROM chapters c WHERE c.mdid=v.mdid AND c.volume=v.volume),
+                (SELECT count(*) FROM chapters c WHERE c.mdid=v.mdid AND c.volume=v.volume AND c.pages IS NULL),
+                (SELECT count(*) FROM pages p WHERE p.mdid=v.mdid AND p.volume=v.volume),
+                (SELECT count(*) FROM pages p WHERE p.mdid=v.mdid AND p.volume=v.volume AND p.state='downloaded')
+            FROM volumes v LEFT JOIN series s ON s.mdid=v.mdid
+        """
+        params = ()
+        if mdid is not None:
+            query += " WHERE v.mdid=?"
+            params = (mdid,)
+        with self.lock:
+            rows = self.db.execute(query + " ORDER BY s.title, v.volume", params).fetchall()
+        keys = ("mdid", "title", "volume", "state", "chapters", "unknown_chapters", "pages", "downloaded")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
+
+
+_journal = None
+_journal_lock = threading.Lock()
+
+
+def get_journal() -> Journal:
+    """Returns the shared journal, opening it on first use."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = Journal(working_path("journal.sqlite3"))
+        return _journal
+
+
+def print_status(mdid: str = None) -> None:
+    """Prints what is left to do, per volume of every series in the journal (or only one series)."""
+    rows = get_journal().status(mdid)
+    if not rows:
+        print("Nothing in the journal")
+        return
+    title = None
+    for row in rows:
+        if row["title"] != title:
+            title = row["title"]
+            print(f"\n{title} ({row['mdid']})")
+        left = row["pages"] - row["downloaded"]
+        detail = ""
+        if row["state"] == "pending":
+            detail = f"{left} of {row['pages']} pages left"
+            if row["unknown_chapters"]:
+                detail += f", {row['unknown_chapters']} of {row['chapters']} chapters not started"
+        print(f"  Volume {row['volume']}: {row['state']}" + (f" ({detail})" if detail else ""))
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="caravel status", description="Show what is left to do for the series in the journal.")
+    parser.add_argument("mdid", nargs="?", help="Only this series")
+    args = parser.parse_args(argv)
+    print_status(args.mdid)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,396 @@
+# This script consolidates KCC tasks for converting comic files to an EPUB files
+
+import concurrent.futures
+import os
+import signal
+import subprocess
+import threading
+import time
+import zipfile
+
+from . import events
+from . import metrics
+from .fair_queue import FairQueue
+from .misc_utils import IMAGE_EXTENSIONS
+from .settings import ereader_profile, kcc_cpu_affinity, kcc_niceness, kcc_path, kcc_timeout, kcc_workers
+
+# Screen resolution (width, height) and whether the screen is greyscale, for each KCC profile. Copied from KCC's own
+# profile list, see https://github.com/darodi/kcc#profiles. Used to prepare images for the device before KCC.
+PROFILE_RESOLUTIONS = {
+    "K1": (600, 670, True), "K2": (600, 670, True), "K34": (600, 800, True), "K578": (600, 800, True),
+    "KDX": (824, 1000, True), "KPW": (758, 1024, True), "KPW5": (1236, 1648, True), "KV": (1072, 1448, True),
+    "KO": (1264, 1680, True), "K11": (1072, 1448, True), "KS": (1860, 2480, True), "KoMT": (600, 800, True),
+    "KoG": (768, 1024, True), "KoGHD": (1072, 1448, True), "KoA": (758, 1024, True), "KoAHD": (1080, 1440, True),
+    "KoAH2O": (1080, 1430, True), "KoAO": (1404, 1872, True), "KoN": (758, 1024, True), "KoC": (1072, 1448, True),
+    "KoL": (1264, 1680, True), "KoF": (1440, 1920, True), "KoS": (1440, 1920, True), "KoE": (1404, 1872, True),
+}
+
+def _kill_tree(process: subprocess.Popen) -> None:
+    # * kcc-c2e converts with a pool of worker processes, killing it alone would leave them running
+    try:
+        if os.name == "nt":
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(process.pid)], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        else:
+            os.killpg(process.pid, signal.SIGKILL) # * Its own session, see run_kcc()
+    except (OSError, subprocess.SubprocessError):
+        pass # ? Already gone
+    process.kill()
+
+def run_kcc(args: list, timeout: float = kcc_timeout) -> dict:
+    """Runs kcc-c2e as a managed subprocess: output is captured, the process gets a lower priority (and the CPU
+    affinity from the settings on Linux) so downloads stay responsive, and it is killed with its workers if it takes
+    too long.
+
+    Args:
+        args (list): Arguments to pass to kcc-c2e, without the executable itself.
+        timeout (float, optional): Seconds before the process is killed. Defaults to the kcc_timeout setting.
+
+    Returns:
+        dict: {"returncode": int (None if it timed out), "output": str (stdout and stderr combined)}
+    """
+    creationflags = 0
+    if os.name == "nt":
+        creationflags = subprocess.CREATE_NEW_PROCESS_GROUP
+        if kcc_niceness > 0:
+            creationflags |= subprocess.BELOW_NORMAL_PRIORITY_CLASS
+    # * In a session of its own, so its workers can be killed with it
+    process = subprocess.Popen([kcc_path or "kcc-c2e"] + args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, creationflags=creationflags, start_new_session=os.name != "nt")
+    # * Set from the parent once started, preexec_fn is not safe with the download threads running
+    try:
+        if hasattr(os, "setpriority") and kcc_niceness > 0:
+            os.setpriority(os.PRIO_PROCESS, process.pid, kcc_niceness)
+        if hasattr(os, "sched_setaffinity") and len(kcc_cpu_affinity) > 0:
+            os.sched_setaffinity(process.pid, kcc_cpu_affinity)
+    except OSError:
+        pass # ? The process may already be done, or we don't have the rights. Not worth failing the conversion
+    try:
+        output, _ = process.communicate(timeout=timeout)
+        returncode = process.returncode
+    except subprocess.TimeoutExpired:
+        _kill_tree(process)
+        output, _ = process.communicate()
+        output += f"\nkcc-c2e killed after {timeout} seconds".encode()
+        returncode = None
+    return {"returncode": returncode, "output": output.decode(errors="replace")}
+
+def count_pages(path: str) -> int:
+    """Returns how many images a volume folder (or .cbz archive) has."""
+    if os.path.isfile(path):
+        with zipfile.ZipFile(path) as archive:
+            return sum(1 for name in archive.namelist() if name.lower().endswith(IMAGE_EXTENSIONS))
+    return sum(1 for _, _, files in os.walk(path) for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+
+def img_dir_to_epub(series_path: str, volume_id: int, verbose = True, delete = True, tablet_profile = ereader_profile, volume_name: str = None, timeout: float = kcc_timeout, preprocessed: bool = False) -> dict:
+    """Executes a KCC (Kindle Comic Converter) command to convert a folder of images to an EPUB file.
+    If "<volume>.cbz" exists next to the volume folder (see cbz_storage), that archive is converted instead.
+
+    Note that a folder cannot contain illegal characters. This function assumes that the folder has a clean name. ie, for "Blame! Vol. 1", the folder name should be "Blame Vol. 1"
+    This also implies that the folders are already created. This function WILL NOT create any folder.
+    The function follows the structure that retriever.py creates. See that script for more details.
+    This function will execute a KCC CLI command. See https://github.com/ciromattia/kcc/releases/tag/v5.6.2, get "kcc-c2e_5.6.2.exe", rename to "kcc-c2e.exe", add to PATH.
+
+    The working directory structure should be as follows:
+    workdir
+    > /book_series_1
+    > /book_series_2 (ie, "Blame")
+        > /book_series_2_volume (ie, "0001", representing volume 1)
+        > /book_series_2_title (ie, "0002")
+            > /book_series_2_title_chapter_1 (ie, "1", depending on naming scheme of the source)
+            > /book_series_2_title_chapter_2 (ie, "1.5", example of an unusual naming scheme, Windows keeps it in the right order)
+                > /book_series_2_title_chapter_2_page_1 (ie, "00001.png")
+                > /book_series_2_title_chapter_2_page_2 (ie, "00002.png")
+                > ...
+
+    Where the main arguments to this function are:
+    - The path to BOOK SERIES, not workdir! (ie: .../workdir/book_series_2)
+    - The volume ID of the colume INSIDE the series folder that we want to convert (ie: 2 = third ordered folder inside .../workdir/book_series_2)
+
+    Args:
+        series_path (str): Directory (using \\ in path) in which volume folders are located.
+        volume_id (int): ID of the volume to convert from an ordered list inside the series folder. retriever.py creates them in order, ie: "0001", "0002", "0003", etc. "stranded" may also exist
+        delete (bool, optional): Whether to delete the original folder after conversion. Defaults to True.
+        verbose (bool, optional): Whether to print messages to the console. Defaults to True.
+        tablet_profile (str, optional): Profile to use for the conversion. Defaults to "KoL" (Kobo Libra 2 or H20). See VALID_TABLET_PROFILES for a list.
+        volume_name (str, optional): Name of the volume folder (ie "0002"). When given, it is used instead of volume_id to find the folder. Use this when
+            other volumes may be converting at the same time, since their output changes the order of the series folder.
+        timeout (float, optional): Seconds before kcc-c2e is killed and the conversion reported as failed. Defaults to the kcc_timeout setting.
+        preprocessed (bool, optional): The pages were already resized and split for the profile (see preprocess.py), so KCC doesn't upscale or
+            stretch them again. Defaults to False.
+    Returns:
+        dict: Dictionary containing the following keys: "success" (bool), "full_path" (str), "error" (str), and "output" (str) once KCC was started.
+
+    Where "success" is True if the conversion was successful, and "full_path" is the full path to the converted file (which will be a .EPUB). Will be path to folder that failed if "success" is False.
+    "error" will be a string containing the error message if "success" is False, or a string with assumptions for any invalid inputs even if "success" is True.
+    "output" is everything kcc-c2e printed, useful to find out why KCC_STEP_FAILED happened.
+
+    List of errors:
+    - SERIES_FOLDER_DOES_NOT_EXIST: The series folder does not exist inside the filesystem
+    - VOLUME_ID_NOT_INTEGER: The volume ID is not an integer. Only sent if it couldn't be converted to an integer
+    - VOLUME_ID_OUT_OF_LOW_BOUNDS: The volume ID is less than 0. Not making assumptions so this will abort
+    - VOLUME_ID_OUT_OF_HIGH_BOUNDS: The volume ID is greater than the number of volumes in the series folder. Not making assumptions so this will abort
+    - DELETE_NOT_BOOLEAN: The "delete" parameter is not a boolean. Defaulting to False for safety
+    - TABLET_PROFILE_NOT_STRING: The "tablet_profile" parameter is not a string. Defaulting to empty string, but may result in undesired output, so it also disables "delete"
+    - TABLET_PROFILE_NOT_VALID: The "tablet_profile" parameter is not a valid profile. See VALID_TABLET_PROFILES for a list. Also disables "delete", see above
+    - VOLUME_IS_ALREADY_AN_EPUB: The volume folder is not a valid volume folder, but an EPUB with the same name exists. This is likely a bug in the script, please report it
+    - VOLUME_FOLDER_DOES_NOT_EXIST: The volume folder does not exist inside the filesystem
+    - VOLUME_FOLDER_IS_EMPTY: The volume folder is empty. Either a bad input or retriever.py aborted and this still passed. Not making assumptions so this will abort
+    - KCC_STEP_FAILED: The KCC command failed to execute, exited with an error or timed out, or the file failed to rename. This is a big step where many things can go wrong, see "output"
+    - CATASTROPHIC_ERROR: A catastrophic error occured in the script. See console for details. This is likely a bug in the script, please report it
+    """
+
+    final_error_msg = "" # This will be the final error message if some inputs are invalid or assumptions are made
+    if not type(verbose) is bool:
+        print("Error: " + str(verbose) + " is not a valid value for 'verbose', must be BOOLEAN. Defaulting to True")
+        verbose = True
+
+    try:
+        # Start by validating input and exiting or asking for new inputs if they are invalid:
+        if not os.path.isdir(series_path):
+            # Make sure the series folder exists
+            print("Error: " + series_path + " is not a valid directory, series folder does not exist") if verbose else None
+            return {
+                "success": False,
+                "full_path": '"' + series_path + '" does not exist',
+                "error": "SERIES_FOLDER_DOES_NOT_EXIST"
+                }
+
+        if volume_name is not None:
+            # Looking up by name, make sure the folder is there and use its current position for the checks below
+            if not volume_name in os.listdir(series_path) and not volume_name + '.cbz' in os.listdir(series_path):
+                print("Error: " + volume_name + " is not a valid volume directory, volume folder does not exist") if verbose else None
+                return {
+                    "success": False,
+                    "full_path": series_path,
+                    "error": "VOLUME_FOLDER_DOES_NOT_EXIST"
+                    }
+            series_content = os.listdir(series_path)
+            volume_id = series_content.index(volume_name if volume_name in series_content else volume_name + '.cbz')
+
+        if not type(volume_id) is int:
+            # Make sure the volume is a number
+            try:
+                volume_id = int(volume_id) # If this works, keep going. volume_id likely entered as float or string
+            except:
+                print("Error: " + str(volume_id) + " is not a valid volume ID, must be INTEGER") if verbose else None
+                return {
+                    "success": False,
+                    "full_path": series_path,
+                    "error": "VOLUME_ID_NOT_INTEGER"
+                    }
+
+        if volume_id < 0:
+            # Make sure the volume is a positive number, ids are 0-indexed
+            print("Error: " + volume_id + " is not a valid volume ID, must be POSITIVE") if verbose else None
+            return {
+                "success": False,
+                "full_path": series_path,
+                "error": "VOLUME_ID_OUT_OF_LOW_BOUNDS"
+                }
+
+        if volume_id >= len(os.listdir(series_path)):
+            # Make sure the volume is not out of bounds
+            print("Error: " + volume_id + " is not a valid volume, must be less than " + str(len(os.listdir(series_path))) + " (Entered is out of bounds)") if verbose else None
+            return {
+                "success": False,
+                "full_path": series_path,
+                "error": "VOLUME_ID_OUT_OF_HIGH_BOUNDS"
+                }
+
+        # Check other parameters too, like tablet_profile, delete, etc. if needed. Create a final error message for assumptions made with invalid inputs
+        if not type(delete) is bool:
+            # Make sure "delete" is a boolean
+            print("Error: " + str(delete) + " is not a valid value for 'delete', must be BOOLEAN. Defaulting to False") if verbose else None
+            final_error_msg += "DELETE_NOT_BOOLEAN, "
+            delete = False
+
+        if not type(tablet_profile) is str:
+            # Make sure "tablet_profile" is a string
+            print("Error: " + str(tablet_profile) + " is not a valid value for 'tablet_profile', must be STRING. Defaulting to empty string") if verbose else None
+            final_error_msg += "TABLET_PROFILE_NOT_STRING, "
+            tablet_profile = ""
+            delete = False # If the profile is invalid, we don't want to delete the original folder in case the output is not what we want
+        else:
+            # Tablet was specified but check if it's valid:
+            VALID_TABLET_PROFILES = ["K1", "K2", "K34", "K578", "KDX", "KPW", "KPW5", "KV", "KO", "K11", "KS", "KoMT", "KoG", "KoGHD", "KoA", "KoAHD", "KoAH2O", "KoAO", "KoN", "KoC", "KoL", "KoF", "KoS", "KoE"]
+            if not tablet_profile in VALID_TABLET_PROFILES:
+                print("Error: " + str(tablet_profile) + " is not a valid value for 'tablet_profile'. Defaulting to empty string") if verbose else None
+                final_error_msg += "TABLET_PROFILE_NOT_VALID, "
+                tablet_profile = ""
+                delete = False # If the profile is invalid, we don't want to delete the original folder in case the output is not what we want
+
+
+        # If we didn't exit, the inputs SHOULD be valid. We haven't tried checking if the directories exist yet though
+        # First, get the variants we need to work with paths:
+        if volume_name is not None:
+            volume_text = volume_name
+            book_title = os.path.basename(series_path) + " - Vol. " + (str(int(volume_name)) if volume_name.isdigit() else volume_name)
+        else:
+            book_title = os.path.basename(series_path) + " - Vol. " + str(volume_id+1) # This will exclude illegal characters, but they are allowed in the metadata later
+            volume_text = os.listdir(series_path)[volume_id] # listdir is 0-indexed, should be converted before passing this if needed. We do this because "1" may not be the first volume
+        inside_workdir = os.path.join(series_path, volume_text)
+        if os.path.isfile(inside_workdir + '.cbz'):
+            # * Pages stored in an archive (see cbz_storage), KCC reads it directly and names the output after it
+            inside_workdir = inside_workdir + '.cbz'
+
+        if not os.path.isdir(inside_workdir) and not os.path.isfile(inside_workdir):
+            # Make sure the volume folder exists
+            # It might have failed previously, so check if there's an EPUB and report it if so:
+            if os.path.isfile(os.path.join(series_path, book_title + '.epub')):
+                print("Error: " + inside_workdir + " is not a valid volume directory, volume folder does not exist. An EPUB with the same name exists, aborting.") if verbose else None
+                return {
+                    "success": False,
+                    "full_path": os.path.join(series_path, book_title + '.epub'),
+                    "error": "VOLUME_IS_ALREADY_AN_EPUB"
+                    }
+            else:
+                print("Error: " + inside_workdir + " is not a valid volume directory, volume folder does not exist") if verbose else None
+                return {
+                    "success": False,
+                    "full_path": series_path,
+                    "error": "VOLUME_FOLDER_DOES_NOT_EXIST"
+                    }
+
+        if os.path.isdir(inside_workdir) and len(os.listdir(inside_workdir)) == 0:
+            # Check if the folder is empty
+            print("Error: " + inside_workdir + " is empty, is this the right folder?") if verbose else None
+            return {
+                "success": False,
+                "full_path": series_path,
+                "error": "VOLUME_FOLDER_IS_EMPTY"
+                }
+
+        # By now, we should be pretty sure that we have all that we need. We can start the conversion process.
+        # Prepare the KCC CLI command and include all related specified parameters:
+        kcc_args = ['--manga-style'] + (['--profile', tablet_profile] if tablet_profile != "" else []) + ([] if preprocessed else ['--upscale', '--stretch']) + ['--mozjpeg', '--title', book_title, '--format', 'EPUB', '--hq'] + (['--delete'] if delete else []) + [inside_workdir]
+        # Interesting parameters for later:
+        # --batchsplit 2: consider every subdir as a volume. This might be good to process the entire workdir at once
+        # --output OUTPUT: output to OUTPUT instead of the current directory (?)
+        kcc_output = ''
+        try:
+            page_count = count_pages(inside_workdir) # * Before KCC, --delete removes the input
+            time_start = time.perf_counter()
+            kcc_run = run_kcc(kcc_args, timeout)
+            kcc_output = kcc_run["output"]
+            if kcc_run["returncode"] != 0:
+                raise RuntimeError("kcc-c2e " + ("timed out" if kcc_run["returncode"] is None else "exited with code " + str(kcc_run["returncode"])))
+            if page_count > 0:
+                metrics.observe("caravel_kcc_seconds_per_page", (time.perf_counter() - time_start) / page_count)
+                metrics.inc("caravel_kcc_pages_total", page_count)
+            # Profile makes it into a .kepub.epub, change it back:
+            os.rename(os.path.join(series_path, volume_text + '.kepub.epub'), os.path.join(series_path, volume_text + '.epub'))
+            # At this point, we have a simple epub containing all book content and correctly formated, profivided the images and chapters were in a clean order
+            print('Converted folders to epub') if verbose else None
+            final_error_msg = final_error_msg[:-2] # Remove the last ", " from the final error message
+            return {
+                "success": True,
+                "full_path": os.path.join(series_path, volume_text + '.epub'),
+                "error": final_error_msg,
+                "output": kcc_output
+                }
+        except Exception as e:
+            print('Failed passing kcc command or renaming the file, aborting.\nFILES MAY HAVE BEEN DELETED, CORRUPTED, OR CREATED.\nSee below for details:') if verbose else None
+            events.message('Error: ' + str(e), "error") # This will always show because it is helpful in debugging. May be changed later
+            return {
+                "success": False,
+                "full_path": series_path,
+                "error": "KCC_STEP_FAILED",
+                "output": kcc_output
+                }
+
+    except Exception as e:
+        print('Catasrophic error in "kcc_conversion.py", aborting. See below for details:') if verbose else None
+        events.message('Error message up to failure:\n' + final_error_msg, "error") # This will always show because it is helpful in debugging. May be changed later
+        events.message("Error: " + str(e), "error")
+        return {
+            "success": False,
+            "full_path": "",
+            "error": "CATASTROPHIC_ERROR"
+            }
+
+
+class ConversionScheduler:
+    """Runs several KCC conversions at the same time. Each conversion is its own kcc-c2e process, the pool threads only
+    wait on them, so "workers" is how many processes (and roughly how many cores) conversion uses at once.
+    Conversions wait in a fair queue (see fair_queue.py): when several series run at the same time, a series with a
+    hundred volumes ready to convert doesn't hold up the others, each gets workers in proportion to its weight.
+    """
+
+    def __init__(self, workers: int = kcc_workers):
+        self.workers = max(workers, 1)
+        self.queue = FairQueue()
+        self.condition = threading.Condition()
+        self.threads = [] # * Started as conversions come in, up to workers
+        self.closed = False
+
+    def _worker(self) -> None:
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: len(self.queue) > 0 or self.closed)
+                if len(self.queue) == 0:
+                    return # * Shut down and nothing left to convert
+                future, function, args, kwargs = self.queue.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(function(*args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+    def submit(self, series_path: str, volume_name: str, verbose = True, delete = False, tablet_profile = ereader_profile, preprocessed = False,
+               series: str = None, weight: float = 1.0) -> concurrent.futures.Future:
+        """Queues the conversion of one volume folder. Returns a future with the result of img_dir_to_epub().
+        series and weight say whose conversion it is, see run()."""
+        return self.run(img_dir_to_epub, series_path, 0, verbose, delete, tablet_profile, volume_name, kcc_timeout, preprocessed, series=series, weight=weight)
+
+    def run(self, function, *args, series: str = None, weight: float = 1.0, **kwargs) -> concurrent.futures.Future:
+        """Queues any other conversion job (ie epub_builder.build_epub()) so it shares the same workers.
+
+        Args:
+            function: Called with args and kwargs on a worker.
+            series (str, optional): Who the conversion is for (the Mangadex ID), see fair_queue.py. Defaults to None.
+            weight (float, optional): Share of the workers the series gets, relative to the others. Defaults to 1.0.
+
+        Returns:
+            concurrent.futures.Future: Future with what function returned.
+        """
+        future = concurrent.futures.Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Conversion scheduler was shut down")
+            self.queue.put((future, function, args, kwargs), series, weight)
+            if len(self.threads) < self.workers:
+                thread = threading.Thread(target=self._worker, name="kcc_" + str(len(self.threads)), daemon=True)
+                thread.start()
+                self.threads.append(thread)
+            self.condition.notify()
+        return future
+
+    def shutdown(self, wait = True) -> None:
+        """Stops the workers once the queued conversions are done."""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler() -> ConversionScheduler:
+    """Returns the shared conversion scheduler, starting it on first use."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ConversionScheduler()
+        return _scheduler
+
+def close_scheduler() -> None:
+    """Stops the shared conversion scheduler if it was started, once its queued conversions are done."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.shutdown()
+            _scheduler = None
@@ -0,0 +1,258 @@
+# Run metrics. Counters and histograms for where the time of a run goes: request latency per endpoint, bytes per host,
+# retries and 429s, pages, KCC seconds per page and Calibre push time, plus the peak memory of the process. They are
+# written as a Prometheus textfile (for node_exporter's textfile collector, refreshed every metrics_interval seconds
+# while the run goes on) and as a JSON run report at the end. Nothing is recorded if neither file is set.
+# See https://github.com/prometheus/node_exporter#textfile-collector
+
+import json
+import os
+import re
+import sys
+import threading
+import time
+from urllib.parse import urlsplit
+
+try:
+    import resource
+except ImportError: # * Windows, only tracemalloc then
+    resource = None
+
+from . import events
+from .settings import api_url, metrics_interval, metrics_report, metrics_textfile, metrics_trace_memory
+
+API_HOST = urlsplit(api_url).netloc
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+# Every metric: name -> (type, help, buckets for histograms)
+METRICS = {
+    "caravel_request_seconds": ("histogram", "Time to get a response, per endpoint (pages include saving them)", LATENCY_BUCKETS),
+    "caravel_downloaded_bytes_total": ("counter", "Bytes downloaded, per host", None),
+    "caravel_rate_limited_total": ("counter", "429 responses from Mangadex, per endpoint", None),
+    "caravel_retries_total": ("counter", "Requests made again, per reason (rate_limit, page, failover)", None),
+    "caravel_api_cache_total": ("counter", "Mangadex API responses served from the cache (hit) or requested (miss)", None),
+    "caravel_pages_total": ("counter", "Pages downloaded, per result (ok, failed)", None),
+    "caravel_kcc_seconds_per_page": ("histogram", "kcc-c2e run time divided by the pages of the volume", (0.05, 0.1, 0.25, 0.5, 1, 2, 5)),
+    "caravel_kcc_pages_total": ("counter", "Pages converted by kcc-c2e", None),
+    "caravel_calibre_push_seconds": ("histogram", "Time of a calibredb add", (1, 2.5, 5, 10, 30, 60, 120, 300)),
+    "caravel_calibre_books_total": ("counter", "Books handed to calibredb", None),
+}
+_ID = re.compile(r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$")
+
+
+def endpoint(url: str) -> str:
+    """Returns the label of a URL for per endpoint metrics: the path with IDs replaced for the API (ie
+    "/manga/{id}/feed"), only the first part of the path for image hosts (ie "/data-saver"), there are too many pages.
+    """
+    parts = urlsplit(url)
+    segments = [segment for segment in parts.path.split("/") if segment]
+    if parts.netloc != API_HOST:
+        return "/" + (segments[0] if segments else "")
+    return "/" + "/".join("{id}" if _ID.match(segment) else segment for segment in segments)
+
+
+def _labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+class Metrics:
+    """Thread-safe registry of the counters and histograms of a run. Use the module functions below, they do
+    nothing when metrics are off.
+    """
+
+    def __init__(self, trace_memory: bool = metrics_trace_memory):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.started_monotonic = time.monotonic()
+        self.counters = {} # * (name, labels) -> value
+        self.histograms = {} # * (name, labels) -> {"buckets": [count per bucket], "sum", "count", "max"}
+        self.traced = False
+        if trace_memory:
+            import tracemalloc # * Only when asked, it isn't needed otherwise
+            self.traced = not tracemalloc.is_tracing()
+        if self.traced:
+            tracemalloc.start() # ! Slows down every allocation, off by default
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        buckets = METRICS[name][2]
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0, "max": 0.0}
+            for index, bound in enumerate(buckets):
+                if value <= bound:
+                    histogram["buckets"][index] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+            histogram["max"] = max(histogram["max"], value)
+
+    def peak_memory(self) -> dict:
+        """Returns {"tracemalloc": peak bytes allocated by Python (None if not traced), "rss": peak resident size of
+        the process in bytes (None where the OS doesn't say)}."""
+        tracemalloc = sys.modules.get("tracemalloc") # * Not traced if nobody imported it
+        peak = {"tracemalloc": tracemalloc.get_traced_memory()[1] if tracemalloc is not None and tracemalloc.is_tracing() else None, "rss": None}
+        if resource is not None:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            peak["rss"] = maxrss if sys.platform == "darwin" else maxrss * 1024 # * Bytes on macOS, KB elsewhere
+        return peak
+
+    def pages(self) -> int:
+        with self.lock:
+            return int(self.counters.get(("caravel_pages_total", (("result", "ok"),)), 0))
+
+    def textfile(self) -> str:
+        """Returns every metric in the Prometheus text format."""
+        duration = time.monotonic() - self.started_monotonic
+        lines = []
+        with self.lock:
+            for name, (kind, help_text, buckets) in METRICS.items():
+                series = self.counters if kind == "counter" else self.histograms
+                keys = sorted(key for key in series if key[0] == name)
+                if not keys:
+                    continue
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+                for key in keys:
+                    labels = key[1]
+                    if kind == "counter":
+                        lines.append(f"{name}{_labels(labels)} {series[key]}")
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets, series[key]["buckets"]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_labels(labels + (('le', bound),))} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {series[key]['count']}")
+                    lines.append(f"{name}_sum{_labels(labels)} {series[key]['sum']}")
+                    lines.append(f"{name}_count{_labels(labels)} {series[key]['count']}")
+        pages = self.pages()
+        gauges = [
+            ("caravel_run_start_timestamp_seconds", "When the run started", {(): self.started}),
+            ("caravel_run_seconds", "How long the run has been going", {(): duration}),
+            ("caravel_pages_per_second", "Pages downloaded per second since the start of the run", {(): pages / duration if duration > 0 else 0.0}),
+            ("caravel_peak_memory_bytes", "Peak memory of the process, per source (tracemalloc, rss)",
+             {(("source", source),): value for source, value in self.peak_memory().items() if value is not None}),
+        ]
+        for name, help_text, values in gauges:
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+            lines += [f"{name}{_labels(labels)} {value}" for labels, value in values.items()]
+        return "\n".join(lines) + "\n"
+
+    def report(self) -> dict:
+        """Returns the JSON run report: {"started": unix time, "duration", "pages", "pages_per_second", "peak_memory",
+        "counters": {name: {labels: value}}, "histograms": {name: {labels: {"count", "sum", "mean", "max", "buckets":
+        {upper bound: count}}}}}, labels written as in the textfile ("" when there are none)."""
+        duration = time.monotonic() - self.started_monotonic
+        pages = self.pages()
+        report = {
+            "started": round(self.started, 3),
+            "duration": round(duration, 3),
+            "pages": pages,
+            "pages_per_second": round(pages / duration, 2) if duration > 0 else 0.0,
+            "peak_memory": self.peak_memory(),
+            "counters": {},
+            "histograms": {}
+        }
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                report["counters"].setdefault(name, {})[_labels(labels)] = value
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                report["histograms"].setdefault(name, {})[_labels(labels)] = {
+                    "count": histogram["count"],
+                    "sum": round(histogram["sum"], 4),
+                    "mean": round(histogram["sum"] / histogram["count"], 4),
+                    "max": round(histogram["max"], 4),
+                    "buckets": {str(bound): count for bound, count in zip(METRICS[name][2], histogram["buckets"])}
+                }
+        return report
+
+
+def _write(path: str, text: str) -> None:
+    # * Atomic, node_exporter must never read half a file
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(path + ".tmp", path)
+
+
+class _Flusher:
+    """Rewrites the textfile every interval seconds from a background thread, so long runs can be scraped."""
+
+    def __init__(self, metrics: Metrics, path: str, interval: float):
+        self.metrics = metrics
+        self.path = path
+        self.interval = interval
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="metrics-flusher", daemon=True)
+        self.thread.start()
+
+    def _run(self) -> None:
+        while not self.stop.wait(self.interval):
+            try:
+                _write(self.path, self.metrics.textfile())
+            except OSError as e:
+                events.message("Could not write metrics to " + self.path + ": " + str(e), "warning")
+
+    def close(self) -> None:
+        self.stop.set()
+        self.thread.join()
+
+
+_metrics = None
+_flusher = None
+_lock = threading.Lock()
+
+
+def get_metrics() -> Metrics:
+    """Returns the metrics of this run, or None if metrics are off (no metrics_textfile and no metrics_report)."""
+    global _metrics, _flusher
+    if not (metrics_textfile or metrics_report):
+        return None
+    with _lock:
+        if _metrics is None:
+            _metrics = Metrics()
+            if metrics_textfile:
+                _flusher = _Flusher(_metrics, metrics_textfile, max(metrics_interval, 1))
+        return _metrics
+
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    """Adds to a counter of METRICS, ie inc("caravel_pages_total", result="ok")."""
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.inc(name, amount, **labels)
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """Records a value in a histogram of METRICS, ie observe("caravel_request_seconds", 0.2, endpoint="/manga")."""
+    metrics = get_metrics()
+    if metrics is not None:
+        metrics.observe(name, value, **labels)
+
+
+def close() -> None:
+    """Writes the final textfile and the run report and stops recording. The next metric starts a new run."""
+    global _metrics, _flusher
+    with _lock:
+        metrics, _metrics = _metrics, None
+        flusher, _flusher = _flusher, None
+    if flusher is not None:
+        flusher.close()
+    if metrics is None:
+        return
+    try:
+        if metrics_textfile:
+            _write(metrics_textfile, metrics.textfile())
+        if metrics_report:
+            _write(metrics_report, json.dumps(metrics.report(), indent=2))
+    except OSError as e:
+        events.message("Could not write metrics: " + str(e), "warning")
+    if metrics.traced:
+        sys.modules["tracemalloc"].stop()
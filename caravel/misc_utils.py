@@ -0,0 +1,118 @@
+# Miscellaneous functions for the project
+
+import hashlib
+import os
+import threading
+from urllib.parse import urlsplit
+
+from . import http_client
+from . import metrics
+from .settings import working_dir
+
+# Returns a path inside the working directory (working_dir setting, or the current directory if it's empty)
+def working_path(*parts):
+    return os.path.join(working_dir or os.getcwd(), *parts)
+
+# From https://stackoverflow.com/a/34325723
+def printProgressBar (iteration, total, prefix = '', suffix = '', decimals = 1, length = 100, fill = '█', printEnd = "\r"):
+    """
+    Call in a loop to create terminal progress bar
+    @params:
+        iteration   - Required  : current iteration (Int)
+        total       - Required  : total iterations (Int)
+        prefix      - Optional  : prefix string (Str)
+        suffix      - Optional  : suffix string (Str)
+        decimals    - Optional  : positive number of decimals in percent complete (Int)
+        length      - Optional  : character length of bar (Int)
+        fill        - Optional  : bar fill character (Str)
+        printEnd    - Optional  : end character (e.g. "\r", "\r\n") (Str)
+
+    Start by calling with "iteration" = 0, then loop and call again to update the current iteration (basically the progress towards "total")
+    """
+    percent = ("{0:." + str(decimals) + "f}").format(100 * (iteration / float(total)))
+    filledLength = int(length * iteration // total)
+    bar = fill * filledLength + '-' * (length - filledLength)
+    print(f'\r{prefix} |{bar}| {percent}% {suffix}', end = printEnd)
+    # Print New Line on Complete
+    if iteration == total:
+        print()
+
+# Image types we can get from MD@Home, by the first bytes of the file and by Content-Type
+IMAGE_SIGNATURES = [(b"\xff\xd8\xff", ".jpg"), (b"\x89PNG\r\n\x1a\n", ".png"), (b"GIF87a", ".gif"), (b"GIF89a", ".gif")]
+IMAGE_CONTENT_TYPES = {"image/jpeg": ".jpg", "image/jpg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp"}
+IMAGE_EXTENSIONS = (".jpg", ".png", ".gif", ".webp")
+
+# Finds the real extension of an image from its first bytes, falling back on the Content-Type and then on ".png"
+def image_extension(head, content_type = None):
+    head = bytes(head[:12])
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return ".webp"
+    if content_type is not None:
+        return IMAGE_CONTENT_TYPES.get(content_type.split(";")[0].strip().lower(), ".png")
+    return ".png"
+
+# Writes a downloaded page next to its final path, then renames it in place so a page on disk is always complete.
+# image_path is the path without extension, the extension comes from the content.
+# Returns {"path": final path, "bytes": size, "sha256": hash of the content}
+def write_page(image_path, data, content_type = None):
+    final_path = image_path + image_extension(data, content_type)
+    # * Hidden temporary name in the same folder, os.replace() is only atomic on the same filesystem
+    temp_path = os.path.join(os.path.dirname(image_path), "." + os.path.basename(image_path) + ".part")
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, final_path)
+    return {"path": final_path, "bytes": len(data), "sha256": hashlib.sha256(data).hexdigest()}
+
+_buffers = threading.local() # * One reusable download buffer per thread
+
+# Function for downloading individual images for chapters:
+def download_chapter_image(baseUrl, chapter_hash, image, image_path):
+    # Build the URL to the image, download it in chunks into this thread's buffer, then save it.
+    im_url = baseUrl + '/data/' + chapter_hash + '/' + image                        # Build the URL to the image
+    try:
+        with http_client.get(im_url, stream=True) as image_request:
+            image_request.raise_for_status()
+            buffer = getattr(_buffers, "buffer", None)
+            expected = int(image_request.headers.get("Content-Length", 0))
+            if buffer is None or len(buffer) < max(expected, 64 * 1024):
+                buffer = bytearray(max(expected, 512 * 1024))
+                _buffers.buffer = buffer
+            view = memoryview(buffer)
+            size = 0
+            while True:
+                if size == len(buffer): # * Server lied about the size or didn't say, grow the buffer
+                    view.release()
+                    buffer.extend(bytearray(len(buffer)))
+                    view = memoryview(buffer)
+                    _buffers.buffer = buffer
+                read = image_request.raw.readinto(view[size:])
+                if not read:
+                    break
+                size += read
+            metrics.inc("caravel_downloaded_bytes_total", size, host=urlsplit(im_url).netloc) # * Streamed, http_client doesn't count it
+            if expected and size != expected:
+                metrics.inc("caravel_pages_total", result="failed")
+                return {"success": False, "path": "", "bytes": size, "error": f"Expected {expected} bytes, got {size}"}
+            with view[:size] as data:
+                written = write_page(image_path, data, image_request.headers.get("Content-Type"))
+            view.release()
+        metrics.inc("caravel_pages_total", result="ok")
+        return {"success": True, "path": written["path"], "bytes": written["bytes"], "error": ""}
+    except Exception as e:
+        metrics.inc("caravel_pages_total", result="failed")
+        return {"success": False, "path": "", "bytes": 0, "error": str(e)}
+
+# From https://stackoverflow.com/questions/40419276
+def link(uri, label=None):
+    if label is None:
+        label = uri
+    parameters = ''
+
+    # OSC 8 ; params ; URI ST <name> OSC 8 ;; ST
+    escape_mask = '\033]8;{};{}\033\\{}\033]8;;\033\\'
+
+    return escape_mask.format(parameters, uri, label)
+
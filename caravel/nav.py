@@ -1,8 +1,9 @@
 # This script holds navigation functions to be called in a main script.
 
 import time
-from misc_utils import *
-from func import *
+
+from .func import contributor_request, mangadex_titles_request, safe_title
+from .misc_utils import link
 
 # Title search function
 def title_search() -> dict:
@@ -135,8 +136,8 @@ def display_results(results: dict) -> dict:
             response_type = "title_selection"
             mdid = results['ids_results'][int(user_input)-1]
             title = results['titles_results'][int(user_input)-1]
-            contributors = results['contributors'][int(user_input)-1][0]
-            clean_title = title.replace(":", "").replace("/", "").replace("\\", "").replace("*", "").replace("?", "").replace("\"", "").replace("<", "").replace(">", "").replace("|", "")
+            contributors = (results['contributors'][int(user_input)-1] or ["Unknown"])[0] # * Some titles have no author or artist
+            clean_title = safe_title(title)
     else:
         # ! Invalid input, dunno why
         response_type = "invalid_input"
@@ -230,7 +231,11 @@ def series_select_nav(title_lookup: dict) -> dict:
             print('\n\nInvalid input, please try again\n')
             user_select = 'none'
     # We should now have a valid selection
-    contributors = contributor_request(title_lookup['contributors'][user_select["response"]-1])
-    # Replace the contributor ID by the contributor names
+    # Replace the contributor ID by the contributor names. They usually came with the search already (includes[])
+    names = title_lookup.get('contributor_names', [[]] * title_lookup['result_number'])[user_select["response"]-1]
+    if len(names) > 0:
+        contributors = {"names": names, "duration": 0}
+    else:
+        contributors = contributor_request(title_lookup['contributors'][user_select["response"]-1]) # ! An API request is made here
     user_select["contributors"] = contributors
     return user_select
\ No newline at end of file
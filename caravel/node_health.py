@@ -0,0 +1,202 @@
+# MD@Home node health. Mangadex wants a report for every image downloaded from a MD@Home node (success, size, time
+# and whether the node had it cached) so it can take bad nodes out of rotation, see
+# https://api.mangadex.org/docs/04-chapter/retrieving-chapter/#the-mangadexhome-report-system
+# We also keep our own scoreboard of how fast and reliable each node has been, which page_downloader uses to move a
+# chapter to a fresh node when the current one gets too slow.
+
+import json
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlsplit
+
+from . import http_client
+from .misc_utils import working_path
+from .settings import (api_url, node_min_pages, node_throughput_floor, report_batch_size, report_interval, report_to_mangadex,
+                      report_url, uploads_url)
+
+REPORT_URL = report_url
+EWMA_WEIGHT = 0.3 # * How much the latest page counts in a node's throughput
+_STOP = object() # * Put in the report queue to stop the reporter thread
+
+
+def node_of(url: str) -> str:
+    """Returns the "scheme://host:port" of a page URL, which is how nodes are identified."""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def is_reportable(url: str) -> bool:
+    # * Mangadex only wants reports for MD@Home nodes, not for its own servers
+    parts = urlsplit(url)
+    hostname = parts.hostname or ""
+    if parts.netloc in (urlsplit(api_url).netloc, urlsplit(uploads_url).netloc):
+        return False
+    return not (hostname == "mangadex.org" or hostname.endswith(".mangadex.org"))
+
+
+class NodeReporter:
+    """Sends reports to Mangadex from a background thread, so downloads never wait on them. Reports are queued and
+    sent in bursts, every report_interval seconds or as soon as report_batch_size of them are waiting. The report
+    endpoint takes a single report per request, so a burst is one POST per report, one after the other on the same
+    keep-alive connection.
+    """
+
+    def __init__(self, batch_size: int = report_batch_size, interval: float = report_interval):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.sent = 0
+        self.failed = 0
+        self.thread = threading.Thread(target=self._run, name="node-reporter", daemon=True)
+        self.thread.start()
+
+    def report(self, url: str, success: bool, size: int, duration: float, cached: bool) -> None:
+        """Queues a report for one image.
+
+        Args:
+            url (str): Full URL of the image.
+            success (bool): Whether the image was downloaded correctly.
+            size (int): Number of bytes received.
+            duration (float): Time taken, in seconds.
+            cached (bool): Whether the node said it had the image cached (X-Cache header starting with "HIT").
+        """
+        if is_reportable(url):
+            self.queue.put({"url": url, "success": success, "bytes": size, "duration": int(duration * 1000), "cached": cached})
+
+    def _send(self, batch: list) -> None:
+        # * One request per report, the endpoint has no way to take several at once
+        for report in batch:
+            try:
+                # ! Request is being made here, the report endpoint is not rate limited
+                http_client.post(REPORT_URL, json=report).close()
+                self.sent += 1
+            except Exception:
+                self.failed += 1 # * A lost report is not worth more than a counter
+
+    def _run(self) -> None:
+        batch = []
+        deadline = time.monotonic() + self.interval
+        while True:
+            try:
+                report = self.queue.get(timeout=max(deadline - time.monotonic(), 0.01))
+            except queue.Empty:
+                report = None
+            if report is _STOP:
+                self._send(batch)
+                return
+            if report is not None:
+                batch.append(report)
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._send(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.interval
+
+    def close(self) -> None:
+        """Sends whatever is left and stops the thread."""
+        self.queue.put(_STOP)
+        self.thread.join()
+
+
+class NodeScoreboard:
+    """Throughput and error counts for every node we downloaded from, saved between runs. Throughput is an
+    exponentially weighted average over pages, so it reacts to a node slowing down in the middle of a chapter.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.nodes = json.load(f)
+        except (OSError, ValueError):
+            self.nodes = {}
+        self.seen_this_run = {} # * node -> pages this run, the saved average could be from a good day last week
+
+    def record(self, node: str, success: bool, size: int, duration: float) -> None:
+        with self.lock:
+            stats = self.nodes.setdefault(node, {"pages": 0, "errors": 0, "bytes": 0, "seconds": 0.0, "throughput": None})
+            stats["updated"] = time.time()
+            if not success:
+                stats["errors"] += 1
+                return
+            stats["pages"] += 1
+            stats["bytes"] += size
+            stats["seconds"] += duration
+            page_throughput = size / max(duration, 0.001)
+            if stats["throughput"] is None or self.seen_this_run.get(node, 0) == 0:
+                stats["throughput"] = page_throughput
+            else:
+                stats["throughput"] = EWMA_WEIGHT * page_throughput + (1 - EWMA_WEIGHT) * stats["throughput"]
+            self.seen_this_run[node] = self.seen_this_run.get(node, 0) + 1
+
+    def throughput(self, node: str) -> float:
+        """Returns the recent throughput of a node in bytes per second, or None if we don't know it."""
+        with self.lock:
+            return self.nodes.get(node, {}).get("throughput")
+
+    def is_slow(self, node: str, floor: float = node_throughput_floor, min_pages: int = node_min_pages) -> bool:
+        """Whether a node has been under the throughput floor, once enough pages were downloaded from it this run."""
+        with self.lock:
+            if self.seen_this_run.get(node, 0) < min_pages:
+                return False
+            return self.nodes[node]["throughput"] < floor
+
+    def save(self) -> None:
+        with self.lock:
+            data = json.dumps(self.nodes, indent=1)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(data)
+        os.replace(self.path + '.tmp', self.path)
+
+
+_reporter = None
+_scoreboard = None
+_lock = threading.Lock()
+
+
+def get_scoreboard() -> NodeScoreboard:
+    global _scoreboard
+    with _lock:
+        if _scoreboard is None:
+            _scoreboard = NodeScoreboard(working_path("cache", "nodes.json"))
+        return _scoreboard
+
+
+def get_reporter() -> NodeReporter:
+    """Returns the shared reporter, or None if reporting is disabled in the settings."""
+    global _reporter
+    with _lock:
+        if _reporter is None and report_to_mangadex:
+            _reporter = NodeReporter()
+        return _reporter
+
+
+def page_finished(url: str, success: bool, size: int, duration: float, cached: bool = False) -> None:
+    """Records one downloaded (or failed) image in the scoreboard and reports it to Mangadex.
+
+    Args:
+        url (str): Full URL of the image.
+        success (bool): Whether the image was downloaded correctly.
+        size (int): Number of bytes received.
+        duration (float): Time taken, in seconds.
+        cached (bool, optional): Whether the node had the image cached. Defaults to False.
+    """
+    get_scoreboard().record(node_of(url), success, size, duration)
+    reporter = get_reporter()
+    if reporter is not None:
+        reporter.report(url, success, size, duration, cached)
+
+
+def close() -> None:
+    """Sends the remaining reports and saves the scoreboard."""
+    global _reporter
+    with _lock:
+        reporter, _reporter = _reporter, None
+    if reporter is not None:
+        reporter.close()
+    if _scoreboard is not None:
+        _scoreboard.save()
@@ -0,0 +1,425 @@
+# Asyncio download engine for chapter pages. Instead of one thread per page, every page of every chapter goes through
+# a single event loop running in a background thread, with connection limits per host and overall, and a cap on how
+# many bytes can be held in memory at once. Series running at the same time share the connections fairly (see
+# fair_queue.py), and within a series pages are served lowest priority number first, so the pipeline can make the
+# earliest volume finish first.
+# Every page is recorded in node_health (and reported to Mangadex), and a chapter whose MD@Home node is too slow or
+# keeps failing is moved to a fresh node.
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from . import cbz_storage
+from . import events
+from . import metrics
+from . import node_health
+from .api_cache import is_offline
+from .fair_queue import FairQueue
+from .func import at_home_server
+from .http_client import USER_AGENT
+from .misc_utils import write_page
+from .preprocess import get_pool, prepare_page
+from .source_quality import SourceStats, image_size, is_enough
+from .settings import (connect_timeout, ereader_profile, max_inflight_bytes, max_node_failovers, max_page_connections,
+                      max_page_connections_per_host, page_retries, prewarm_connections, read_timeout)
+
+CHUNK_SIZE = 64 * 1024
+DEFAULT_PAGE_SIZE = 512 * 1024 # * Used to reserve memory when the server doesn't send a Content-Length
+
+
+class StorageError(Exception):
+    """A page was downloaded but couldn't be saved (ie disk full, archive too big). Not the node's fault, so it is
+    neither retried nor held against the node."""
+
+
+class ByteBudget:
+    """Limits how many bytes of page data can be in flight (downloaded but not yet written) at once. Callers wait
+    in reserve() until enough bytes are released by other pages. A single page bigger than the whole budget is
+    still let through when nothing else is in flight, otherwise it would wait forever.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_flight = 0
+        self.condition = asyncio.Condition()
+
+    async def reserve(self, size: int) -> None:
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight == 0 or self.in_flight + size <= self.limit)
+            self.in_flight += size
+
+    async def release(self, size: int) -> None:
+        async with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+
+class PageDownloader:
+    """Owns the event loop, the aiohttp session and the limits. Use submit() from any thread to queue a batch of
+    pages, or download_pages() below for a blocking call on the shared engine.
+
+    A page job is a dict: {"url": full image URL, "path": where to save it, without extension}. Any other keys are kept
+    and passed back. Jobs of MD@Home pages can also have "chapter_id", "base_url" (the node) and "data_path" (the rest
+    of the URL), in which case the page is downloaded from the current node of its chapter, which can change. If
+    "data_path" is a data saver page and the job has "full_data_path", the original is downloaded instead when the data
+    saver page is too small for the screen (see source_quality). "quality" says which one the job ended up with.
+    Jobs with "archive" (path of a CBZ) and "entry" (name in the archive, without extension) are appended to that
+    archive instead of being written to "path", see cbz_storage. Jobs with "preprocess" set are made ready for the
+    device in the preprocess process pool before they are saved, a split spread is saved as two pages. "profile" is the
+    KCC profile of the device for both checks, the ereader_profile setting if missing. Pages are saved with their real extension, atomically (see misc_utils.write_page()).
+    Every job gets a result dict: {"job": job, "success": bool, "path": str, "bytes": int, "sha256": str (on success),
+    "duration": float, "error": str}
+
+    Jobs wait in a fair queue and a fixed number of workers (one per allowed connection) take them series by series,
+    in proportion to their weight, and lowest priority first within a series, then in the order they were submitted.
+    """
+
+    def __init__(self, max_connections: int = max_page_connections, max_per_host: int = max_page_connections_per_host,
+                 max_bytes: int = max_inflight_bytes, retries: int = page_retries, max_failovers: int = max_node_failovers,
+                 resolve_node=None):
+        self.max_connections = max_connections
+        self.max_per_host = max_per_host
+        self.max_bytes = max_bytes
+        self.retries = retries
+        self.max_failovers = max_failovers
+        # * Called with a chapter ID, from a worker thread, must return the base URL of a fresh node for that chapter
+        self.resolve_node = resolve_node or (lambda chapter_id: at_home_server(chapter_id, fresh=True)["baseUrl"])
+        # * Per chapter, dropped once none of its pages are queued or downloading (see _page_finished()), the engine
+        # * lives as long as the watch daemon
+        self.chapter_pages = {} # * chapter ID -> pages queued or downloading
+        self.chapter_nodes = {} # * chapter ID -> node its pages are downloaded from
+        self.failovers = {} # * chapter ID -> how many times it was moved
+        self.failover_locks = {}
+        self.sources = SourceStats()
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        self.budget = None
+        self.queue = FairQueue() # * Only used from the loop
+        self.queued = None # * Counts the jobs in the queue, workers wait on it
+        self.workers = []
+        self.warming = set() # * Pre-warming requests still going, see prewarm()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="page-downloader", daemon=True)
+        self.thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(), self.loop).result()
+
+    async def _setup(self) -> None:
+        connector = aiohttp.TCPConnector(limit=self.max_connections, limit_per_host=self.max_per_host, ttl_dns_cache=300)
+        timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers={"User-Agent": USER_AGENT})
+        self.budget = ByteBudget(self.max_bytes)
+        self.queued = asyncio.Semaphore(0)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.max_connections)]
+
+    async def _worker(self) -> None:
+        buffer = bytearray(DEFAULT_PAGE_SIZE) # * Reused for every page this worker downloads
+        while True:
+            await self.queued.acquire()
+            job, future, on_page = self.queue.get()
+            try:
+                result = await self.fetch(job, buffer)
+            finally:
+                self._page_finished(job)
+            if on_page is not None:
+                try:
+                    on_page(result)
+                except Exception as e: # * A broken callback must not kill the worker
+                    events.message("Error in page callback: " + str(e), "error")
+            if not future.done():
+                future.set_result(result)
+
+    async def _warm(self, url: str) -> None:
+        try:
+            # * A HEAD on the root is cheap, we don't care about the answer, only about the connection left in the pool
+            async with self.session.head(url + "/", allow_redirects=False):
+                pass
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+    def prewarm(self, url: str, connections: int = prewarm_connections) -> None:
+        """Opens connections to a MD@Home node in the background, from any thread, so the TCP and TLS handshakes are
+        already done when its first page is requested. Meant to be called as soon as the baseUrl is known. Never raises.
+
+        Args:
+            url (str): Base URL of the node.
+            connections (int, optional): How many connections to open. Defaults to the prewarm_connections setting.
+        """
+        if is_offline() or connections <= 0:
+            return
+        base = "{0.scheme}://{0.netloc}".format(urlsplit(url))
+
+        def _start():
+            for _ in range(min(connections, self.max_per_host)):
+                task = self.loop.create_task(self._warm(base))
+                self.warming.add(task)
+                task.add_done_callback(self.warming.discard)
+
+        self.loop.call_soon_threadsafe(_start)
+
+    def _page_finished(self, job: dict) -> None:
+        chapter_id = job.get("chapter_id")
+        if chapter_id is None or chapter_id not in self.chapter_pages:
+            return
+        self.chapter_pages[chapter_id] -= 1
+        if self.chapter_pages[chapter_id] <= 0:
+            for chapter_state in (self.chapter_pages, self.chapter_nodes, self.failovers, self.failover_locks):
+                chapter_state.pop(chapter_id, None)
+            self.sources.finish_chapter(chapter_id)
+
+    def page_url(self, job: dict) -> str:
+        """Returns the URL to download a page from, on the current node of its chapter if it has one."""
+        if "chapter_id" not in job or "data_path" not in job:
+            return job["url"]
+        node = self.chapter_nodes.setdefault(job["chapter_id"], job["base_url"])
+        return node + job["data_path"]
+
+    async def _failover(self, job: dict, node: str) -> bool:
+        """Moves the chapter of a page to a fresh node, unless another page already did.
+
+        Args:
+            job (dict): A page of the chapter.
+            node (str): The node the page was downloaded from.
+
+        Returns:
+            bool: True if the chapter is now on another node.
+        """
+        chapter_id = job.get("chapter_id")
+        if chapter_id is None or "data_path" not in job or chapter_id not in self.chapter_pages:
+            return False # * Or every page of the chapter is done already
+        lock = self.failover_locks.setdefault(chapter_id, asyncio.Lock())
+        async with lock:
+            if self.chapter_nodes.get(chapter_id) != node:
+                return True # * Moved by another page while we were waiting
+            if self.failovers.get(chapter_id, 0) >= self.max_failovers:
+                return False
+            self.failovers[chapter_id] = self.failovers.get(chapter_id, 0) + 1
+            try:
+                new_node = await self.loop.run_in_executor(None, self.resolve_node, chapter_id)
+            except Exception as e:
+                events.message(f"Could not get a new server for chapter {chapter_id}: {e}", "warning")
+                return False
+            if not new_node or new_node == node:
+                return False
+            self.chapter_nodes[chapter_id] = new_node
+            metrics.inc("caravel_retries_total", reason="failover")
+            events.message(f"Server {node_health.node_of(node)} is too slow or failing, moved chapter {chapter_id} to {node_health.node_of(new_node)}", "warning")
+            return True
+
+    async def _sample(self, job: dict, saver_size: int) -> None:
+        # * Asks the node for the size of the original of a data saver page, to estimate how much data saver saves
+        try:
+            async with self.session.head(self.chapter_nodes.get(job["chapter_id"], job["base_url"]) + job["full_data_path"]) as response:
+                if response.status == 200:
+                    self.sources.sample(job["chapter_id"], saver_size, response.content_length)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+
+    @staticmethod
+    def _store(job: dict, pages: list) -> dict:
+        # * Saves the page (or both halves of a split spread) where the job says. Runs in a thread.
+        written = None
+        for suffix, data, content_type in pages:
+            if "archive" in job:
+                part = cbz_storage.write_page(job["archive"], job["entry"] + suffix, data, content_type)
+            else:
+                part = write_page(job["path"] + suffix, data, content_type)
+            if written is None:
+                written = part
+            else:
+                written["bytes"] += part["bytes"]
+        return written
+
+    async def _fetch_once(self, job: dict, url: str, buffer: bytearray, timing: dict) -> dict:
+        """Downloads one page into the buffer and saves it. Raises on any failure, StorageError if the page was
+        received but couldn't be saved.
+
+        Args:
+            timing (dict): "transfer" is set to the seconds spent talking to the node, without the wait for the byte
+            budget, the preprocessing and the write, and "downloaded" to the bytes received. Set even when this raises.
+
+        Returns:
+            dict: {"path": final path of the page, "bytes": number of bytes written, "downloaded": number of bytes
+            received, "cached": whether the node had it}
+        """
+        t_start = time.perf_counter()
+        timing["transfer"] = 0.0
+        try:
+            response = await self.session.get(url)
+        finally:
+            timing["transfer"] = time.perf_counter() - t_start
+        async with response:
+            if response.status != 200:
+                raise aiohttp.ClientResponseError(response.request_info, response.history, status=response.status,
+                                                  message=response.reason or "")
+            reserved = response.content_length or DEFAULT_PAGE_SIZE
+            await self.budget.reserve(reserved)
+            try:
+                if len(buffer) < reserved:
+                    buffer.extend(bytearray(reserved - len(buffer)))
+                size = 0
+                t_body = time.perf_counter()
+                try:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        if size + len(chunk) > len(buffer): # * No (or a wrong) Content-Length, grow the buffer
+                            buffer.extend(bytearray(max(len(chunk), len(buffer))))
+                        buffer[size:size + len(chunk)] = chunk
+                        size += len(chunk)
+                finally:
+                    timing["transfer"] += time.perf_counter() - t_body
+                    timing["downloaded"] = size
+                if response.content_length is not None and size != response.content_length:
+                    raise aiohttp.ClientPayloadError(f"Expected {response.content_length} bytes, got {size}")
+                cached = response.headers.get("X-Cache", "").upper().startswith("HIT")
+                with memoryview(buffer)[:size] as data:
+                    if job.get("quality") == "data-saver" and "full_data_path" in job and not is_enough(image_size(data), job.get("profile", ereader_profile)):
+                        return {"path": "", "bytes": size, "downloaded": size, "cached": cached, "too_small": True}
+                    pages = [("", data, response.content_type)]
+                    if job.get("preprocess"):
+                        try:
+                            pages = [(suffix, jpeg, "image/jpeg") for suffix, jpeg in
+                                     await self.loop.run_in_executor(get_pool(), prepare_page, bytes(data), job.get("profile", ereader_profile))]
+                        except Exception as e: # * KCC can still deal with the original
+                            events.message(f"Could not prepare page {job['path']}, keeping it as is: {e}", "warning")
+                    try:
+                        written = await self.loop.run_in_executor(None, self._store, job, pages)
+                    except Exception as e:
+                        raise StorageError(f"{type(e).__name__}: {e}") from e
+                written["cached"] = cached
+                written["downloaded"] = size
+                return written
+            finally:
+                await self.budget.release(reserved)
+
+    async def fetch(self, job: dict, buffer: bytearray = None) -> dict:
+        """Downloads one page, retrying up to self.retries times. Never raises, failures are in the result."""
+        t1 = time.perf_counter()
+        if is_offline():
+            return {"job": job, "success": False, "path": "", "bytes": 0, "duration": 0.0, "error": "OFFLINE"}
+        if buffer is None:
+            buffer = bytearray(DEFAULT_PAGE_SIZE)
+        error = ""
+        attempt = 0
+        while attempt <= self.retries:
+            url = self.page_url(job)
+            node = self.chapter_nodes.get(job.get("chapter_id"))
+            timing = {}
+            try:
+                written = await self._fetch_once(job, url, buffer, timing)
+            except StorageError as e:
+                # * The node did its part, retrying or moving the chapter would not free any disk space
+                node_health.page_finished(url, True, timing["downloaded"], timing["transfer"])
+                metrics.observe("caravel_request_seconds", timing["transfer"], endpoint=metrics.endpoint(url))
+                events.message(f"Could not save page {job['path']}: {e}", "error")
+                error = "STORAGE_ERROR: " + str(e)
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                node_health.page_finished(url, False, 0, timing.get("transfer", 0.0))
+                metrics.observe("caravel_request_seconds", timing.get("transfer", 0.0), endpoint=metrics.endpoint(url))
+                error = f"{type(e).__name__}: {e}"
+                attempt += 1
+                if attempt <= self.retries:
+                    metrics.inc("caravel_retries_total", reason="page")
+                if attempt > self.retries and node is not None and await self._failover(job, node):
+                    attempt = self.retries # * One last try on the new node
+                    continue
+                await asyncio.sleep(0.5 * attempt) # * Small backoff, MD@Home nodes hiccup more than they fail
+                continue
+            node_health.page_finished(url, True, written["downloaded"], timing["transfer"], written["cached"])
+            metrics.observe("caravel_request_seconds", timing["transfer"], endpoint=metrics.endpoint(url))
+            metrics.inc("caravel_downloaded_bytes_total", written["downloaded"], host=urlsplit(url).netloc)
+            if written.get("too_small"):
+                # * Not an error and not an attempt, the same page is downloaded again from the originals
+                self.sources.record(job.get("chapter_id"), "fallback", written["bytes"])
+                job["data_path"] = job.pop("full_data_path")
+                job["quality"] = "data"
+                continue
+            self.sources.record(job.get("chapter_id"), job.get("quality", "data"), written["bytes"])
+            if job.get("quality") == "data-saver" and "full_data_path" in job and self.sources.needs_sample(job.get("chapter_id")):
+                await self._sample(job, written["bytes"])
+            if node is not None and node_health.get_scoreboard().is_slow(node_health.node_of(node)):
+                # * The page is fine, the next pages of the chapter go to the new node
+                asyncio.ensure_future(self._failover(job, node))
+            metrics.inc("caravel_pages_total", result="ok")
+            return {"job": job, "success": True, "path": written["path"], "bytes": written["bytes"], "sha256": written["sha256"], "duration": time.perf_counter() - t1, "error": ""}
+        metrics.inc("caravel_pages_total", result="failed")
+        return {"job": job, "success": False, "path": "", "bytes": 0, "duration": time.perf_counter() - t1, "error": error}
+
+    async def download(self, jobs: list, on_page=None, priority: int = 0, series: str = None, weight: float = 1.0) -> list:
+        """Queues a batch of pages and waits for all of them. Must run on the engine loop.
+
+        Args:
+            jobs (list): Page jobs, see the class docstring.
+            on_page (function, optional): Called with each result as soon as its page is done.
+            priority (int, optional): Lower numbers are downloaded first, within the series. Defaults to 0.
+            series (str, optional): Who the pages are for (the Mangadex ID), see fair_queue.py. Defaults to None.
+            weight (float, optional): Share of the connections the series gets, relative to the others. Defaults to 1.0.
+
+        Returns:
+            list: Results, in the same order as jobs.
+        """
+        futures = []
+        for job in jobs:
+            if job.get("chapter_id") is not None:
+                self.chapter_pages[job["chapter_id"]] = self.chapter_pages.get(job["chapter_id"], 0) + 1
+            future = self.loop.create_future()
+            self.queue.put((job, future, on_page), series, weight, priority)
+            self.queued.release()
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    def submit(self, jobs: list, on_page=None, priority: int = 0, series: str = None, weight: float = 1.0) -> concurrent.futures.Future:
+        """Queues a batch of pages from any thread, arguments as for download(). Returns a future with the list of results."""
+        return asyncio.run_coroutine_threadsafe(self.download(jobs, on_page, priority, series, weight), self.loop)
+
+    async def _shutdown(self) -> None:
+        for worker in self.workers:
+            worker.cancel()
+        for task in list(self.warming):
+            task.cancel()
+        await asyncio.gather(*self.workers, *self.warming, return_exceptions=True)
+        await self.session.close()
+
+    def close(self) -> None:
+        """Closes the session and stops the loop. The engine can't be used afterwards."""
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine() -> PageDownloader:
+    """Returns the shared engine, starting it on first use."""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PageDownloader()
+        return _engine
+
+
+def download_pages(jobs: list, on_page=None) -> list:
+    """Blocking helper: downloads a batch of pages on the shared engine and returns the results in order.
+
+    Args:
+        jobs (list): Page jobs, see PageDownloader.
+        on_page (function, optional): Called with each result as soon as its page is done (from the engine thread).
+
+    Returns:
+        list: One result dict per job.
+    """
+    return get_engine().submit(jobs, on_page).result()
+
+
+def close_engine() -> None:
+    """Stops the shared engine if it was started."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.close()
+            _engine = None
@@ -0,0 +1,505 @@
+# Staged download -> convert -> push pipeline. Each stage runs in its own thread with a queue in between, so that
+# volume N+1 downloads while volume N converts. Converted volumes are pushed to Calibre together at the end, with a
+# single calibredb call. Pages are given the volume's
+# position as their priority in page_downloader, so the earliest volume always finishes first and conversion can
+# start as soon as possible. Conversions of several volumes run at the same time.
+# Several series can run through the pipeline at the same time (one run_pipeline() per thread): they share the download
+# engine and the conversion workers, which serve them fairly according to their weight (see fair_queue.py).
+# What was done is kept in the job journal (journal.py), so an interrupted run picks up where it stopped.
+# Nothing is printed directly, progress goes through events.py so the output can be a bar, JSON lines or nothing.
+
+import concurrent.futures
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+
+from . import cbz_storage
+from . import events
+from . import http_client
+from . import metrics
+from . import node_health
+from .covers import download_covers
+from .func import at_home_server, build_folders
+from .journal import get_journal
+from .epub_builder import build_epub, can_build
+from .kcc_conversion import close_scheduler, get_scheduler, img_dir_to_epub
+from .misc_utils import working_path
+from .push_to_calibre import push_books
+from .preprocess import close_pool, get_pool
+from .settings import converter, ereader_profile, page_storage, pipeline_lookahead, preprocess_pages, source_quality
+from .source_quality import use_data_saver
+
+_DONE = None # * Sentinel put in a queue when the previous stage has nothing left to send
+_series_locks = {} # * mdid -> lock held while the series runs, two runs of a series would share its folders
+_series_locks_lock = threading.Lock()
+
+
+def _series_lock(mdid: str) -> threading.RLock:
+    with _series_locks_lock:
+        return _series_locks.setdefault(mdid, threading.RLock())
+
+
+def _loaded(module: str):
+    """Returns a module of the package if it was imported already, else None. The download engine (aiohttp) is only
+    imported once a volume has pages to download, so there is nothing to stop when a run had none."""
+    return sys.modules.get(__package__ + "." + module)
+
+
+def volume_key(volume) -> str:
+    """Returns the folder/pseudo_file_structure name of a volume, ie 1 -> "0001"."""
+    return str(volume).zfill(4)
+
+
+def prepare_volume(series: dict, volume) -> list:
+    """Creates the chapter folders of a volume and asks MD@Home where each chapter's pages are. Pages that the
+    journal says are downloaded are skipped, and chapters that are complete don't need a MD@Home request at all.
+
+    Args:
+        series (dict): See run_pipeline().
+        volume: Volume to prepare, as selected by the user.
+
+    Returns:
+        list: Page jobs ready for page_downloader.
+    """
+    volume = volume_key(volume)
+    journal = get_journal()
+    profile = series.get('profile', ereader_profile)
+    chapters = series['pseudo_file_structure'][series['clean_title']][volume]
+    vol_path = os.path.join(series['workdir'], volume)
+    known = journal.volume_chapters(series['mdid'], volume)
+
+    page_jobs = []
+    for chapter, chapter_id in chapters.items():
+        ch_path = os.path.join(vol_path, chapter)
+        done = known.get(chapter, {}).get("done", set())
+        if known.get(chapter, {}).get("pages") is not None and len(done) == known[chapter]["pages"]:
+            continue
+        os.makedirs(ch_path if page_storage == 'files' else vol_path, exist_ok=True)
+
+        chapter_request = at_home_server(chapter_id) # ! This function does an API request!
+        chapter_baseUrl = chapter_request['baseUrl']
+        chapter_hash = chapter_request['chapter']['hash']
+        from .page_downloader import get_engine # * Not at the top, see _loaded()
+        get_engine().prewarm(chapter_baseUrl) # * Handshakes happen while we prepare the other chapters
+        page_count = len(chapter_request['chapter']['data'])
+        if known.get(chapter, {}).get("pages") not in (None, page_count):
+            done = set() # * The chapter changed since last time, the journal starts it over
+        journal.set_chapter_pages(series['mdid'], volume, chapter, chapter_id, page_count)
+
+        data_saver = chapter_request['chapter'].get('dataSaver', [])
+        for im, image in enumerate(chapter_request['chapter']['data']):
+            page_name = str(im).zfill(5)
+            if page_name in done:
+                continue
+            page_job = {
+                "url": chapter_baseUrl + '/data/' + chapter_hash + '/' + image,
+                "chapter_id": chapter_id, # * With data_path, lets page_downloader move the chapter to another node
+                "base_url": chapter_baseUrl,
+                "data_path": '/data/' + chapter_hash + '/' + image,
+                "quality": "data",
+                "preprocess": preprocess_pages,
+                "profile": profile,
+                "path": os.path.join(ch_path, page_name), # * The extension is added when the page is written
+                "volume": volume,
+                "chapter": chapter,
+                "page": page_name
+            }
+            if page_storage == 'chapter':
+                page_job["archive"] = ch_path + '.cbz'
+                page_job["entry"] = page_name
+            elif page_storage == 'volume':
+                page_job["archive"] = vol_path + '.cbz'
+                page_job["entry"] = chapter + '/' + page_name
+            if use_data_saver(profile=profile) and len(data_saver) == len(chapter_request['chapter']['data']):
+                page_job["full_data_path"] = page_job["data_path"]
+                page_job["data_path"] = '/data-saver/' + chapter_hash + '/' + data_saver[im]
+                page_job["url"] = chapter_baseUrl + page_job["data_path"]
+                page_job["quality"] = "data-saver"
+                if source_quality == "data-saver":
+                    del page_job["full_data_path"] # * Forced, never fall back on the originals
+            page_jobs.append(page_job)
+    return page_jobs
+
+
+def record_pages(series: dict, volume, page_results: list) -> None:
+    """Marks the pages that were written successfully as downloaded in the journal, and the volume as downloaded
+    if none failed.
+
+    Args:
+        series (dict): See run_pipeline().
+        volume: Volume the pages belong to.
+        page_results (list): Results from page_downloader.
+    """
+    vol_path = os.path.join(series['workdir'], volume_key(volume))
+    cbz_storage.sync_archives(vol_path) # * Chapter archives
+    cbz_storage.sync_archives(vol_path + '.cbz') # * Volume archive
+    journal = get_journal()
+    journal.record_pages(series['mdid'], page_results)
+    if all(result["success"] for result in page_results):
+        journal.set_volume_state(series['mdid'], volume_key(volume), "downloaded")
+
+
+def reopen_volume(mdid: str, workdir: str, volume, chapters: list) -> None:
+    """Moves a volume whose chapters changed on Mangadex back to pending (see journal.Journal.reopen_volume()) and
+    deletes what is on disk of the changed chapters, whatever page_storage they were written with, and the book made
+    from them. Chapters that were uploaded again, shortened or moved to another volume would otherwise still be in the
+    volume folder or archive KCC converts.
+
+    Args:
+        mdid (str): Mangadex ID of the series.
+        workdir (str): Folder of the series.
+        volume: Volume that changed.
+        chapters (list): Chapters of the volume to download again, or that left it.
+    """
+    volume = volume_key(volume)
+    vol_path = os.path.join(workdir, volume)
+    with _series_lock(mdid): # * Not while a run of the series is writing to these folders
+        get_journal().reopen_volume(mdid, volume, chapters) # * First, a crash below leaves stale pages the journal wants again
+        cbz_storage.close_archives(vol_path)
+        for chapter in chapters:
+            shutil.rmtree(os.path.join(vol_path, chapter), ignore_errors=True)
+            if os.path.exists(os.path.join(vol_path, chapter + '.cbz')):
+                os.remove(os.path.join(vol_path, chapter + '.cbz'))
+        cbz_storage.remove_folders(vol_path + '.cbz', chapters)
+        for book in (volume + '.epub', volume + '.kepub.epub'):
+            if os.path.exists(os.path.join(workdir, book)):
+                os.remove(os.path.join(workdir, book))
+
+
+def _volume_cover(series: dict, volume: str) -> str:
+    for cover_volume, cover in series.get('covers', {}).items():
+        if volume_key(cover_volume) == volume and cover["success"]:
+            return cover["epub_cover"]
+    return None
+
+
+def _convert_native(series: dict, volume: str) -> dict:
+    # * Runs on a conversion worker. Checking the pages takes a moment, so it's not done in the convert stage itself
+    workdir = series['workdir']
+    vol_path = os.path.join(workdir, volume)
+    chapters = list(series['pseudo_file_structure'][series['clean_title']][volume])
+    profile = series.get('profile', ereader_profile)
+    if not can_build(vol_path, chapters, profile):
+        events.message('Volume ' + volume + ' needs KCC to prepare its pages')
+        return img_dir_to_epub(workdir, 0, events.is_verbose(), False, profile, volume_name=volume, preprocessed=preprocess_pages)
+    try:
+        volume_number = int(volume)
+    except ValueError:
+        volume_number = None
+    return build_epub(
+        vol_path,
+        os.path.join(workdir, volume + '.epub'),
+        'Vol. ' + str(volume_number if volume_number is not None else volume) + ' - ' + series['series_title'],
+        chapters,
+        series['authors'],
+        series['series_title'],
+        volume_number,
+        _volume_cover(series, volume)
+    )
+
+
+def convert_volume(series: dict, volume, converter: str = converter) -> concurrent.futures.Future:
+    """Queues the conversion of a downloaded volume to EPUB, unless it was already converted. Several volumes convert
+    at the same time, see kcc_conversion.ConversionScheduler.
+
+    Args:
+        series (dict): See run_pipeline().
+        volume: Volume to convert.
+        converter (str, optional): 'kcc' or 'native' (see epub_builder, volumes it can't handle still go to KCC).
+            Defaults to the converter setting.
+
+    Returns:
+        concurrent.futures.Future: Future with the same result as kcc_conversion.img_dir_to_epub().
+    """
+    volume = volume_key(volume)
+    workdir = series['workdir']
+    if get_journal().volume_state(series['mdid'], volume) in ("converted", "pushed"):
+        events.message('Volume ' + volume + ' already converted, skipping')
+        future = concurrent.futures.Future()
+        future.set_result({"success": True, "full_path": get_journal().volume_path(series['mdid'], volume), "error": ''})
+        return future
+    vol_path = os.path.join(workdir, volume)
+    if page_storage == 'volume':
+        cbz_storage.close_archives(vol_path + '.cbz')
+    elif page_storage == 'chapter':
+        # * KCC takes one archive per book, the chapters are copied into it as they are
+        cbz_storage.close_archives(vol_path)
+        chapters = list(series['pseudo_file_structure'][series['clean_title']][volume])
+        cbz_storage.merge_archives([os.path.join(vol_path, chapter + '.cbz') for chapter in chapters], vol_path + '.cbz', chapters)
+    share = {"series": series['mdid'], "weight": series.get('weight', 1.0)}
+    if converter == 'native':
+        return get_scheduler().run(_convert_native, series, volume, **share)
+    # * By name, not by position: other volumes converting at the same time add files to the series folder
+    return get_scheduler().submit(workdir, volume, events.is_verbose(), False, series.get('profile', ereader_profile), preprocessed=preprocess_pages, **share)
+
+
+def calibre_book(series: dict, volume) -> dict:
+    """Returns what push_to_calibre.push_books() needs to push a converted volume with the series metadata and its cover.
+
+    Args:
+        series (dict): See run_pipeline().
+        volume: Volume to push.
+
+    Returns:
+        dict: {"epub_path", "author", "series", "volume", "title", "cover_path", "replace", "book_id"}, "replace" is
+        set when the volume was rebuilt after it was pushed (see reopen_volume()), with the Calibre ID of its book if known.
+    """
+    pushed = get_journal().volume_book(series['mdid'], volume_key(volume))
+    try:
+        volume = int(volume)
+    except:
+        volume = 'Extra'
+    workdir = series['workdir']
+    return {
+        "epub_path": os.path.join(workdir, volume_key(volume) + '.epub'),
+        "author": series['authors'],
+        "series": series['series_title'],
+        "volume": volume,
+        "title": 'Vol. ' + str(volume) + ' - ' + series['series_title'],
+        "cover_path": os.path.join(workdir, volume_key(volume) + '.jpg'),
+        "replace": pushed["outdated"],
+        "book_id": pushed["book_id"]
+    }
+
+
+def run_pipeline(series: dict, volume_list: list, lookahead: int = pipeline_lookahead, converter: str = converter) -> dict:
+    """Downloads, converts and pushes a list of volumes with the three stages overlapping.
+
+    Args:
+        series (dict): Everything the stages need to know about the series:
+        {
+            "mdid": Mangadex ID,
+            "series_title": real title, used for metadata,
+            "clean_title": title without illegal characters, used for folders,
+            "authors": list of author names,
+            "pseudo_file_structure": pseudo file structure of the series,
+            "workdir": folder of the series,
+            "covers": results of covers.download_covers() (optional),
+            "profile": KCC profile of the device (optional, defaults to the ereader_profile setting),
+            "weight": share of the downloads and conversions against other series running at the same time (optional, 1.0)
+        }
+        volume_list (list): Volumes to process, in the order they should finish.
+        lookahead (int, optional): How many volumes can be downloading at the same time. Defaults to the
+        pipeline_lookahead setting.
+        converter (str, optional): 'kcc' or 'native', see convert_volume(). Defaults to the converter setting.
+
+    Returns:
+        dict: One entry per volume: {"download": list of failed page results, "convert": kcc results or None,
+        "push": calibre results or None}
+    """
+    with _series_lock(series['mdid']): # * Another thread running the same series finishes first, then this run skips what it did
+        return _run_pipeline(series, volume_list, lookahead, converter)
+
+
+def _run_pipeline(series: dict, volume_list: list, lookahead: int, converter: str) -> dict:
+    if preprocess_pages:
+        get_pool() # * Before the engine thread starts, see preprocess.get_pool()
+    journal = get_journal()
+    journal.add_series(series, [volume_key(volume) for volume in volume_list])
+    convert_queue = queue.PriorityQueue()
+    push_queue = queue.PriorityQueue()
+    slots = threading.Semaphore(max(lookahead, 1))
+    downloaded = threading.Semaphore(0) # * Released once per volume after it was handed to the convert stage
+    results = {volume_key(volume): {"download": [], "convert": None, "push": None} for volume in volume_list}
+    mdid = series['mdid']
+    weight = series.get('weight', 1.0)
+    engine = [] # * The download engine, once a volume needs it
+
+    def page_done(result):
+        # * Runs on the download engine thread for every page, the renderer throttles what it draws
+        events.publish("page_done", mdid=mdid, volume=result["job"].get("volume"), success=result["success"])
+
+    def download_stage():
+        pending = []
+        for priority, volume in enumerate(volume_list):
+            volume = volume_key(volume)
+            if journal.volume_state(series['mdid'], volume) == "pushed":
+                events.message('Volume ' + volume + ' was already pushed to Calibre, skipping')
+                results[volume]["push"] = {"success": True, "book id": None, "error": ''}
+                continue
+            slots.acquire() # * Don't resolve MD@Home URLs too far ahead, they expire
+            try:
+                page_jobs = prepare_volume(series, volume)
+            except Exception as e:
+                events.message('Could not prepare volume ' + volume + ': ' + str(e), "error")
+                results[volume]["download"] = [{"job": {"volume": volume}, "success": False, "error": str(e)}]
+                slots.release()
+                convert_queue.put((priority, volume, None)) # * The convert stage reports it as missing pages
+                continue
+            events.publish("volume_started", mdid=mdid, volume=volume, position=str(priority+1) + ' of ' + str(len(volume_list)), pages=len(page_jobs))
+            if len(page_jobs) == 0:
+                future = concurrent.futures.Future()
+                future.set_result([]) # * Every page is on disk already, no need to start the engine for it
+            else:
+                if not engine:
+                    from .page_downloader import get_engine
+                    engine.append(get_engine())
+                future = engine[0].submit(page_jobs, page_done, priority, mdid, weight)
+
+            def volume_downloaded(future, volume=volume, priority=priority):
+                # * Runs on the download engine thread: only hands the volume over, the journal is written by the convert stage
+                try:
+                    slots.release()
+                    convert_queue.put((priority, volume, future))
+                finally:
+                    downloaded.release()
+            future.add_done_callback(volume_downloaded)
+            pending.append(future)
+        for _ in pending:
+            downloaded.acquire() # * Wait until every volume is queued for conversion before saying we're done
+        convert_queue.put((len(volume_list), _DONE, None))
+
+    def convert_stage():
+        converting = 0
+        converted = threading.Semaphore(0)
+        while True:
+            priority, volume, download = convert_queue.get()
+            if volume is _DONE:
+                break
+            if download is not None:
+                try:
+                    page_results = download.result()
+                    record_pages(series, volume, page_results)
+                    results[volume]["download"] = [result for result in page_results if not result["success"]]
+                except Exception as e:
+                    results[volume]["download"] = [{"job": {"volume": volume}, "success": False, "error": str(e)}]
+            failed_pages = results[volume]["download"]
+            events.publish("volume_downloaded", mdid=mdid, volume=volume, failed_pages=len(failed_pages))
+            for result in failed_pages:
+                events.message('Failed to download ' + result["job"].get("url", volume) + ': ' + result["error"], "warning")
+            if failed_pages:
+                # ! Converting a volume with missing pages would silently make a broken book
+                results[volume]["convert"] = {"success": False, "full_path": "", "error": "PAGES_MISSING"}
+                continue
+
+            def volume_converted(future, volume=volume, priority=priority):
+                # * Runs on a conversion worker: only hands the volume over, the journal is written by the push stage
+                try:
+                    push_queue.put((priority, volume, future))
+                finally:
+                    converted.release()
+            try:
+                conversion = convert_volume(series, volume, converter)
+            except Exception as e:
+                conversion = concurrent.futures.Future()
+                conversion.set_exception(e)
+            conversion.add_done_callback(volume_converted)
+            converting += 1
+        for _ in range(converting):
+            converted.acquire() # * Wait until every conversion is handed to the push stage
+        push_queue.put((len(volume_list), _DONE, None))
+
+    def push_stage():
+        # * calibredb takes seconds just to start, so every volume of the run is added with a single call at the end
+        to_push = []
+        while True:
+            priority, volume, conversion = push_queue.get()
+            if volume is _DONE:
+                break
+            try:
+                kcc_results = conversion.result()
+            except Exception as e:
+                kcc_results = {"success": False, "full_path": "", "error": "CATASTROPHIC_ERROR: " + str(e)}
+            results[volume]["convert"] = kcc_results
+            if kcc_results["success"]:
+                journal.set_volume_state(series['mdid'], volume, "converted", kcc_results["full_path"])
+            events.publish("volume_converted", mdid=mdid, volume=volume, success=kcc_results["success"], error=kcc_results["error"])
+            if kcc_results["success"]:
+                to_push.append((priority, volume))
+        to_push.sort()
+        if len(to_push) == 0:
+            return
+        events.message('Pushing ' + str(len(to_push)) + ' volume(s) to Calibre')
+        push_results = push_books([calibre_book(series, volume) for _, volume in to_push])
+        for (_, volume), push_result in zip(to_push, push_results):
+            results[volume]["push"] = push_result
+            if push_result["success"]:
+                journal.set_volume_state(series['mdid'], volume, "pushed", book_id=push_result["book id"])
+            events.publish("volume_pushed", mdid=mdid, volume=volume, success=push_result["success"], book_id=push_result["book id"], error=push_result["error"])
+        # Can't clean up folder as Calibre could fail but report success. If we don't delete anything, we'll get to a point where all steps get skipped anyway
+
+    time_start = time.perf_counter()
+    stages = [threading.Thread(target=stage, name=stage.__name__) for stage in (download_stage, convert_stage, push_stage)]
+    for stage in stages:
+        stage.start()
+    for stage in stages:
+        stage.join()
+    events.publish("series_finished", mdid=mdid, duration=time.perf_counter() - time_start)
+    if engine:
+        events.message(engine[0].sources.summary())
+    cbz_storage.close_archives(series['workdir']) # * Volumes with failed pages, they are completed on the next run
+    return results
+
+
+def run_series(info: dict, pseudo_file_structure: dict, volume_list: list, profile: str = ereader_profile, converter: str = converter,
+               weight: float = 1.0) -> dict:
+    """Makes the folders and covers of a series and runs its volumes through the pipeline. What the interactive
+    script and batch.py do once they know the series and the volumes.
+
+    Args:
+        info (dict): {"mdid", "series_title", "clean_title", "authors", "main_cover_filename"}, see func.series_request().
+        pseudo_file_structure (dict): Pseudo file structure of the series, see func.chapter_request_and_files().
+        volume_list (list): Volumes to process, in the order they should finish.
+        profile (str, optional): KCC profile of the device. Defaults to the ereader_profile setting.
+        converter (str, optional): See convert_volume(). Defaults to the converter setting.
+        weight (float, optional): Share of the downloads and conversions against other series running at the same
+        time, see fair_queue.py. Defaults to 1.0.
+
+    Returns:
+        dict: See run_pipeline().
+    """
+    with _series_lock(info['mdid']):
+        events.publish("series_started", mdid=info['mdid'], title=info['series_title'], volumes=len(volume_list))
+        series = dict(series_context(info, pseudo_file_structure, volume_list, profile), weight=weight)
+        return run_pipeline(series, volume_list, converter=converter)
+
+
+def series_context(info: dict, pseudo_file_structure: dict, volume_list: list, profile: str = ereader_profile) -> dict:
+    """Makes the folders and covers of the volumes of a series, and returns the series dict the stages take, see
+    run_pipeline(). Arguments as for run_series()."""
+    workdir = working_path("books", info['clean_title'])
+    build_folders(pseudo_file_structure, volume_list)
+    cover_results = download_covers(info['mdid'], workdir, volume_list, info.get('main_cover_filename'), profile)
+    return {
+        "mdid": info['mdid'],
+        "series_title": info['series_title'],
+        "clean_title": info['clean_title'],
+        "authors": info['authors'],
+        "pseudo_file_structure": pseudo_file_structure,
+        "workdir": workdir,
+        "covers": cover_results,
+        "profile": profile
+    }
+
+
+def pick_volumes(pseudo_file_structure: dict, clean_title: str, wanted="all") -> tuple:
+    """Matches a volume selection against the volumes Mangadex has.
+
+    Args:
+        pseudo_file_structure (dict): Pseudo file structure of the series.
+        clean_title (str): Title the structure is under.
+        wanted (optional): "all", or a list of volume numbers. Defaults to "all".
+
+    Returns:
+        tuple: (volumes to run, in order, selected volumes Mangadex doesn't have). Chapters without a volume
+        ("stranded") are never picked.
+    """
+    available = [volume for volume in pseudo_file_structure[clean_title] if volume != 'stranded']
+    if wanted == "all":
+        return [int(volume) if volume.isdigit() else volume for volume in sorted(available, key=cbz_storage.natural_key)], []
+    return [volume for volume in wanted if volume_key(volume) in available], [volume for volume in wanted if volume_key(volume) not in available]
+
+
+def shutdown() -> None:
+    """Stops everything the pipeline started (download engine, conversion workers, preprocess workers, node reports,
+    HTTP sessions) and writes the run metrics. Call it once at the very end, the next run_pipeline() would start them again."""
+    if _loaded("page_downloader") is not None:
+        _loaded("page_downloader").close_engine()
+    close_scheduler()
+    close_pool()
+    node_health.close()
+    http_client.close_all()
+    metrics.close()
@@ -0,0 +1,82 @@
+# Page preprocessing with Pillow, in a pool of processes. When enabled, every page is made ready for the device as soon
+# as it is downloaded: double page spreads are split (or rotated), the page is resized to the screen of the ereader
+# profile, made greyscale if the screen is, and saved as JPEG. KCC then gets pages it has almost nothing left to do on,
+# and most of the CPU work happens while the rest of the volume is still downloading.
+
+import concurrent.futures
+import io
+import multiprocessing
+import os
+import sys
+import threading
+
+from .kcc_conversion import PROFILE_RESOLUTIONS
+from .settings import ereader_profile, preprocess_workers, spread_mode
+
+JPEG_QUALITY = 90
+
+
+def prepare_page(data: bytes, profile: str = ereader_profile, spreads: str = spread_mode, right_to_left: bool = True) -> list:
+    """Makes one downloaded page ready for the device. Runs in a worker process.
+
+    Args:
+        data (bytes): The image as downloaded.
+        profile (str, optional): KCC profile of the device. Defaults to the ereader_profile setting.
+        spreads (str, optional): What to do with double page spreads: 'split', 'rotate' or 'none'. Defaults to the
+            spread_mode setting.
+        right_to_left (bool, optional): Reading order, the first half of a split spread is the right one for manga.
+            Defaults to True.
+
+    Returns:
+        list: [(suffix, JPEG bytes)], one item, or two for a split spread (suffixes "a" and "b", in reading order).
+    """
+    from PIL import Image # * Imported in the worker process, the main process never needs it
+
+    width, height, greyscale = PROFILE_RESOLUTIONS.get(profile, (None, None, False))
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("L" if greyscale else "RGB")
+    if image.width > image.height and spreads == 'split':
+        left = image.crop((0, 0, image.width // 2, image.height))
+        right = image.crop((image.width // 2, 0, image.width, image.height))
+        parts = [("a", right), ("b", left)] if right_to_left else [("a", left), ("b", right)]
+    elif image.width > image.height and spreads == 'rotate':
+        parts = [("", image.rotate(90, expand=True))]
+    else:
+        parts = [("", image)]
+
+    pages = []
+    for suffix, part in parts:
+        if width is not None:
+            scale = min(width / part.width, height / part.height)
+            part = part.resize((max(round(part.width * scale), 1), max(round(part.height * scale), 1)), Image.LANCZOS)
+        output = io.BytesIO()
+        part.save(output, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        pages.append((suffix, output.getvalue()))
+    return pages
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> concurrent.futures.ProcessPoolExecutor:
+    """Returns the shared process pool, starting it on first use. Call it before starting other threads (ie the
+    download engine): on Linux the workers are forked, and forking copies whatever locks other threads hold.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # * fork where we can, workers start instantly and don't import the script that started them again
+            context = multiprocessing.get_context("fork" if sys.platform.startswith("linux") else None)
+            _pool = concurrent.futures.ProcessPoolExecutor(max_workers=preprocess_workers or os.cpu_count(), mp_context=context)
+            _pool.submit(int).result() # * Forked workers are all started on the first task, do it now
+        return _pool
+
+
+def close_pool() -> None:
+    """Stops the worker processes if they were started."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
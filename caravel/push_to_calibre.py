@@ -0,0 +1,277 @@
+# Send book to Calibre
+# Books are added with a single "calibredb add" for a whole run. Their metadata and cover are written into the EPUBs
+# first, so Calibre reads everything from the files and nothing has to be set book by book. A volume that was rebuilt
+# after it was pushed (watch mode, see pipeline.reopen_volume()) replaces the EPUB of its book instead, since Calibre
+# would skip it as a duplicate. When calibre_library is the address of a content server, calibredb talks to it and
+# Calibre can stay open.
+
+import os
+import re
+import subprocess
+import threading
+import time
+
+from . import events
+from . import metrics
+from .epub_builder import stamp_metadata
+from .misc_utils import working_path
+from .settings import calibre_library, calibre_password, calibre_path, calibre_timeout, calibre_username, use_calibre
+
+LOCK_REFRESH = 15 # * Seconds between two touches of the lock file while it is held
+LOCK_STALE_AFTER = 4 * LOCK_REFRESH # * A lock file not touched for this long was left by a process that died
+
+_library_lock = threading.Lock()
+
+
+class LibraryLock:
+    """Makes sure only one calibredb writes to the library at a time, across threads and across Caravel processes
+    (a lock file in the working directory). The holder touches the lock file every LOCK_REFRESH seconds, however long
+    calibredb takes, so a lock file that wasn't touched for LOCK_STALE_AFTER was left by a process that died and is
+    taken over.
+    """
+
+    def __init__(self, path: str = None, timeout: float = calibre_timeout):
+        self.path = path or working_path("calibre.lock")
+        self.timeout = timeout
+        self.released = threading.Event()
+        self.heartbeat = None
+
+    def _refresh(self) -> None:
+        while not self.released.wait(LOCK_REFRESH):
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass # * Taken over or removed, nothing better to do than carry on
+
+    def __enter__(self):
+        _library_lock.acquire()
+        try:
+            self._acquire_file()
+        except BaseException:
+            _library_lock.release() # * ie a read-only working directory, later pushes must not wait on this one
+            raise
+        self.released.clear()
+        self.heartbeat = threading.Thread(target=self._refresh, name="calibre-lock", daemon=True)
+        self.heartbeat.start()
+        return self
+
+    def _acquire_file(self) -> None:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                os.close(os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.path) > LOCK_STALE_AFTER:
+                        os.remove(self.path)
+                        continue
+                except OSError:
+                    continue # * Released between the two calls
+                if time.monotonic() > deadline:
+                    raise TimeoutError("Calibre library is locked by another process: " + self.path)
+                time.sleep(0.5)
+
+    def __exit__(self, *exc):
+        self.released.set()
+        self.heartbeat.join()
+        try:
+            os.remove(self.path)
+        finally:
+            _library_lock.release()
+
+
+def calibredb(args: list, timeout: float = calibre_timeout) -> dict:
+    """Runs calibredb on the configured library (a folder or a content server).
+
+    Args:
+        args (list): Command and arguments, ie ["add", "book.epub"].
+        timeout (float, optional): Seconds before calibredb is killed. Defaults to the calibre_timeout setting.
+
+    Returns:
+        dict: {"returncode": int (None if it timed out), "output": str (stdout and stderr combined)}
+    """
+    command = [calibre_path or "calibredb"] + args
+    password = None
+    if calibre_library != '':
+        command += ['--with-library', calibre_library]
+        if calibre_username != '':
+            # * Read from stdin by calibredb, on the command line anyone could see it with ps
+            command += ['--username', calibre_username, '--password', '<stdin>']
+            password = (calibre_password + '\n').encode("utf-8")
+    try:
+        run = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, input=password,
+                             stdin=subprocess.DEVNULL if password is None else None, timeout=timeout)
+        return {"returncode": run.returncode, "output": run.stdout.decode("utf-8", "replace")}
+    except subprocess.TimeoutExpired as e:
+        return {"returncode": None, "output": (e.stdout or b"").decode("utf-8", "replace")}
+
+
+def _validate_book(epub_path, author, series, volume, title, cover_path) -> dict:
+    # * Same checks as always, returns the cleaned up book, or a failed result with "success" in it
+    error_message = ''
+
+    # First, go over author list and format a string out of it if it's not empty:
+    if len(author) > 0:
+        try:
+            author = [str(name) for name in author]
+        except:
+            author = []
+            error_message += 'AUTHOR_LIST_ERROR, '
+            events.message('Author is list parameter failing, ignoring', "warning")
+    else:
+        author = []
+        error_message += 'AUTHOR_EMPTY, '
+        events.message('Author list is empty, ignoring', "warning")
+
+    # Check if series is a string:
+    if type(series) != str:
+        series = ''
+        error_message += 'SERIES_NOT_STRING, '
+        events.message('Series is not a string, ignoring', "warning")
+
+    # Repeat for title:
+    if type(title) != str:
+        title = ''
+        error_message += 'TITLE_NOT_STRING, '
+        events.message('Title is not a string, ignoring', "warning")
+
+    # Then, check if the series has a volume number and format it accordingly:
+    if volume != '':
+        try:
+            volume = float(volume)
+        except:
+            volume = ''
+            error_message += 'VOLUME_NOT_FLOAT, '
+            events.message('Volume "' + str(volume) + '" is not a float, ignoring', "warning")
+
+    # Now check if epub and cover paths are correctly formatted and exist:
+    if type(epub_path) != str:
+        events.message('EPUB path "' + str(epub_path) + '" is not a string', "warning")
+        return {"success": False, "book id": None, "error": error_message + 'EPUB_NOT_STRING'}
+    if type(cover_path) != str:
+        events.message('Cover path "' + str(cover_path) + '" is not a string', "warning")
+        return {"success": False, "book id": None, "error": error_message + 'COVER_NOT_STRING'}
+
+    if not os.path.exists(epub_path):
+        events.message('EPUB path "' + str(epub_path) + '" does not exist', "warning")
+        return {"success": False, "book id": None, "error": error_message + 'EPUB_NOT_EXIST'}
+    if not os.path.exists(cover_path):
+        events.message('Cover path "' + str(cover_path) + '" does not exist, ignoring', "warning")
+        cover_path = ''
+        error_message += 'COVER_NOT_EXIST, '
+    return {"epub_path": epub_path, "authors": author, "series": series, "volume": volume, "title": title, "cover_path": cover_path, "error": error_message}
+
+
+def find_book(title: str) -> int:
+    """Returns the Calibre ID of the book with exactly this title, or None. Only call it while holding LibraryLock."""
+    run = calibredb(['search', '--limit', '1', 'title:"=' + title.replace('\\', '\\\\').replace('"', '\\"') + '"'])
+    found = re.search(r"\d+", run["output"]) if run["returncode"] == 0 else None
+    return int(found.group()) if found else None
+
+
+def push_books(books: list) -> list:
+    """Pushes several books to Calibre with one calibredb call. Books to replace get one more call each.
+
+    Args:
+        books (list): One dict per book, with the arguments of push_to_calibre(): {"epub_path": str, "author": list,
+        "series": str, "volume": float, "title": str, "cover_path": str}, and optionally "replace": True for a book
+        that is already in Calibre and must be replaced, with "book_id" its Calibre ID if known (otherwise it is looked
+        up by title). A book to replace that is no longer in Calibre is added again.
+
+    Returns:
+        list: One result per book, in the same order, see push_to_calibre(). List of errors, on top of the ones from
+        the checks on the arguments:
+        - ALREADY_IN_LIBRARY: Calibre already had this book and skipped it ("success" is True, "book id" is None). For a
+        book to replace, "success" is False: Calibre still has the old one
+        - CALIBRE_PUSH_FAILED: calibredb failed, timed out or didn't say which books it added
+    """
+    if use_calibre == False:
+        events.message('Calibre push disabled, skipping...')
+        return [{"success": True, "book id": None, "error": "CALIBRE_DISABLED"} for _ in books]
+
+    results = [None] * len(books)
+    to_add = [] # * (index in books, validated book)
+    to_replace = [] # * (index in books, validated book, Calibre ID or None)
+    for index, book in enumerate(books):
+        checked = _validate_book(book["epub_path"], book["author"], book["series"], book["volume"], book["title"], book["cover_path"])
+        if "success" in checked:
+            results[index] = checked
+            continue
+        try:
+            volume = checked["volume"]
+            if volume != '' and volume == int(volume):
+                volume = int(volume) # * 1 reads better than 1.0 in Calibre
+            stamp_metadata(checked["epub_path"], checked["title"], checked["authors"], checked["series"],
+                           volume if volume != '' else None, checked["cover_path"] or None)
+        except Exception as e:
+            events.message('Could not write metadata into "' + checked["epub_path"] + '", Calibre will use what the file has: ' + str(e), "warning")
+            checked["error"] += 'METADATA_NOT_WRITTEN, '
+        if book.get("replace"):
+            to_replace.append((index, checked, book.get("book_id")))
+        else:
+            to_add.append((index, checked))
+    if len(to_add) == 0 and len(to_replace) == 0:
+        return results
+
+    replaced = 0
+    try:
+        with LibraryLock():
+            time_start = time.perf_counter() # * Not counting the wait for the lock
+            for index, book, book_id in to_replace:
+                if book_id is None:
+                    book_id = find_book(book["title"])
+                if book_id is not None and calibredb(['add_format', '--replace', str(book_id), book["epub_path"]])["returncode"] == 0:
+                    results[index] = {"success": True, "book id": book_id, "error": book["error"][:-2]}
+                    replaced += 1
+                else:
+                    to_add.append((index, book)) # * Removed from Calibre since it was pushed
+            calibre_run = calibredb(['add'] + [book["epub_path"] for _, book in to_add]) if to_add else {"returncode": 0, "output": ""}
+            metrics.observe("caravel_calibre_push_seconds", time.perf_counter() - time_start)
+            metrics.inc("caravel_calibre_books_total", len(to_add) + replaced)
+    except Exception as e:
+        calibre_run = {"returncode": None, "output": str(e)}
+        pending = dict(to_add)
+        pending.update({index: book for index, book, _ in to_replace if results[index] is None})
+        to_add = sorted(pending.items())
+    output = calibre_run["output"]
+
+    # "Added book ids: 12, 13" in the order of the files, after skipping the ones listed as already in the library
+    ids_match = re.search(r"Added book ids?: ([\d,\s]+)", output)
+    book_ids = [int(book_id) for book_id in re.findall(r"\d+", ids_match.group(1))] if ids_match else []
+    duplicates_start = output.find("already exist in the database")
+    duplicates = output[duplicates_start:] if duplicates_start != -1 else ""
+    added = [(index, book) for index, book in to_add if not (duplicates and book["epub_path"] in duplicates)]
+
+    if calibre_run["returncode"] != 0 or len(book_ids) != len(added):
+        events.message('Calibre push failed:\n' + output, "error")
+        for index, book in to_add:
+            results[index] = {"success": False, "book id": None, "error": book["error"] + 'CALIBRE_PUSH_FAILED'}
+        return results
+
+    for (index, book), book_id in zip(added, book_ids):
+        results[index] = {"success": True, "book id": book_id, "error": book["error"][:-2]}
+    replacing = {index for index, _, _ in to_replace}
+    for index, book in to_add:
+        if results[index] is None:
+            results[index] = {"success": index not in replacing, "book id": None, "error": book["error"] + 'ALREADY_IN_LIBRARY'}
+    events.message('Calibre push successful, added ' + str(len(book_ids)) + ' book(s)' + (', replaced ' + str(replaced) if replaced else ''))
+    return results
+
+
+def push_to_calibre(epub_path: str, author: list, series: str, volume: float, title: str, cover_path: str) -> dict:
+    """Aggregate all required data to push a book to Calibre alongside relevant metadata.
+    Use push_books() to push several books at once, calibredb is slow to start.
+
+    Args:
+        epub_path (str): Location of the epub file to push using "\\" as a separator
+        author (list): Author list of the book, each other is a string in a list
+        series (str): Name of the book series if it has one
+        volume (float): Volume number (as a float) in the series if it has one
+        title (str): Real title of the book
+        cover_path (str): Path to an image file of the book's cover, using "\\" as a separator
+    Returns:
+        dict: Dictionary containing the data: {"success": bool, "book id": int, "error": str}
+    Where "success" is a boolean indicating whether the operation was successful, "book id" is the id of the book in Calibre's database, and "error" is a string containing the error message if the operation failed
+    """
+    return push_books([{"epub_path": epub_path, "author": author, "series": series, "volume": volume, "title": title, "cover_path": cover_path}])[0]
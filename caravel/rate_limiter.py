@@ -0,0 +1,153 @@
+# Rate limiter for the Mangadex API. Keeps one token bucket per kind of endpoint and reads the rate limit headers
+# Mangadex sends back so we can go as fast as we are allowed to without getting 429s.
+# See https://api.mangadex.org/docs/2-limitations/#endpoint-specific-rate-limits
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .settings import api_rate_limit, api_url, at_home_rate_limit
+
+API_HOST = urlsplit(api_url).netloc
+
+
+class TokenBucket:
+    """A thread-safe token bucket. Tokens refill continuously at "rate" per second up to "capacity". On top of the
+    bucket itself, the server can tell us to stop until a given time (block_until), which always wins.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0 # * monotonic time before which nothing goes through, set from the headers
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Takes a token and returns how long the caller has to wait before using it. The token is reserved even if
+        the caller has to wait, so concurrent callers are spaced out correctly.
+
+        Returns:
+            float: Seconds to wait, 0 if the request can go right away.
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def acquire(self) -> None:
+        """Blocks until a request is allowed through this bucket."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def sync(self, remaining: int = None, reset_in: float = None) -> None:
+        """Adjusts the bucket to what the server says is left.
+
+        Args:
+            remaining (int, optional): Requests left in the current window (X-RateLimit-Remaining).
+            reset_in (float, optional): Seconds until the window resets (from X-RateLimit-Retry-After).
+        """
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if remaining is not None:
+                # * Never trust our own count over the server's, it sees every client on this IP
+                self.tokens = min(self.tokens, remaining)
+                if remaining <= 0 and reset_in is not None:
+                    self.blocked_until = max(self.blocked_until, now + reset_in)
+            elif reset_in is not None:
+                # * No "remaining" means it was a 429, back off until the server says so
+                self.tokens = min(self.tokens, 0)
+                self.blocked_until = max(self.blocked_until, now + reset_in)
+
+
+# One bucket per endpoint class. Image hosts (MD@Home nodes, uploads.mangadex.org) are not limited.
+BUCKETS = {
+    "api": TokenBucket(api_rate_limit, api_rate_limit),
+    "at-home": TokenBucket(at_home_rate_limit / 60, at_home_rate_limit),
+}
+
+
+def endpoint_class(url: str) -> str:
+    """Sorts a URL into the rate limit class it belongs to.
+
+    Args:
+        url (str): Full URL of the request.
+
+    Returns:
+        str: "at-home" for /at-home/server lookups, "api" for anything else on the API host, "images" otherwise.
+    """
+    parts = urlsplit(url)
+    if parts.netloc != API_HOST:
+        return "images"
+    if parts.path.startswith("/at-home/server"):
+        return "at-home"
+    return "api"
+
+
+def _buckets_for(url: str) -> list:
+    kind = endpoint_class(url)
+    if kind == "at-home":
+        return [BUCKETS["at-home"], BUCKETS["api"]] # * The at-home limit is on top of the global one
+    return [BUCKETS[kind]] if kind in BUCKETS else []
+
+
+def acquire(url: str) -> None:
+    """Blocks until a request to this URL is allowed. Call right before sending the request.
+
+    Args:
+        url (str): Full URL of the request.
+    """
+    for bucket in _buckets_for(url):
+        bucket.acquire()
+
+
+def retry_after(headers) -> float:
+    """Reads how long the server wants us to wait from the response headers.
+
+    Args:
+        headers: Response headers (any mapping).
+
+    Returns:
+        float: Seconds to wait, or None if the headers don't say.
+    """
+    value = headers.get("X-RateLimit-Retry-After") or headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        value = float(value)
+    except ValueError:
+        return None
+    # * Mangadex sends a unix timestamp, the standard header is a number of seconds
+    return max(value - time.time(), 0.0) if value > 1e9 else value
+
+
+def update(url: str, status_code: int, headers) -> None:
+    """Feeds the rate limit headers of a response back into the buckets. Call right after a response is received.
+
+    Args:
+        url (str): Full URL of the request.
+        status_code (int): HTTP status of the response.
+        headers: Response headers (any mapping).
+    """
+    buckets = _buckets_for(url)
+    if not buckets:
+        return
+    wait = retry_after(headers)
+    if status_code == 429:
+        buckets[0].sync(reset_in=wait if wait is not None else 1.0)
+        return
+    remaining = headers.get("X-RateLimit-Remaining")
+    if remaining is not None:
+        try:
+            buckets[0].sync(remaining=int(remaining), reset_in=wait)
+        except ValueError:
+            pass
@@ -0,0 +1,98 @@
+# We want to stop relying on external services to download. Call Mangadex directly
+# https://api.mangadex.org/docs/retrieving-chapter/
+# https://api.mangadex.org/docs/redoc.html#tag/Manga/operation/get-manga-tag
+
+# Page above will explain in stunning detail how to do it. Just load it and store the images. Do what they ask for and so on.
+# Might also be able to pull some metadata.
+
+# This should be done before other metadata mapping so that we have a solid basis that wont change further.
+
+# Requirements:
+# - Mangadex just wants to know the "chapter ID". This is the ID of the chapter in the chapter list.
+# That's it
+
+# A chapter is a unique bundle of images. A volume may be associated to it. There are also multiple languages. We want to only request english, and avoid duplicate chapters.
+# So we also need to:
+# - Identify the manga on mangadex
+# - Determine if it is available in english
+# - Determine which scanlation group to use if more than one (use the one with the most chapters in the entire series, or only one available)
+
+# We would also like to separate the chapters into volumes. Research the API further to see if this is doable. It will depend on proper formating from scanlaters, but usually they are good about it.
+
+# Since we want to use anilist for metadata, being able to crossmatch Anilist and Mangadex entries would be nice. See their respective API...
+# See https://api.mangadex.org/docs/static-data/ in section 'Manga links data', Mangadex may declare where the manga is in Anilist, can we reverse it?
+# Answer: No, but we can use it to confirm. Using Anilist titles in a search seems ok
+# Basically: Anilist -> Title search in Mangadex -> Confirm correct manga by going back to anilist
+
+# For now, only search unsing inputted title
+
+# Some of this code is using https://api.mangadex.org/docs/guide/find-manga/ as a reference
+
+import argparse
+
+from . import events
+from .func import chapter_request_and_files, select_volumes_to_download
+from .nav import series_select_nav, title_search_nav
+from .pipeline import run_series, shutdown
+
+
+def main(argv: list = None) -> int:
+    """Interactive run: search a title, pick the series and its volumes, then download, convert and push them.
+    See batch.py to run a list of series without any prompt."""
+    argparse.ArgumentParser(prog="caravel get", description="Search a series on Mangadex, pick its volumes, then download, convert and push them.").parse_args(argv)
+    # ====================================================================================================
+    # ? Start by getting the title to lookup
+    title_lookup = title_search_nav() # ! This function does an API request!
+
+    # ====================================================================================================
+    # ? Now do the search and show the results, then ask the user which to use
+    user_select = series_select_nav(title_lookup) # ! This function MAY make an API request!
+
+    # ====================================================================================================
+    # * All of these below are for compatibility, they should be replaced later on
+    us = user_select # Shortcut for later
+    id_select = int(us['response']) - 1
+
+    authors_list = us["contributors"]["names"]
+
+    # ====================================================================================================
+    # We now have a title to work with. We need to get the ID of the manga on Mangadex to continue
+    print('\n\n\n')
+    # TODO make this its own navigation function that supports going back and exiting
+    chapter_request = chapter_request_and_files(us['mdid'], us['clean_title']) # ! This function does an API request!
+    cr = chapter_request # Shortcut for later
+    # TODO: An alternative to above is to allow the user to select which scanlator to use if a choice is available.
+    # * API requests are cached on disk (see api_cache.py), rerunning a series doesn't request its feed, covers and authors again
+
+    volume_selection = select_volumes_to_download(cr['pseudo_file_structure'])
+    vs = volume_selection # Shortcut for later
+    volume_list = vs['volumes_to_download']
+
+    # ====================================================================================================
+
+    # Now we have a list of volumes to download, we can go through the pseudo_file_structure and download the chapters based on Mangadex IDs
+    # Download, conversion and the push to Calibre overlap between volumes, see pipeline.py
+    info = {
+        "mdid": us['mdid'],
+        "series_title": us['series_title'],
+        "clean_title": us['clean_title'],
+        "authors": authors_list,
+        "main_cover_filename": title_lookup["main_cover_filename"][id_select]
+    }
+    try:
+        run_series(info, cr['pseudo_file_structure'], volume_list)
+    finally:
+        shutdown()
+
+    # Finished the job
+    events.message('Finished downloading all volumes\n========================================\n')
+    return 0
+
+
+if __name__ == "__main__":
+    main()
+
+# At this point, running this script, we went from entering a title search to having ebooks of requested volumes.
+# TODO: Adapt for manga that don't use volumes. Maybe use chapter ranges? ie "Series Title - Ch.20-30.epub"
+# TODO: Include exception handling, error reporting, and attempts for data correction
+# TODO: More general, but allow the user to navigate the steps instead of locking them in a workflow and having to Ctrl+C out of it if they make a mistake
@@ -0,0 +1,235 @@
+# This file contains the settings the script uses. Change them manually as needed. Refer to comments for details.
+# NEVER change the structure of this file other than where prescribed.
+
+# Which tablet model to export for. This is passed to KCC, so it depends on it supporting it. Currently, I am not using the
+# a setup that allows custom resolutions, so for now this is limited to the following:
+# VALID_TABLET_PROFILES = ["K1", "K2", "K34", "K578", "KDX", "KPW", "KPW5", "KV", "KO", "K11", "KS", "KoMT", "KoG", "KoGHD", "KoA", "KoAHD", "KoAH2O", "KoAO", "KoN", "KoC", "KoL", "KoF", "KoS", "KoE"]
+# See https://github.com/darodi/kcc#profiles
+# Default: 'KoL'
+ereader_profile = 'KoL'
+
+# Whether to enable the final step to send to Calibre. Requires Calibre is installed and set up: https://calibre-ebook.com/
+# Turning this off will disable metadata features, meaning this entire script becomes useless. Default: True
+use_calibre = True
+
+# calibredb Path. Leave empty to use the "calibredb" found in PATH. Default: '' (empty)
+calibre_path = ''
+
+# Library to add books to. Either a library folder, or the address of a Calibre content server, ie
+# 'http://localhost:8080/#Calibre_Library' (the part after # is the library ID, see the content server settings).
+# With a content server, Calibre can stay open while books are added. Empty means Calibre's current library, which
+# only works if Calibre is closed. Default: '' (empty)
+calibre_library = ''
+
+# Username and password of the content server, if it requires them. Default: '' (empty)
+calibre_username = ''
+calibre_password = ''
+
+# How long calibredb can take to add the books of a run, in seconds. Also how long we wait for another Caravel to
+# finish adding its books. Default: 600
+calibre_timeout = 600
+
+# Working directory path. Where to store the files the script is working with (books, cache). Default: current directory
+# (leave empty)
+working_dir = ''
+
+# Scanlation groups to prefer when several groups uploaded the same chapter, best first. Names or Mangadex group IDs,
+# ie ['Group A', 'Group B']. Otherwise the group that uploaded the most chapters of the series wins. Default: []
+preferred_groups = []
+
+# Scanlation groups whose uploads are never downloaded, names or Mangadex group IDs. Default: []
+excluded_groups = []
+
+# What is shown during a run: 'bar' (what happens to each volume and a progress bar with the ETA of the whole series),
+# 'json' (one JSON object per line, for job runners, see events.py) or 'quiet' (only warnings and errors).
+# Default: 'bar'
+progress = 'bar'
+
+# How often the progress bar can be redrawn, in seconds. Drawing it for every page slows down runs over SSH or into a
+# log file. Default: 0.25
+progress_interval = 0.25
+
+# Network settings
+# ================================================================================================
+
+# Where Mangadex is: the API, the server covers are downloaded from, and where MD@Home reports go. Only change these
+# to run against a test server, ie the fake one benchmark.py starts. Default: 'https://api.mangadex.org',
+# 'https://uploads.mangadex.org', 'https://api.mangadex.network/report'
+api_url = 'https://api.mangadex.org'
+uploads_url = 'https://uploads.mangadex.org'
+report_url = 'https://api.mangadex.network/report'
+
+# Timeouts in seconds used by every request made through http_client.py. The first one is how long we wait to open a
+# connection, the second is how long we wait between bytes of the response. Default: 5, 30
+connect_timeout = 5
+read_timeout = 30
+
+# How many keep-alive connections to hold open per host. The API host gets its own (smaller) pool since it is rate
+# limited anyway, MD@Home image hosts get the bigger one. Default: 4, 32
+api_pool_size = 4
+image_pool_size = 32
+
+# MD@Home hands out a different baseUrl for almost every chapter, so we only keep pools for the most recently used hosts.
+# Older ones are closed when we go over this number. Default: 8
+max_pooled_hosts = 8
+
+# How many connections the page download engine opens to a MD@Home node as soon as its baseUrl is known, so the
+# handshakes are done by the time the first page of the chapter is requested. 0 disables pre-warming. Default: 4
+prewarm_connections = 4
+
+# Mangadex rate limits, see https://api.mangadex.org/docs/2-limitations/. The global limit is in requests per second, the
+# /at-home/server limit is in requests per minute. Only lower these, the server headers are always followed anyway.
+# Default: 5, 40
+api_rate_limit = 5
+at_home_rate_limit = 40
+
+# How many times a request that got rate limited (429) is retried after waiting what the server asks. Default: 5
+max_rate_limit_retries = 5
+
+# How many pages of a series feed (500 chapters each) are requested at the same time. Default: 4
+feed_workers = 4
+
+# How many covers are downloaded at the same time. Default: 4
+cover_workers = 4
+
+# Limits for the page download engine (page_downloader.py). Connections are shared by every chapter being downloaded.
+# max_inflight_bytes caps how much page data can sit in memory before it is written to disk. Default: 256, 32, 256 MB
+max_page_connections = 256
+max_page_connections_per_host = 32
+max_inflight_bytes = 256 * 1024 * 1024
+
+# How many times a page download is retried before it is reported as failed. Default: 3
+page_retries = 3
+
+# How downloaded pages are stored: 'files' (one file per page, in a folder per chapter), 'chapter' (one CBZ archive per
+# chapter) or 'volume' (one CBZ archive per volume, read directly by KCC). Archives are much easier on the filesystem
+# for big series, but the folders of files are what older runs left on disk. Default: 'files'
+page_storage = 'files'
+
+# Whether to prepare pages for the device (resize, split spreads, greyscale) with Pillow as soon as they are downloaded,
+# in parallel, instead of leaving everything to KCC at the end of the volume. Default: False
+preprocess_pages = False
+
+# How many processes prepare pages at the same time. 0 means one per core. Default: 0
+preprocess_workers = 0
+
+# What to do with double page spreads when preparing pages: 'split' (two pages, right one first), 'rotate' (one
+# landscape page turned sideways) or 'none'. Default: 'split'
+spread_mode = 'split'
+
+# Which version of the pages to download: 'data' (originals), 'data-saver' (recompressed, much smaller) or 'auto'.
+# 'auto' uses data saver pages unless a page is too small for the screen of ereader_profile, in which case the
+# original is downloaded instead. Data saver pages are lossy, so they are only used when asked for. Default: 'data'
+source_quality = 'data'
+
+# How many volumes can be downloading at the same time while earlier ones are converted and pushed. Higher values keep
+# the network busier but MD@Home links expire after a while, so don't go crazy. Default: 2
+pipeline_lookahead = 2
+
+# How many series go through the pipeline at the same time in "caravel batch", "caravel watch" and api.run_all().
+# They share the download connections, the rate limit and the conversion workers, each series getting a share in
+# proportion to its weight (1 unless the job says otherwise), so a long series doesn't hold up the short ones behind
+# it. Default: 1 (one series after the other)
+parallel_series = 1
+
+# Whether to keep Mangadex API responses on disk (in the "cache" folder of the working directory) and reuse them.
+# Default: True
+use_api_cache = True
+
+# How long cached responses stay valid, in seconds, per kind of request. Searches go stale quickly, authors and covers
+# almost never change. MD@Home links expire on their own after about 15 minutes.
+api_cache_ttl = {
+    "search": 10 * 60,
+    "feed": 60 * 60,
+    "author": 30 * 24 * 60 * 60,
+    "cover": 7 * 24 * 60 * 60,
+    "at-home": 10 * 60,
+    "other": 60 * 60,
+}
+
+# Maximum size of the API cache on disk, in bytes. The least recently used responses are removed first. Default: 200 MB
+api_cache_max_size = 200 * 1024 * 1024
+
+# Offline mode: everything is served from the cache whatever its age and the network is never used. A run only works
+# offline if the same run was done online before. Requires use_api_cache. Default: False
+offline = False
+
+# Whether to tell Mangadex how each image download from a MD@Home node went (success, size, time), as they ask clients
+# to do so bad nodes can be taken out of rotation. Reports are sent in the background. Default: True
+report_to_mangadex = True
+
+# Reports are sent (one request each) as soon as this many are waiting, or every report_interval seconds. Default: 20 and 5
+report_batch_size = 20
+report_interval = 5
+
+# A MD@Home node slower than this, in bytes per second, is considered unhealthy and the chapter is moved to another
+# node. Only judged after node_min_pages pages were downloaded from it. Default: 100 KB/s and 3
+node_throughput_floor = 100 * 1024
+node_min_pages = 3
+
+# How many times a chapter can be moved to another node before we keep whatever node we have. Default: 2
+max_node_failovers = 2
+
+# Conversion settings
+# ================================================================================================
+
+# How volumes are made into EPUBs: 'kcc' (always kcc-c2e) or 'native' (Caravel writes the EPUB itself, much faster).
+# 'native' only works on pages that are already the right size for the device (see preprocess_pages), other volumes
+# are still converted by KCC. Default: 'kcc'
+converter = 'kcc'
+
+# kcc-c2e Path. Leave empty to use the "kcc-c2e" found in PATH. Default: '' (empty)
+kcc_path = ''
+
+# How many volumes KCC can convert at the same time. Each conversion is its own kcc-c2e process, so this is roughly how
+# many cores conversion will use. Default: 2
+kcc_workers = 2
+
+# How long a single volume conversion can run before it is killed and reported as failed, in seconds. Default: 1800
+kcc_timeout = 1800
+
+# Niceness given to kcc-c2e processes so downloads stay responsive (0 to 19, higher is nicer). On Windows any value above
+# 0 means "below normal" priority. Default: 10
+kcc_niceness = 10
+
+# CPU cores kcc-c2e processes are allowed to run on, ie [2, 3, 4, 5]. Empty means any core. Linux only. Default: []
+kcc_cpu_affinity = []
+
+# Watch mode settings (watch.py)
+# ================================================================================================
+
+# How often followed series are checked for new chapters, in seconds. Each check is one small feed request per series.
+# Default: 3600 (1 hour)
+watch_interval = 60 * 60
+
+# How often the full feed of a followed series is read again instead of only what changed, in seconds. Chapters with a
+# delayed release are only in the feed once released, without their update time changing, so only a full read sees
+# them. Default: 604800 (1 week)
+watch_full_sync_interval = 7 * 24 * 60 * 60
+
+# Metrics settings (metrics.py)
+# ================================================================================================
+
+# Prometheus textfile the run metrics are written to (request latency, bytes, retries, pages/s, KCC and Calibre times,
+# peak memory), ie '/var/lib/node_exporter/textfile/caravel.prom' for node_exporter's textfile collector. Rewritten
+# every metrics_interval seconds while a run goes on. Empty to not write it. Default: '' (empty)
+metrics_textfile = ''
+
+# JSON file the same metrics are written to at the end of a run. Empty to not write it. Default: '' (empty)
+metrics_report = ''
+
+# How often the textfile is rewritten during a run, in seconds. Default: 15
+metrics_interval = 15
+
+# Whether to trace Python memory allocations (tracemalloc) for the peak memory metric. The peak resident size of the
+# process is always reported where the OS gives it, tracing adds what Python itself allocated but slows down the
+# whole run. Default: False
+metrics_trace_memory = False
+
+# Settings below are not implemented yet
+# ================================================================================================
+
+# Whether to delete files when done or not. Unsafe as the script has limited testing, use at your own risk.
+# Some files will always clean up. Default: False
+# TODO Not implemented yet, does not do anything
+destructive = False
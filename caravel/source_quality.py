@@ -0,0 +1,105 @@
+# Which version of the pages to download. MD@Home has every page twice: "data" (the original upload) and "dataSaver"
+# (recompressed, smaller). KCC resizes every page to the screen of the ereader profile anyway, so for small screens the
+# originals are mostly wasted bandwidth. In "auto" mode pages are downloaded from dataSaver, and a page that would have
+# to be upscaled to fill the screen is downloaded again from data.
+
+import io
+import threading
+
+from .kcc_conversion import PROFILE_RESOLUTIONS
+from .settings import ereader_profile, source_quality
+
+UPSCALE_TOLERANCE = 1.05 # * A page 5% smaller than the screen still looks fine, don't download it twice for that
+
+
+def image_size(data) -> tuple:
+    """Returns the (width, height) of an image from its bytes, or None if it can't be read. Only the header is parsed."""
+    from PIL import Image
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    except Exception:
+        return None
+
+
+def is_enough(size: tuple, profile: str = ereader_profile) -> bool:
+    """Whether a page of this size fills the screen of the profile without being upscaled.
+
+    Args:
+        size (tuple): (width, height) of the page.
+        profile (str, optional): KCC profile of the device. Defaults to the ereader_profile setting.
+
+    Returns:
+        bool: True if the page is big enough, or if we can't tell.
+    """
+    if size is None or profile not in PROFILE_RESOLUTIONS:
+        return True
+    screen_width, screen_height, _ = PROFILE_RESOLUTIONS[profile]
+    width, height = size
+    if width > height:
+        width = width / 2 # * Double page spreads are split in two by KCC
+    return min(screen_width / width, screen_height / height) <= UPSCALE_TOLERANCE
+
+
+def use_data_saver(quality: str = source_quality, profile: str = ereader_profile) -> bool:
+    """Whether pages should be downloaded from dataSaver first, for the source_quality setting and the profile."""
+    if quality == "data-saver":
+        return True
+    return quality == "auto" and profile in PROFILE_RESOLUTIONS
+
+
+class SourceStats:
+    """Counts what was downloaded from where during a run. The bytes saved by dataSaver are estimated: for the first
+    page of each chapter, the size of the original is asked with a HEAD request, and the ratio is applied to the
+    rest of the chapter.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pages = {"data": 0, "data-saver": 0, "fallback": 0}
+        self.bytes = {"data": 0, "data-saver": 0, "fallback": 0}
+        self.chapter_bytes = {} # * chapter ID -> dataSaver bytes
+        self.ratios = {} # * chapter ID -> size of the original / size of the dataSaver version
+        self.saved = 0.0 # * Estimate for the chapters that are done, see finish_chapter()
+
+    def record(self, chapter_id, quality: str, size: int) -> None:
+        with self.lock:
+            self.pages[quality] += 1
+            self.bytes[quality] += size
+            if quality == "data-saver":
+                self.chapter_bytes[chapter_id] = self.chapter_bytes.get(chapter_id, 0) + size
+
+    def needs_sample(self, chapter_id) -> bool:
+        """True the first time it is called for a chapter, so only one page per chapter is sampled."""
+        with self.lock:
+            if chapter_id in self.ratios:
+                return False
+            self.ratios[chapter_id] = None
+            return True
+
+    def sample(self, chapter_id, saver_size: int, original_size: int) -> None:
+        with self.lock:
+            if saver_size > 0 and original_size:
+                self.ratios[chapter_id] = original_size / saver_size
+
+    def finish_chapter(self, chapter_id) -> None:
+        """Folds what a chapter saved into the total and forgets the chapter, once none of its pages are left."""
+        with self.lock:
+            size, ratio = self.chapter_bytes.pop(chapter_id, 0), self.ratios.pop(chapter_id, None)
+            if ratio:
+                self.saved += size * (ratio - 1)
+
+    def saved_bytes(self) -> int:
+        """Estimated bytes not downloaded thanks to dataSaver, minus the dataSaver pages that had to be downloaded again."""
+        with self.lock:
+            saved = self.saved + sum(size * (self.ratios[chapter_id] - 1) for chapter_id, size in self.chapter_bytes.items() if self.ratios.get(chapter_id))
+            return int(saved - self.bytes["fallback"])
+
+    def summary(self) -> str:
+        with self.lock:
+            if self.pages["data-saver"] == 0 and self.pages["fallback"] == 0:
+                return "Downloaded " + str(self.pages["data"]) + " original pages"
+            text = (f"Downloaded {self.pages['data-saver']} data saver pages and {self.pages['data']} original pages"
+                    f" ({self.pages['fallback']} were too small for the screen)")
+        return text + f", about {round(self.saved_bytes() / 1024 / 1024, 1)} MB saved"
@@ -0,0 +1,230 @@
+# Follow list and watch mode. Every watch_interval, each followed series is checked with a single feed request for the
+# chapters created or updated since the newest one we saw (updatedAtSince), the pseudo file structure is updated with
+# only those chapters, and only the volumes they changed go through the pipeline. The follow list and the last sync of
+# every series are kept in the journal, so the daemon can be stopped and started again at any time.
+# Usage:
+#   caravel watch follow <mangadex id> [--volumes 1-5,7] [--profile KoL]
+#   caravel watch unfollow <mangadex id>
+#   caravel watch list
+#   caravel watch run [--once] [--parallel 4] [--progress json]
+
+import argparse
+import concurrent.futures
+import copy
+import sys
+import time
+
+from . import events
+from .batch import job_summary
+from .cbz_storage import natural_key
+from .func import (build_pseudo_file_structure, chapter_request, extract_chapter_info, parse_volume_ranges, safe_title, select_uploads,
+                  series_request)
+from .journal import get_journal
+from .kcc_conversion import PROFILE_RESOLUTIONS
+from .misc_utils import working_path
+from .pipeline import reopen_volume, run_series, shutdown, volume_key
+from .preprocess import get_pool
+from .settings import (converter, ereader_profile, feed_workers, parallel_series, preprocess_pages, progress, watch_full_sync_interval,
+                       watch_interval)
+
+
+def follow(mdid: str, volumes="all", profile: str = ereader_profile) -> dict:
+    """Adds a series to the follow list. Its volumes are downloaded on the next watch cycle.
+
+    Args:
+        mdid (str): Mangadex ID of the series.
+        volumes (optional): "all" or a list of volume numbers. Defaults to "all".
+        profile (str, optional): KCC profile of the device. Defaults to the ereader_profile setting.
+
+    Returns:
+        dict: The series, see func.series_request().
+    """
+    info = series_request(mdid) # ! API request
+    get_journal().follow(mdid, info["series_title"], profile, volumes)
+    return info
+
+
+def _is_selected(followed: dict, volume: str) -> bool:
+    return volume != 'stranded' and (followed["volumes"] == "all" or volume in [volume_key(number) for number in followed["volumes"]])
+
+
+def sync_series(followed: dict) -> dict:
+    """Asks Mangadex what changed in a followed series since its last sync. Doesn't save anything.
+
+    Args:
+        followed (dict): The series, see journal.Journal.followed().
+
+    Returns:
+        dict: {"full": whether the whole feed was read, "structure": updated pseudo file structure, "cursor": str,
+        "seen": {chapter id: updatedAt}, "coverage": see func.select_uploads(), "changed": {volume: [chapters to download again]} for the volumes whose
+        chapters changed, every volume on the first sync}
+    """
+    title = safe_title(followed["title"])
+    old_structure = followed["structure"] if followed["structure"] and title in followed["structure"] else None
+    full = (old_structure is None or followed["cursor"] is None or followed["coverage"] is None
+            or time.time() - (followed["full_sync"] or 0) > watch_full_sync_interval)
+    feed = chapter_request(followed["mdid"], None if full else followed["cursor"]) # ! API request, a single one when nothing changed
+    if feed.get("result") != "ok":
+        raise RuntimeError(f"Feed request failed for {followed['mdid']}: {feed.get('errors')}")
+
+    # * updatedAtSince includes the cursor itself, so the newest chapter comes back every time, it's not a change
+    updated = [chapter for chapter in feed["data"] if followed["seen"].get(chapter["id"]) != chapter["attributes"]["updatedAt"]]
+    if full:
+        uploads = select_uploads(feed)
+        chapter_id_list, _ = extract_chapter_info(uploads)
+        structure = build_pseudo_file_structure(uploads, title, chapter_id_list)
+        seen = {chapter["id"]: chapter["attributes"]["updatedAt"] for chapter in feed["data"]}
+    else:
+        # * Another group's upload of a chapter we have doesn't replace it, unless the group is preferred. Groups are
+        # * compared on every chapter they uploaded, as in a full sync, not only on what changed. The structure is keyed
+        # * by func.chapter_name(), like select_uploads(), so chapters without a number stay apart here too
+        current = {chapter: chapter_id for volume in old_structure[title].values() for chapter, chapter_id in volume.items()}
+        uploads = select_uploads({"data": updated}, current=current, coverage=followed["coverage"])
+        structure = build_pseudo_file_structure(uploads, title, [chapter["id"] for chapter in uploads["data"]], copy.deepcopy(old_structure))
+        seen = dict(followed["seen"], **{chapter["id"]: chapter["attributes"]["updatedAt"] for chapter in updated})
+    updated_ids = {chapter["id"] for chapter in updated} & {chapter["id"] for chapter in uploads["data"]}
+
+    changed = {}
+    if old_structure is None:
+        changed = {volume: [] for volume in structure[title]}
+    else:
+        for volume in set(structure[title]) | set(old_structure[title]):
+            old_chapters, new_chapters = old_structure[title].get(volume, {}), structure[title].get(volume, {})
+            chapters = [chapter for chapter in set(old_chapters) | set(new_chapters)
+                        if old_chapters.get(chapter) != new_chapters.get(chapter) or new_chapters.get(chapter) in updated_ids]
+            if chapters:
+                changed[volume] = chapters
+    return {
+        "full": full,
+        "structure": structure,
+        "cursor": max(seen.values())[:19] if seen else None, # * updatedAtSince wants "2024-01-31T12:00:00", no offset
+        "seen": seen,
+        "coverage": uploads["coverage"],
+        "changed": changed
+    }
+
+
+def update_series(followed: dict, syncing: concurrent.futures.Future, converter: str = converter, weight: float = 1.0) -> dict:
+    """Saves what the sync of a followed series found, reopens the volumes that changed, and runs them, and the ones a
+    previous cycle didn't finish, through the pipeline. Never raises.
+
+    Args:
+        followed (dict): See journal.JobJournal.followed().
+        syncing (concurrent.futures.Future): Future of sync_series() for this series.
+        converter (str, optional): See pipeline.convert_volume(). Defaults to the converter setting.
+        weight (float, optional): Share of the downloads and conversions, see fair_queue.py. Defaults to 1.0.
+
+    Returns:
+        dict: Summary of the series, see batch.run_jobs(), or None if it had nothing to run or couldn't be checked.
+    """
+    journal = get_journal()
+    try:
+        sync = syncing.result()
+    except Exception as e:
+        events.message(f"Could not check {followed['title']} ({followed['mdid']}): {e}", "warning")
+        return None
+    first_sync = followed["structure"] is None
+    title = safe_title(followed["title"])
+    for volume, chapters in sync["changed"].items():
+        if not first_sync and _is_selected(followed, volume):
+            events.message(f"{followed['title']}: volume {volume} changed ({len(chapters)} chapter(s))")
+            reopen_volume(followed["mdid"], working_path("books", title), volume, chapters)
+    # * Saved before running, an interrupted run is picked up below on the next cycle
+    journal.save_sync(followed["mdid"], sync["cursor"], time.time() if sync["full"] else followed["full_sync"], sync["structure"], sync["seen"], sync["coverage"])
+
+    unfinished = [row["volume"] for row in journal.status(followed["mdid"]) if row["state"] != "pushed"]
+    volumes = sorted({volume for volume in list(sync["changed"]) + unfinished
+                      if _is_selected(followed, volume) and volume in sync["structure"][title]}, key=natural_key)
+    if not volumes:
+        return None
+    job_start = time.perf_counter()
+    job = {"mdid": followed["mdid"], "profile": followed["profile"]}
+    try:
+        info = series_request(followed["mdid"]) # ! API request, cached
+        info["series_title"], info["clean_title"] = followed["title"], title # * The structure is under the followed title
+        volumes = [int(volume) if volume.isdigit() else volume for volume in volumes]
+        pipeline_results = run_series(info, sync["structure"], volumes, followed["profile"], converter, weight)
+        return job_summary(job, {"info": info, "missing": []}, pipeline_results, time.perf_counter() - job_start)
+    except Exception as e:
+        events.message(f"Update of {followed['title']} failed: {e}", "error")
+        return None
+
+
+def watch_cycle(parallel: int = parallel_series) -> list:
+    """Checks every followed series once and runs the volumes that changed, and the ones a previous cycle didn't
+    finish, through the pipeline. The feed requests all go out at the start (the rate limiter paces them).
+
+    Args:
+        parallel (int, optional): How many series run at the same time. Defaults to the parallel_series setting.
+
+    Returns:
+        list: One summary per series that had volumes to run, see batch.run_jobs().
+    """
+    followed_series = get_journal().followed()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(feed_workers, 1), thread_name_prefix="watch-sync") as syncer, \
+         concurrent.futures.ThreadPoolExecutor(max_workers=max(parallel, 1), thread_name_prefix="watch-update") as runner:
+        syncs = [syncer.submit(sync_series, followed) for followed in followed_series]
+        summaries = list(runner.map(update_series, followed_series, syncs))
+    return [summary for summary in summaries if summary is not None]
+
+
+def watch(interval: float = watch_interval, once: bool = False, parallel: int = parallel_series) -> None:
+    """Runs watch cycles every interval seconds until interrupted (Ctrl+C), or a single one. parallel series are
+    updated at the same time, see watch_cycle()."""
+    if preprocess_pages:
+        get_pool() # * Before the sync threads start, see preprocess.get_pool()
+    try:
+        while True:
+            cycle_start = time.monotonic()
+            summaries = watch_cycle(parallel)
+            updated = sum(1 for summary in summaries if summary["success"])
+            events.message(f"\nChecked {len(get_journal().followed())} series, updated {updated}" + (f", {len(summaries) - updated} failed" if len(summaries) > updated else ''))
+            if once:
+                break
+            time.sleep(max(interval - (time.monotonic() - cycle_start), 0))
+    except KeyboardInterrupt:
+        events.message("\nStopped watching")
+    finally:
+        shutdown()
+
+
+def main(argv: list = None) -> int:
+    parser = argparse.ArgumentParser(prog="caravel watch", description="Follow series and keep their volumes up to date.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    follow_command = commands.add_parser("follow", help="Add a series to the follow list")
+    follow_command.add_argument("mdid")
+    follow_command.add_argument("--volumes", default="all", help="Volumes to keep up to date, ie 1-5,7. Defaults to all")
+    follow_command.add_argument("--profile", default=ereader_profile, choices=sorted(PROFILE_RESOLUTIONS), help="Defaults to the ereader_profile setting")
+    unfollow_command = commands.add_parser("unfollow", help="Remove a series from the follow list")
+    unfollow_command.add_argument("mdid")
+    commands.add_parser("list", help="Show the follow list")
+    run_command = commands.add_parser("run", help="Check the followed series every watch_interval")
+    run_command.add_argument("--once", action="store_true", help="Check once and exit")
+    run_command.add_argument("--interval", type=float, default=watch_interval, help="Seconds between checks. Defaults to the watch_interval setting")
+    run_command.add_argument("--parallel", type=int, default=parallel_series, help="How many series are updated at the same time. Defaults to the parallel_series setting")
+    run_command.add_argument("--progress", choices=sorted(events.RENDERERS), default=progress, help="Defaults to the progress setting")
+    args = parser.parse_args(argv)
+
+    if args.command == "follow":
+        try:
+            volumes = "all" if args.volumes.strip().lower() == "all" else parse_volume_ranges(args.volumes)
+        except ValueError:
+            parser.error(f"can't read the volumes {args.volumes!r}")
+        info = follow(args.mdid, volumes, args.profile)
+        print(f"Following {info['series_title']}")
+    elif args.command == "unfollow":
+        if not get_journal().unfollow(args.mdid):
+            print(f"{args.mdid} is not followed")
+            return 1
+    elif args.command == "list":
+        for followed in get_journal().followed():
+            volumes = "all volumes" if followed["volumes"] == "all" else "volumes " + ",".join(str(volume) for volume in followed["volumes"])
+            print(f"{followed['title']} ({followed['mdid']}): {volumes}, {followed['profile']}, last chapter update {followed['cursor'] or 'never checked'}")
+    else:
+        events.set_mode(args.progress)
+        watch(args.interval, args.once, args.parallel)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,381 @@
+# Fake Mangadex for benchmarks and tests. Serves a made up library on local ports: the API, a few MD@Home nodes, the
+# uploads server (covers) and the MD@Home report server, with the same endpoints and formats Caravel uses. Every server can be made slow (latency per
+# request, bandwidth per response), nodes can fail and be slower than the others, and the API enforces Mangadex's
+# rate limits with 429s (each one is counted as a violation) and can send extra 429s on purpose.
+# Run it on its own to point Caravel at it by hand: "python fake_mangadex.py [config.json]" prints the URLs of the
+# servers as JSON on its first line, then serves until killed. GET /__stats on the API returns what every server saw.
+
+import io
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from PIL import Image
+
+DEFAULT_CONFIG = {
+    "series": 2,               # * Series in the library
+    "volumes": 3,              # * Volumes per series
+    "chapters": 4,             # * Chapters per volume
+    "pages": 20,               # * Pages per chapter
+    "duplicate_rate": 0.25,    # * Share of chapters also uploaded by a second, smaller group
+    "page_size": [1100, 1600], # * Width and height of the pages, data saver pages are 60% of that
+    "api_latency": 0.03,       # * Seconds added to every API request
+    "api_rate_limit": 5,       # * Requests per second, like Mangadex
+    "at_home_rate_limit": 40,  # * /at-home/server requests per minute, like Mangadex
+    "inject_429": 0.0,         # * Share of API requests answered with a 429 whatever the rate
+    "nodes": 3,                # * MD@Home nodes, chapters are spread over them in turn
+    "slow_nodes": 1,           # * How many of them are slow
+    "node_latency": 0.02,      # * Seconds before a node answers
+    "node_bandwidth": 0,       # * Bytes per second per response, 0 for no limit
+    "slow_bandwidth": 200 * 1024,
+    "fail_rate": 0.0,          # * Share of page requests answered with a 500
+    "seed": 1
+}
+
+RATE_LIMIT_SLACK = 1 # * Requests over the limit we let through, arrivals are jittered by the network
+
+
+def _jpeg(size: tuple, seed: int, quality: int) -> bytes:
+    # * Blotchy noise, compresses about as well as a scanned page
+    noise = Image.effect_noise((max(size[0] // 8, 1), max(size[1] // 8, 1)), 60 + seed % 20).resize(size, Image.BILINEAR)
+    output = io.BytesIO()
+    noise.save(output, "JPEG", quality=quality)
+    return output.getvalue()
+
+
+class Stats:
+    """What a server saw. Safe to use from the handler threads."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = {}
+        self.statuses = {}
+        self.page_latencies = [] # * Seconds from the request to the last byte, pages only
+        self.bytes = 0
+        self.rate_limited = 0
+        self.injected_429 = 0
+        self.reports = 0
+
+    def count(self, endpoint: str, status: int, sent: int = 0) -> None:
+        with self.lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+            self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+            self.bytes += sent
+
+    def as_dict(self) -> dict:
+        with self.lock:
+            return {"requests": dict(self.requests), "statuses": dict(self.statuses), "page_latencies": list(self.page_latencies),
+                    "bytes": self.bytes, "rate_limited": self.rate_limited, "injected_429": self.injected_429, "reports": self.reports}
+
+
+class _Bucket:
+    # * Same token bucket Mangadex describes, with a little slack
+    def __init__(self, rate: float, capacity: float):
+        self.rate, self.capacity, self.tokens, self.updated = rate, capacity + RATE_LIMIT_SLACK, capacity + RATE_LIMIT_SLACK, time.monotonic()
+        self.lock = threading.Lock()
+
+    def take(self) -> tuple:
+        """Returns (allowed, requests left, seconds until the next one is allowed)."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False, 0, (1 - self.tokens) / self.rate
+            self.tokens -= 1
+            return True, int(self.tokens), 0.0
+
+
+class Library:
+    """The made up series, chapters and pages, built from the config. Everything is derived from the seed."""
+
+    def __init__(self, config: dict):
+        self.config = config
+        rng = random.Random(config["seed"])
+        self.series = {}
+        self.chapters = {}
+        next_id = iter(range(1, 10 ** 9))
+        groups = [{"id": str(uuid.UUID(int=next(next_id))), "type": "scanlation_group", "attributes": {"name": name}} for name in ("Main Scans", "Side Scans")]
+        for number in range(config["series"]):
+            mdid = str(uuid.UUID(int=next(next_id)))
+            author = {"id": str(uuid.UUID(int=next(next_id))), "type": "author", "attributes": {"name": f"Author {number + 1}"}}
+            chapters = []
+            for volume in range(1, config["volumes"] + 1):
+                for index in range(config["chapters"]):
+                    chapter_number = str((volume - 1) * config["chapters"] + index + 1)
+                    uploads = [(groups[0], config["pages"])]
+                    if rng.random() < config["duplicate_rate"]:
+                        uploads.append((groups[1], max(config["pages"] - 2, 1)))
+                    for group, pages in uploads:
+                        chapter = {
+                            "id": str(uuid.UUID(int=next(next_id))),
+                            "hash": uuid.UUID(int=rng.getrandbits(128)).hex,
+                            "volume": str(volume),
+                            "chapter": chapter_number,
+                            "pages": pages,
+                            "group": group,
+                            "updatedAt": time.strftime("%Y-%m-%dT%H:%M:%S+00:00", time.gmtime(1704067200 + len(self.chapters) * 60))
+                        }
+                        chapters.append(chapter)
+                        self.chapters[chapter["id"]] = chapter
+            self.series[mdid] = {
+                "id": mdid,
+                "title": f"Benchmark Series {number + 1}",
+                "author": author,
+                "covers": [{"id": str(uuid.UUID(int=next(next_id))), "type": "cover_art", "attributes": {"volume": str(volume), "fileName": f"v{volume}.jpg"}}
+                           for volume in range(1, config["volumes"] + 1)],
+                "chapters": chapters
+            }
+
+    def manga(self, series: dict) -> dict:
+        return {
+            "id": series["id"],
+            "type": "manga",
+            "attributes": {"title": {"en": series["title"]}, "links": {}},
+            "relationships": [series["author"], dict(series["author"], type="artist"), series["covers"][0]]
+        }
+
+    def chapter(self, chapter: dict) -> dict:
+        return {
+            "id": chapter["id"],
+            "type": "chapter",
+            "attributes": {"volume": chapter["volume"], "chapter": chapter["chapter"], "title": None, "pages": chapter["pages"],
+                           "externalUrl": None, "translatedLanguage": "en", "updatedAt": chapter["updatedAt"]},
+            "relationships": [chapter["group"]]
+        }
+
+
+class FakeServer(ThreadingHTTPServer):
+    """One of the fake servers. kind is "api", "node", "uploads" or "report"."""
+
+    daemon_threads = True
+
+    def __init__(self, kind: str, config: dict, library: Library, stats: Stats, images: dict, slow: bool = False):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.kind = kind
+        self.config = config
+        self.library = library
+        self.stats = stats
+        self.latency = config["api_latency"] if kind == "api" else config["node_latency"]
+        self.bandwidth = config["slow_bandwidth"] if slow else config["node_bandwidth"]
+        self.images = images
+        self.nodes = [] # * Set on the API once the nodes are started
+        self.next_node = 0
+        self.all_stats = None # * Set on the API, for /__stats
+        self.buckets = {"api": _Bucket(config["api_rate_limit"], config["api_rate_limit"]),
+                        "at-home": _Bucket(config["at_home_rate_limit"] / 60, config["at_home_rate_limit"])}
+        self.rng = random.Random(config["seed"] + self.server_port)
+        self.rng_lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_port}"
+
+    def chance(self, rate: float) -> bool:
+        with self.rng_lock:
+            return self.rng.random() < rate
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # * Keep-alive, like the real servers
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, endpoint: str, status: int, body: bytes, content_type: str = "application/json", headers: dict = None, head: bool = False) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not head:
+            bandwidth = self.server.bandwidth if self.server.kind != "api" else 0
+            chunk_size = 16 * 1024
+            for start in range(0, len(body), chunk_size):
+                self.wfile.write(body[start:start + chunk_size])
+                if bandwidth:
+                    time.sleep(min(chunk_size, len(body) - start) / bandwidth)
+        self.server.stats.count(endpoint, status, 0 if head else len(body))
+
+    def _json(self, endpoint: str, data, status: int = 200, headers: dict = None) -> None:
+        self._send(endpoint, status, json.dumps(data).encode(), headers=headers)
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head: bool = False):
+        started = time.perf_counter()
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        path = [part for part in parts.path.split("/") if part]
+        if path == ["__stats"]:
+            return self._json("/__stats", self.server.all_stats() if self.server.all_stats else self.server.stats.as_dict())
+        time.sleep(self.server.latency)
+        if self.server.kind == "api":
+            return self._api(path, query)
+        if self.server.kind == "uploads" and len(path) == 3 and path[0] == "covers":
+            return self._send("/covers/{mdid}/{file}", 200, self.server.images["cover"], "image/jpeg", head=head)
+        if self.server.kind == "node" and path == []:
+            return self._send("/", 200, b"", "text/plain", head=head) # * Connection pre-warming
+        if self.server.kind == "node" and len(path) == 3 and path[0] in ("data", "data-saver"):
+            endpoint = f"/{path[0]}/{{hash}}/{{file}}"
+            if self.server.chance(self.server.config["fail_rate"]):
+                return self._send(endpoint, 500, b"", "text/plain", head=head)
+            self._send(endpoint, 200, self.server.images[path[0]], "image/jpeg",
+                       {"X-Cache": "HIT" if self.server.chance(0.5) else "MISS"}, head=head)
+            if not head:
+                with self.server.stats.lock:
+                    self.server.stats.page_latencies.append(time.perf_counter() - started)
+            return
+        self._send(parts.path, 404, b"", "text/plain", head=head)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.server.kind == "report" and urlsplit(self.path).path == "/report":
+            reports = json.loads(body or b"null")
+            with self.server.stats.lock:
+                self.server.stats.reports += len(reports) if isinstance(reports, list) else 1
+            return self._json("POST /report", {"result": "ok"})
+        self._send(self.path, 404, b"", "text/plain")
+
+    def _rate_limit(self, endpoint: str, kinds: list) -> bool:
+        # * Returns True if the request was answered with a 429
+        headers = {}
+        for kind in kinds:
+            allowed, remaining, wait = self.server.buckets[kind].take()
+            if kind == "at-home":
+                headers = {"X-RateLimit-Limit": str(self.server.config["at_home_rate_limit"]), "X-RateLimit-Remaining": str(remaining),
+                           "X-RateLimit-Retry-After": str(int(time.time() + 60))}
+            if not allowed:
+                with self.server.stats.lock:
+                    self.server.stats.rate_limited += 1
+                self._json(endpoint, {"result": "error", "errors": [{"status": 429, "title": "Too Many Requests"}]}, 429,
+                           {"X-RateLimit-Retry-After": str(time.time() + wait)})
+                return True
+        if self.server.chance(self.server.config["inject_429"]):
+            with self.server.stats.lock:
+                self.server.stats.injected_429 += 1
+            self._json(endpoint, {"result": "error", "errors": [{"status": 429, "title": "Too Many Requests"}]}, 429,
+                       {"X-RateLimit-Retry-After": str(time.time() + 0.5)})
+            return True
+        self._rate_headers = headers
+        return False
+
+    def _api(self, path: list, query: dict) -> None:
+        library = self.server.library
+        if path[:1] == ["at-home"]:
+            endpoint = "/at-home/server/{id}"
+            if self._rate_limit(endpoint, ["at-home", "api"]):
+                return
+            chapter = library.chapters.get(path[-1])
+            if chapter is None:
+                return self._json(endpoint, {"result": "error", "errors": [{"status": 404}]}, 404)
+            with self.server.rng_lock:
+                node = self.server.nodes[self.server.next_node % len(self.server.nodes)]
+                self.server.next_node += 1
+            files = [f"{page + 1}-{chapter['hash'][:8]}.jpg" for page in range(chapter["pages"])]
+            return self._json(endpoint, {"result": "ok", "baseUrl": node, "chapter": {"hash": chapter["hash"], "data": files, "dataSaver": files}},
+                              headers=self._rate_headers)
+
+        if path == ["manga"]:
+            endpoint = "/manga"
+        elif len(path) == 2 and path[0] == "manga":
+            endpoint = "/manga/{id}"
+        elif len(path) == 3 and path[0] == "manga" and path[2] == "feed":
+            endpoint = "/manga/{id}/feed"
+        else:
+            endpoint = "/" + "/".join(path[:1])
+        if self._rate_limit(endpoint, ["api"]):
+            return
+        limit = int(query.get("limit", ["10"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+
+        def collection(items):
+            return {"result": "ok", "response": "collection", "data": items[offset:offset + limit], "limit": limit, "offset": offset, "total": len(items)}
+
+        if endpoint == "/manga":
+            title = query.get("title", [""])[0].lower()
+            return self._json(endpoint, collection([library.manga(series) for series in library.series.values() if title in series["title"].lower()]))
+        if endpoint in ("/manga/{id}", "/manga/{id}/feed"):
+            series = library.series.get(path[1])
+            if series is None:
+                return self._json(endpoint, {"result": "error", "errors": [{"status": 404}]}, 404)
+            if endpoint == "/manga/{id}":
+                return self._json(endpoint, {"result": "ok", "response": "entity", "data": library.manga(series)})
+            since = query.get("updatedAtSince", [""])[0]
+            return self._json(endpoint, collection([library.chapter(chapter) for chapter in series["chapters"] if chapter["updatedAt"][:19] >= since]))
+        if endpoint == "/author":
+            ids = set(query.get("ids[]", []))
+            authors = {series["author"]["id"]: series["author"] for series in library.series.values()}
+            return self._json(endpoint, collection([author for author_id, author in authors.items() if author_id in ids]))
+        if endpoint == "/cover":
+            series = library.series.get(query.get("manga[]", [""])[0])
+            return self._json(endpoint, collection(series["covers"] if series else []))
+        self._json(endpoint, {"result": "error", "errors": [{"status": 404}]}, 404)
+
+
+class FakeMangadex:
+    """Starts every fake server in background threads. Use as a context manager, or call start() and stop()."""
+
+    def __init__(self, config: dict = None):
+        self.config = dict(DEFAULT_CONFIG, **(config or {}))
+        self.library = Library(self.config)
+        self.stats = {"api": Stats(), "uploads": Stats(), "nodes": Stats(), "report": Stats()}
+        size = tuple(self.config["page_size"])
+        # * The same image is served for every page, encoding one per request would make the fake the bottleneck
+        images = {"data": _jpeg(size, self.config["seed"], 85), "data-saver": _jpeg((size[0] * 6 // 10, size[1] * 6 // 10), self.config["seed"], 60),
+                  "cover": _jpeg((1000, 1500), self.config["seed"] + 1, 85)}
+        self.api = FakeServer("api", self.config, self.library, self.stats["api"], images)
+        self.uploads = FakeServer("uploads", self.config, self.library, self.stats["uploads"], images)
+        self.report = FakeServer("report", self.config, self.library, self.stats["report"], images) # * Its own host, like Mangadex
+        self.nodes = [FakeServer("node", self.config, self.library, self.stats["nodes"], images, slow=index < self.config["slow_nodes"])
+                      for index in range(self.config["nodes"])]
+        self.api.nodes = [node.url for node in self.nodes]
+        self.api.all_stats = self.all_stats
+        self.threads = []
+
+    @property
+    def urls(self) -> dict:
+        return {"api": self.api.url, "uploads": self.uploads.url, "report": self.report.url + "/report",
+                "nodes": [node.url for node in self.nodes], "series": list(self.library.series)}
+
+    def all_stats(self) -> dict:
+        return {name: stats.as_dict() for name, stats in self.stats.items()}
+
+    def start(self) -> "FakeMangadex":
+        for server in [self.api, self.uploads, self.report] + self.nodes:
+            thread = threading.Thread(target=server.serve_forever, name=f"fake-{server.kind}-{server.server_port}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def stop(self) -> None:
+        for server in [self.api, self.uploads, self.report] + self.nodes:
+            server.shutdown()
+            server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    config = {}
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], encoding="utf-8") as file:
+            config = json.load(file)
+    fake = FakeMangadex(config).start()
+    print(json.dumps(fake.urls), flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
@@ -32,9 +32,9 @@ import requests
 from pprint import pprint
 import os
 import time
-from misc_utils import printProgressBar
-from kcc_conversion import img_dir_to_epub as kcc_convert
-from push_to_calibre import push_to_calibre as calibre_push
+from caravel.misc_utils import printProgressBar
+from caravel.kcc_conversion import img_dir_to_epub as kcc_convert
+from caravel.push_to_calibre import push_to_calibre as calibre_push
 
 title = input('Enter the title of the manga: ')
 base_url = "https://api.mangadex.org"